@@ -0,0 +1,29 @@
+"""Spread block positions
+
+Revision ID: 5b8f2e6a1c43
+Revises: 3d5e9b1c7a20
+Create Date: 2026-10-18 14:03:27.519204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b8f2e6a1c43'
+down_revision = '3d5e9b1c7a20'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+
+POSITION_GAP = 1024
+
+
+def upgrade():
+    # Leave a gap before the first block too, for blocks inserted above it
+    op.execute("UPDATE `block` SET `position` = (`position` + 1) * %d" % POSITION_GAP)
+
+
+def downgrade():
+    # Spread positions keep the order of the blocks, which is all the former
+    # shifting of positions relies on
+    pass
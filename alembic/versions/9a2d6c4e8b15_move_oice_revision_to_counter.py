@@ -0,0 +1,44 @@
+"""Move the revision of the oices to a counter of their own
+
+Revision ID: 9a2d6c4e8b15
+Revises: 4f7c2a9e1b36
+Create Date: 2026-10-19 10:12:36.402917
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9a2d6c4e8b15'
+down_revision = '4f7c2a9e1b36'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('oice_revision',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('oice_id', sa.Integer(), nullable=False),
+    sa.Column('revision', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['oice_id'], ['oice.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('oice_id', name='oice_revision_oice_uq')
+    )
+    # Oices never changed are at revision 0 without a counter
+    op.execute(
+        "INSERT INTO `oice_revision` (`created_at`, `updated_at`, `oice_id`, `revision`) "
+        "SELECT NOW(), NOW(), `id`, `revision` FROM `oice` WHERE `revision` > 0"
+    )
+    op.drop_column('oice', 'revision')
+
+
+def downgrade():
+    op.add_column('oice', sa.Column('revision', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        "UPDATE `oice` JOIN `oice_revision` ON `oice_revision`.`oice_id` = `oice`.`id` "
+        "SET `oice`.`revision` = `oice_revision`.`revision`"
+    )
+    op.drop_table('oice_revision')
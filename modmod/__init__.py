@@ -26,7 +26,7 @@ from .views.util.confluent_kafka_log import (
     flush_producer,
 )
 
-from .operations.worker import init_worker
+from .operations.worker import get_safile_settings, init_worker
 log = logging.getLogger(__name__)
 
 
@@ -89,10 +89,7 @@ def main(global_config, **settings):
     config.include('modmod.views')
     config.include('modmod.views.util')
 
-    safile_settings = {
-        'file.storages': ['fs:'+settings['upload_dir']],
-        'fs.'+ settings['upload_dir'] +'.asset_path': '/upload/',
-    }
+    safile_settings = get_safile_settings(settings)
 
     pyramid_safile.init_factory(safile_settings)
 
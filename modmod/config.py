@@ -1,5 +1,7 @@
 import os
 
+from pyramid.exceptions import ConfigurationError
+
 ks_view_url = None
 
 def includeme(config):
@@ -7,6 +9,9 @@ def includeme(config):
     global oice_url
     global oice_communication_url
     global o2_output_dir
+    global o2_resize_script
+    global o2_asset_derivative_dir
+    global o2_upload_spool_dir
     global default_lang
     global upload_base_url
     global gcloud_bucket_id
@@ -25,6 +30,15 @@ def includeme(config):
         config.get_settings().get('o2.oice_communication_url', None)
     o2_output_dir = \
         config.get_settings().get('o2.output_dir', None)
+    o2_resize_script = \
+        config.get_settings().get('o2.resize_script', None)
+    o2_asset_derivative_dir = \
+        config.get_settings().get('o2.asset_derivative_dir', None) or None
+    o2_upload_spool_dir = \
+        config.get_settings().get('o2.upload_spool_dir', None) or None
+    if o2_upload_spool_dir is None or not os.path.isdir(o2_upload_spool_dir):
+        # The workers read the uploads there, whatever host they run on
+        raise ConfigurationError('o2.upload_spool_dir must be a directory shared with the workers')
     default_lang = \
         config.get_settings().get('locale.default_lang', 'en')
     upload_base_url = \
@@ -86,6 +100,21 @@ def get_o2_output_dir(oice_uuid):
         return None
 
 
+def get_o2_resize_script():
+    global o2_resize_script
+    return o2_resize_script
+
+
+def get_o2_asset_derivative_dir():
+    global o2_asset_derivative_dir
+    return o2_asset_derivative_dir
+
+
+def get_o2_upload_spool_dir():
+    global o2_upload_spool_dir
+    return o2_upload_spool_dir
+
+
 def get_default_lang():
     global default_lang
     return default_lang
@@ -36,6 +36,10 @@ from .oice import (
     Oice, OiceFactory, OiceQuery
 )
 
+from .oice_localization import (
+    OiceLocalization,
+)
+
 from .macro import (
     Macro, MacroFactory, MacroQuery
 )
@@ -119,3 +123,43 @@ from .price_tier import (
 from .user_subscription_payout import (
     UserSubscriptionPayout, UserSubscriptionPayoutQuery,
 )
+
+from .build_snapshot import (
+    BuildSnapshot, BuildSnapshotQuery,
+)
+
+from .block_tombstone import (
+    BlockTombstone, BlockTombstoneQuery,
+)
+
+from .oice_revision import (
+    OiceRevision, OiceRevisionQuery,
+)
+
+from .block_revision import (
+    add_word_counts_on_commit, bury_blocks, next_oice_revision, touch_blocks,
+)
+
+from .oice_word_count import (
+    OiceWordCount, OiceWordCountQuery,
+)
+
+from .oice_validation_index import (
+    OiceValidationIndex, OiceValidationIndexQuery,
+)
+
+from .translation_memory import (
+    TranslationMemory, TranslationMemoryQuery,
+)
+
+from .storage_blob import (
+    StorageBlob, StorageBlobQuery, handle_digest, release_handle,
+)
+
+from .word_count import (
+    add_word_count, add_word_counts, copy_word_counts, count_words, rebuild_word_counts,
+)
+
+from .catalog import (
+    Catalog, RedisCatalogVersion, catalog,
+)
@@ -14,6 +14,7 @@ from modmod.models.base import (
 from .asset_asset_type import association_table
 from .asset_type import AssetType
 from .asset_user import asset_user
+from .storage_blob import handle_digest
 from . import DBSession
 
 
@@ -38,6 +39,10 @@ class Asset(Base, BaseMixin):
     library_id = sa.Column(sa.Integer, sa.ForeignKey('library.id'), nullable=False)
     is_deleted = sa.Column(sa.Boolean, nullable=False, server_default=false())
     is_hidden = sa.Column(sa.Boolean, nullable=False, server_default=false())
+    # Filled at upload, in pixels for images and in seconds for audio
+    width = sa.Column(sa.Integer, nullable=True)
+    height = sa.Column(sa.Integer, nullable=True)
+    duration = sa.Column(sa.Float, nullable=True)
 
     __table_args__ = (
         sa.Index('asset_library_idx', 'library_id', 'is_deleted'),
@@ -122,6 +127,13 @@ class Asset(Base, BaseMixin):
     def export_filename_with_ext(self):
         return self.export_filename + self.extension
 
+    @property
+    def storage_digest(self):
+        # Identical bytes share one handle, so the descriptor identifies the stored bytes
+        if not self.storage:
+            return None
+        return handle_digest(self.storage)
+
     def import_handle(self, handle):
         if handle:
             self.storage = handle
@@ -5,6 +5,7 @@ from modmod.models.base import (
     Base,
     BaseMixin,
 )
+from .catalog import catalog
 import logging
 
 
@@ -14,7 +15,7 @@ log = logging.getLogger(__name__)
 class Attribute(Base, BaseMixin):
     __tablename__ = 'attribute'
 
-    attribute_definition = relationship("AttributeDefinition", lazy="joined")
+    attribute_definition = relationship("AttributeDefinition")
     attribute_definition_id = sa.Column(
         sa.Integer, sa.ForeignKey('attribute_definition.id'), nullable=False)
 
@@ -37,22 +38,38 @@ class Attribute(Base, BaseMixin):
 
         return acl
 
-    def serialize(self):
-        attr_def = self.attribute_definition
-        return {
+    @property
+    def definition(self):
+        """Catalog entry of the attribute definition, the definition itself is not loaded
+
+        Falls back to the definition for an attribute not flushed yet, or
+        using a definition not committed yet.
+        """
+        entry = catalog.get_definition(self.attribute_definition_id) \
+            if self.attribute_definition_id is not None else None
+        return entry or self.attribute_definition
+
+    def serialize(self, definition=True):
+        attr_def = self.definition
+        serialized = {
             'id': self.id,
             'value': self.serialized_value,
             'isAsset': attr_def.asset_type == 'reference' and attr_def.asset_type_id is not None,
             'asset': self.asset.serialize() if self.asset else {},
-            'definition': attr_def.serialize()
         }
+        # Without definition, only its id for clients that hold the definitions
+        if definition:
+            serialized['definition'] = attr_def.serialize()
+        else:
+            serialized['definitionId'] = attr_def.id
+        return serialized
 
     @property
     def serialized_value(self):
         value = self.converted_value
-        if self.attribute_definition.is_asset and value:
+        if self.definition.is_asset and value:
             return value.id
-        elif not self.attribute_definition.is_asset:
+        elif not self.definition.is_asset:
             return value
         else:
             return ''
@@ -61,9 +78,21 @@ class Attribute(Base, BaseMixin):
     def converted_value(self):
         # Convert value based on its attribute_definition type
         # FIXME: visitor for converting value?
-        if self.attribute_definition.asset_type == 'boolean':
+        if self.definition.asset_type == 'boolean':
             return self.value in {'1', 'true', True}
-        elif self.attribute_definition.is_asset:
+        elif self.definition.is_asset:
             return self.asset
         else:
             return self.value
+
+
+def _invalidate_block_attributes_cache(target, *args):
+    # Only a block already loaded can hold resolved attributes
+    block = target.__dict__.get('block')
+    if block is not None:
+        block.invalidate_attributes_cache()
+
+
+for column in (Attribute.value, Attribute.asset_id, Attribute.asset, Attribute.language,
+               Attribute.attribute_definition_id):
+    sa.event.listen(column, 'set', _invalidate_block_attributes_cache)
@@ -6,6 +6,7 @@ from modmod.models.base import (
     Base,
     BaseMixin
 )
+from .catalog import catalog
 from . import DBSession
 
 
@@ -19,9 +20,11 @@ class Block(Base, BaseMixin):
         sa.Integer, sa.ForeignKey('oice.id'), nullable=False)
     macro_id = sa.Column(
         sa.Integer, sa.ForeignKey('macro.id'), nullable=False)
-    macro = relationship("Macro", lazy="joined")
+    macro = relationship("Macro")
     oice = relationship("Oice")
     position = sa.Column(sa.Integer, nullable=False)
+    # Revision of the oice when the block last changed
+    revision = sa.Column(sa.Integer, nullable=False, server_default="0")
     attributes = relationship("Attribute",
                               cascade="all,delete",
                               backref="block",
@@ -29,6 +32,7 @@ class Block(Base, BaseMixin):
 
     __table_args__ = (
         Index('ks_position_idx', 'oice_id', 'position'),
+        Index('block_revision_idx', 'oice_id', 'revision'),
     )
 
     @property
@@ -39,67 +43,109 @@ class Block(Base, BaseMixin):
                          (Allow, user.email, 'set')]
         return acl
 
+    @property
+    def macro_entry(self):
+        """Catalog entry of the macro, the macro itself is not loaded
+
+        Falls back to the macro for a block not flushed yet, or using a macro
+        not committed yet.
+        """
+        entry = catalog.get_macro(self.macro_id) if self.macro_id is not None else None
+        return entry or self.macro
+
     def serialize(self, language=None):
         return {
             'id': self.id,
             'oiceId': self.oice_id,
             'macroId': self.macro_id,
-            'macroName': self.macro.tagname,
+            'macroName': self.macro_entry.tagname,
             'attributes': self.serialize_attributes(language)
         }
 
-    def serialize_min(self):
+    def serialize_delta(self, language=None):
         return {
             'id': self.id,
             'oiceId': self.oice_id,
             'macroId': self.macro_id,
-            'macroName': self.macro.tagname,
-            'order': self.position,
+            'macroName': self.macro_entry.tagname,
+            'position': self.position,
+            'revision': self.revision,
+            'attributes': self.serialize_attributes(language, definition=False)
         }
 
-    def serialize_attributes(self, language=None):
-        if not language:
-            language = self.oice.story.language
-        attributes = {}
-        for attribute in self.attributes:
-            if (not attribute.attribute_definition.localizable) or \
-                    (attribute.language == language) or \
-                    ((attribute.attribute_definition.attribute_name not in attributes) and \
-                    (attribute.language == self.oice.story.language)):
-                attributes[attribute.attribute_definition.attribute_name] = attribute.serialize()
-        return attributes
+    def serialize_min(self, order=None):
+        # Positions are spread apart, order is the index of the block in its oice
+        return {
+            'id': self.id,
+            'oiceId': self.oice_id,
+            'macroId': self.macro_id,
+            'macroName': self.macro_entry.tagname,
+            'order': self.position if order is None else order,
+        }
+
+    def serialize_attributes(self, language=None, definition=True):
+        return {
+            name: attribute.serialize(definition)
+            for (name, attribute) in self.get_resolved_attributes(language).items()
+        }
+
+    def get_resolved_attributes(self, language=None):
+        """Attributes of the block by name, as read in language
+
+        Non localizable attributes are the same in every language, the
+        localizable ones missing in language fall back to the story language.
+        Computed once per language until an attribute of the block changes,
+        the returned dict is shared and must not be modified.
+        """
+        return self._get_cached_attributes('resolved', language, self._resolve_attributes)
 
     def get_localizable_attributes(self, language=None):
-        if not language:
-            language = self.oice.story.language
-        attributes = {}
-        for attribute in self.attributes:
-            if attribute.attribute_definition.localizable \
-                and (attribute.language == language
-                     or (
-                        attribute.attribute_definition.attribute_name not in attributes
-                        and attribute.language == self.oice.story.language
-                    )):
-                attributes[attribute.attribute_definition.attribute_name] = attribute.value
-        return attributes
+        # A new dict every call, the translation writes into it
+        return {
+            name: attribute.value
+            for (name, attribute) in self.get_resolved_attributes(language).items()
+            if attribute.definition.localizable
+        }
 
     def get_localized_attributes(self, language=None):
+        """Converted values of get_resolved_attributes, shared in the same way"""
+        return self._get_cached_attributes('localized', language, lambda language: {
+            name: attribute.converted_value
+            for (name, attribute) in self.get_resolved_attributes(language).items()
+        })
+
+    def _resolve_attributes(self, language):
+        story_language = self.oice.story.language
         if not language:
-            language = self.oice.story.language
+            language = story_language
         attributes = {}
         for attribute in self.attributes:
+            definition = attribute.definition
             # if the attribute is not localize, use story main language as default
-            if (not attribute.attribute_definition.localizable or \
-                (attribute.language == language) or \
-                ((attribute.attribute_definition.attribute_name not in attributes) and \
-                (attribute.language == self.oice.story.language))):
-                attributes[attribute.attribute_definition.attribute_name] = attribute.converted_value
+            if not definition.localizable or \
+                    attribute.language == language or \
+                    (definition.attribute_name not in attributes and attribute.language == story_language):
+                attributes[definition.attribute_name] = attribute
         return attributes
 
+    def _get_cached_attributes(self, kind, language, compute):
+        cache = self._attributes_cache()
+        key = (kind, language or None)
+        if key not in cache:
+            cache[key] = compute(language)
+        return cache[key]
+
+    def _attributes_cache(self):
+        # Not a column, only lives as long as the instance is not refreshed
+        return self.__dict__.setdefault('_cached_attributes', {})
+
+    def invalidate_attributes_cache(self):
+        self.__dict__.pop('_cached_attributes', None)
+
     # TODO: Make a subclass for each block type
     def accept(self, visitor, *args, **kwargs):
 
-        method_name = 'visit_' + self.macro.tagname + '_block'
+        method_name = 'visit_' + self.macro_entry.tagname + '_block'
 
         method = getattr(visitor, method_name, visitor.visit_default_block)
         return method(self, *args, **kwargs)
@@ -115,3 +161,15 @@ class BlockFactory(object):
                      .filter(Block.id == key) \
                      .one()
         return block
+
+
+def _invalidate_attributes_cache(target, *args):
+    # None for a block expired after it was garbage collected
+    if target is not None:
+        target.invalidate_attributes_cache()
+
+
+for event_name in ('append', 'remove'):
+    sa.event.listen(Block.attributes, event_name, _invalidate_attributes_cache)
+for event_name in ('refresh', 'expire'):
+    sa.event.listen(Block, event_name, _invalidate_attributes_cache)
@@ -0,0 +1,238 @@
+"""Revisions of the blocks of an oice
+
+Every change to a block, its attributes or its position gives it the next
+revision of its oice, deleted blocks leave a BlockTombstone. Editors ask for
+the blocks changed since the revision they hold.
+
+The blocks changed by a transaction are collected as it goes, on flush for
+the changes made through the session, by touch_blocks and bury_blocks for
+bulk statements. They only get their revision just before the transaction
+commits, from the OiceRevision counter of their oice: the counter stays
+locked for the commit only, which gives revisions in commit order without
+making the transactions editing an oice wait for each other.
+
+The word counts of the attributes are tracked the same way and added to
+OiceWordCount once the counter is locked.
+"""
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from .attribute import Attribute
+from .block import Block
+from .block_tombstone import BlockTombstone
+from .oice_revision import OiceRevision
+from .word_count import add_word_count, add_word_counts, count_words
+from . import DBSession
+
+
+PENDING_CHANGES_KEY = 'modmod.pending_oice_changes'
+
+# Blocks given their revision by each statement
+UPDATE_CHUNK_SIZE = 500
+
+
+class PendingOiceChanges(object):
+    """Changes made to the blocks of an oice by the current transaction"""
+
+    def __init__(self):
+        self.block_ids = set()
+        self.deleted_block_ids = set()
+        # Deltas of the word counts by (oice id, language)
+        self.word_counts = {}
+
+
+def get_pending_changes(session, oice_id):
+    if isinstance(session, scoped_session):
+        session = session()
+
+    changes = session.info.setdefault(PENDING_CHANGES_KEY, {})
+    if oice_id not in changes:
+        changes[oice_id] = PendingOiceChanges()
+    return changes[oice_id]
+
+
+def next_oice_revision(session, oice_id):
+    """Increment the revision counter of an oice and return it
+
+    The counter row stays locked until the end of the transaction.
+    """
+    table = OiceRevision.__table__
+    now = datetime.utcnow()
+
+    result = session.execute(
+        table.update()
+             .where(table.c.oice_id == oice_id)
+             .values(revision=table.c.revision + 1, updated_at=now)
+    )
+    if not result.rowcount:
+        try:
+            with session.begin_nested():
+                session.execute(
+                    table.insert()
+                         .values(oice_id=oice_id, revision=1, created_at=now, updated_at=now)
+                )
+            return 1
+        except IntegrityError:
+            # Created by another transaction in the meantime
+            return next_oice_revision(session, oice_id)
+
+    return session.execute(
+        sa.select([table.c.revision]).where(table.c.oice_id == oice_id)
+    ).scalar()
+
+
+def touch_blocks(session, oice_id, block_ids):
+    """Give the next revision of an oice to blocks changed by bulk statements"""
+    if block_ids:
+        get_pending_changes(session, oice_id).block_ids.update(block_ids)
+
+
+def bury_blocks(session, oice_id, block_ids):
+    """Leave the tombstones of blocks deleted by bulk statements"""
+    if block_ids:
+        get_pending_changes(session, oice_id).deleted_block_ids.update(block_ids)
+
+
+def add_word_counts_on_commit(session, deltas):
+    """Add to the stored word counts when the transaction commits, see add_word_counts"""
+    for ((oice_id, language), delta) in deltas.items():
+        add_word_count(get_pending_changes(session, oice_id).word_counts, oice_id, language, delta)
+
+
+def apply_pending_changes(session):
+    if session.transaction.nested:
+        # Savepoints are part of the transaction, applied with it
+        return
+
+    # The last changes of the session are collected by their flush
+    session.flush()
+    changes = session.info.pop(PENDING_CHANGES_KEY, None)
+    if not changes:
+        return
+    now = datetime.utcnow()
+
+    word_counts = {}
+    # Always locked in the same order, the transactions cannot deadlock on them
+    for oice_id in sorted(changes):
+        pending = changes[oice_id]
+        revision = next_oice_revision(session, oice_id)
+
+        block_ids = sorted(pending.block_ids - pending.deleted_block_ids)
+        for start in range(0, len(block_ids), UPDATE_CHUNK_SIZE):
+            session.execute(
+                Block.__table__.update()
+                               .where(Block.id.in_(block_ids[start:start + UPDATE_CHUNK_SIZE]))
+                               .values(revision=revision)
+            )
+        for block_id in block_ids:
+            block = session.identity_map.get(identity_key(Block, block_id))
+            if block is not None:
+                set_committed_value(block, 'revision', revision)
+
+        if pending.deleted_block_ids:
+            session.execute(BlockTombstone.__table__.insert(), [
+                {
+                    'created_at': now,
+                    'updated_at': now,
+                    'oice_id': oice_id,
+                    'block_id': block_id,
+                    'revision': revision,
+                }
+                for block_id in sorted(pending.deleted_block_ids)
+            ])
+
+        word_counts.update(pending.word_counts)
+
+    add_word_counts(session, word_counts)
+
+
+def drop_pending_changes(session, transaction):
+    # Those of a transaction rolled back are dropped with it
+    if transaction._parent is None:
+        session.info.pop(PENDING_CHANGES_KEY, None)
+
+
+def get_block_oice_id(session, block):
+    if block.oice_id is not None:
+        return block.oice_id
+    if block.oice is not None:
+        return block.oice.id
+    return None
+
+
+def get_attribute_history(obj, key):
+    """Values of an attribute before and after the flush"""
+    history = sa.inspect(obj).attrs[key].history
+    before = history.deleted[0] if history.deleted else (history.unchanged[0] if history.unchanged else None)
+    after = history.added[0] if history.added else before
+    return before, after
+
+
+def count_attribute(attribute, value):
+    block = attribute.block
+    if block is None:
+        return None, 0
+    count = count_words(block.macro_entry.tagname, attribute.definition.attribute_name, value)
+    return block.oice_id, count
+
+
+def track_block_revisions(session, flush_context):
+    # After the flush, the new blocks have their id
+    for obj in session.deleted:
+        if isinstance(obj, Block) and obj.oice_id is not None:
+            get_pending_changes(session, obj.oice_id).deleted_block_ids.add(obj.id)
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Block):
+            block = obj
+        elif isinstance(obj, Attribute):
+            block = obj.block
+        else:
+            continue
+
+        if block is None or block in session.deleted:
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+
+        oice_id = get_block_oice_id(session, block)
+        if oice_id is not None:
+            get_pending_changes(session, oice_id).block_ids.add(block.id)
+
+
+def track_word_counts(session, flush_context):
+    deltas = {}
+
+    for obj in session.new:
+        if isinstance(obj, Attribute):
+            oice_id, count = count_attribute(obj, obj.value)
+            add_word_count(deltas, oice_id, obj.language, count)
+
+    for obj in session.dirty:
+        if isinstance(obj, Attribute) and session.is_modified(obj, include_collections=False):
+            (language_before, language_after) = get_attribute_history(obj, 'language')
+            (value_before, value_after) = get_attribute_history(obj, 'value')
+            oice_id, count = count_attribute(obj, value_before)
+            add_word_count(deltas, oice_id, language_before, -count)
+            oice_id, count = count_attribute(obj, value_after)
+            add_word_count(deltas, oice_id, language_after, count)
+
+    for obj in session.deleted:
+        if isinstance(obj, Attribute):
+            (language, _) = get_attribute_history(obj, 'language')
+            (value, _) = get_attribute_history(obj, 'value')
+            oice_id, count = count_attribute(obj, value)
+            add_word_count(deltas, oice_id, language, -count)
+
+    add_word_counts_on_commit(session, deltas)
+
+
+sa.event.listen(DBSession, 'after_flush', track_block_revisions)
+sa.event.listen(DBSession, 'after_flush', track_word_counts)
+sa.event.listen(DBSession, 'before_commit', apply_pending_changes)
+sa.event.listen(DBSession, 'after_transaction_end', drop_pending_changes)
@@ -0,0 +1,35 @@
+import sqlalchemy as sa
+from modmod.models.base import Base, BaseMixin
+from . import DBSession
+
+
+class BlockTombstone(Base, BaseMixin):
+    """Trace of a deleted block, for editors syncing an oice by revision"""
+    __tablename__ = 'block_tombstone'
+
+    oice_id = sa.Column(sa.Integer, sa.ForeignKey('oice.id'), nullable=False)
+    # The block row is gone, no foreign key
+    block_id = sa.Column(sa.Integer, nullable=False)
+    revision = sa.Column(sa.Integer, nullable=False)
+
+    __table_args__ = (
+        sa.Index('block_tombstone_revision_idx', 'oice_id', 'revision'),
+    )
+
+
+class BlockTombstoneQuery:
+
+    def __init__(self, session=DBSession):
+        self.session = session
+
+    @property
+    def query(self):
+        return self.session.query(BlockTombstone)
+
+    def fetch_block_ids_since(self, oice_id, revision):
+        return [
+            block_id for (block_id,) in self.session.query(BlockTombstone.block_id)
+                                            .filter(BlockTombstone.oice_id == oice_id)
+                                            .filter(BlockTombstone.revision > revision)
+                                            .order_by(BlockTombstone.revision)
+        ]
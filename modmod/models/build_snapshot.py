@@ -0,0 +1,287 @@
+from sqlalchemy.orm import joinedload, noload
+from sqlalchemy.sql.expression import false
+
+from .asset import Asset
+from .attribute import Attribute
+from .attribute_definition import AttributeDefinition
+from .block import Block
+from .character import Character
+from .macro import Macro
+from .oice import Oice
+from .record import Record
+from .story import Story
+from . import DBSession
+
+
+class AssetTypeRecord(Record):
+    __slots__ = ('id', 'folder_name', 'type_')
+
+
+class AssetRecord(Record):
+    __slots__ = ('id', 'content_type', 'storage', 'storage_digest', 'extension',
+                 'export_filename', 'asset_types', 'width', 'height', 'duration', 'updated_at')
+    visit_name = 'asset'
+
+    @property
+    def export_filename_with_ext(self):
+        return self.export_filename + self.extension
+
+
+class AttributeDefinitionRecord(Record):
+    __slots__ = ('id', 'attribute_name', 'asset_type', 'localizable')
+
+    is_asset = AttributeDefinition.is_asset
+
+
+class AttributeRecord(Record):
+    __slots__ = ('id', 'block', 'attribute_definition', 'attribute_definition_id',
+                 'value', 'asset_id', 'asset', 'language')
+    visit_name = 'attribute'
+
+    converted_value = Attribute.converted_value
+
+    @property
+    def definition(self):
+        return self.attribute_definition
+
+
+class MacroRecord(Record):
+    __slots__ = ('id', 'name', 'tagname', 'content', 'updated_at')
+
+
+class BlockRecord(Record):
+    __slots__ = ('id', 'oice', 'oice_id', 'macro', 'macro_id', 'position', 'attributes',
+                 'attributes_cache')
+
+    accept = Block.accept
+    get_resolved_attributes = Block.get_resolved_attributes
+    get_localizable_attributes = Block.get_localizable_attributes
+    get_localized_attributes = Block.get_localized_attributes
+    _resolve_attributes = Block._resolve_attributes
+    _get_cached_attributes = Block._get_cached_attributes
+
+    def _attributes_cache(self):
+        return self.attributes_cache
+
+    @property
+    def macro_entry(self):
+        return self.macro
+
+
+class StoryLocalizationRecord(Record):
+    __slots__ = ('language', 'name', 'description')
+
+
+class StoryRecord(Record):
+    __slots__ = ('id', 'name', 'description', 'language', 'localizations', 'supported_languages', 'updated_at')
+
+    has_translated_language = Story.has_translated_language
+    get_name = Story.get_name
+    get_description = Story.get_description
+
+
+class OiceRecord(Record):
+    __slots__ = ('id', 'uuid', 'filename', 'story', 'blocks', 'og_description')
+    visit_name = 'oice'
+
+
+class CharacterLocalizationRecord(Record):
+    __slots__ = ('language', 'name')
+
+
+class CharacterRecord(Record):
+    __slots__ = ('id', 'uuid', 'name', 'width', 'height', 'config', 'is_generic', 'localizations')
+
+    get_name = Character.get_name
+
+
+class BuildSnapshot(object):
+
+    def __init__(self, oice, characters):
+        self.oice = oice
+        self.characters = characters
+
+
+class BuildSnapshotQuery(object):
+    """Load everything a build of an oice needs in a fixed number of queries
+
+    The oice with its story, the blocks, their attributes, the used macros,
+    attribute definitions, assets and characters are each fetched with a
+    single query, whatever the length of the oice. The result is made of
+    records that stay usable once the session is closed.
+    """
+
+    def __init__(self, session=DBSession):
+        self.session = session
+
+    def load(self, oice_id):
+        oice = self.session.query(Oice) \
+            .options(joinedload(Oice.story).joinedload(Story.localizations)) \
+            .filter(Oice.id == oice_id) \
+            .filter(Oice.is_deleted == false()) \
+            .one()
+
+        story = self._story_record(oice.story)
+
+        block_rows = self.session.query(Block.id, Block.macro_id, Block.position) \
+            .filter(Block.oice_id == oice.id) \
+            .order_by(Block.position, Block.id) \
+            .all()
+
+        attribute_rows = self.session.query(
+                Attribute.id,
+                Attribute.block_id,
+                Attribute.attribute_definition_id,
+                Attribute.value,
+                Attribute.asset_id,
+                Attribute.language,
+            ) \
+            .join(Block, Block.id == Attribute.block_id) \
+            .filter(Block.oice_id == oice.id) \
+            .order_by(Attribute.id) \
+            .all()
+
+        macros = self._macro_records(set(row.macro_id for row in block_rows))
+        definitions = self._definition_records(set(row.attribute_definition_id for row in attribute_rows))
+        assets = self._asset_records(set(row.asset_id for row in attribute_rows if row.asset_id))
+
+        character_ids = set()
+        for row in attribute_rows:
+            definition = definitions[row.attribute_definition_id]
+            if definition.attribute_name == 'character' or definition.asset_type == 'character':
+                if row.value and row.value.isdigit():
+                    character_ids.add(int(row.value))
+        characters = self._character_records(character_ids)
+
+        attributes_by_block = {}
+        for row in attribute_rows:
+            attributes_by_block.setdefault(row.block_id, []).append(row)
+
+        blocks = []
+        for row in block_rows:
+            block = BlockRecord(
+                id=row.id,
+                oice_id=oice.id,
+                macro=macros[row.macro_id],
+                macro_id=row.macro_id,
+                position=row.position,
+                attributes=tuple(
+                    AttributeRecord(
+                        id=attribute_row.id,
+                        attribute_definition=definitions[attribute_row.attribute_definition_id],
+                        attribute_definition_id=attribute_row.attribute_definition_id,
+                        value=attribute_row.value,
+                        asset_id=attribute_row.asset_id,
+                        asset=assets.get(attribute_row.asset_id),
+                        language=attribute_row.language,
+                    )
+                    for attribute_row in attributes_by_block.get(row.id, [])
+                ),
+                attributes_cache={},
+            )
+            for attribute in block.attributes:
+                object.__setattr__(attribute, 'block', block)
+            blocks.append(block)
+
+        oice_record = OiceRecord(
+            id=oice.id,
+            uuid=oice.uuid,
+            filename=oice.filename,
+            story=story,
+            blocks=tuple(blocks),
+            og_description=oice.og_description,
+        )
+        for block in blocks:
+            object.__setattr__(block, 'oice', oice_record)
+
+        return BuildSnapshot(oice_record, characters)
+
+    def _story_record(self, story):
+        return StoryRecord(
+            id=story.id,
+            name=story.name,
+            description=story.description,
+            language=story.language,
+            localizations={
+                language: StoryLocalizationRecord(
+                    language=language,
+                    name=localization.name,
+                    description=localization.description,
+                )
+                for (language, localization) in story.localizations.items()
+            },
+            supported_languages=tuple(story.supported_languages),
+            updated_at=story.updated_at,
+        )
+
+    def _macro_records(self, macro_ids):
+        if not macro_ids:
+            return {}
+        rows = self.session.query(Macro.id, Macro.name, Macro.tagname, Macro.content, Macro.updated_at) \
+            .filter(Macro.id.in_(macro_ids)) \
+            .all()
+        return {row.id: MacroRecord(**row._asdict()) for row in rows}
+
+    def _definition_records(self, definition_ids):
+        if not definition_ids:
+            return {}
+        rows = self.session.query(
+                AttributeDefinition.id,
+                AttributeDefinition.attribute_name,
+                AttributeDefinition.asset_type,
+                AttributeDefinition.localizable,
+            ) \
+            .filter(AttributeDefinition.id.in_(definition_ids)) \
+            .all()
+        return {row.id: AttributeDefinitionRecord(**row._asdict()) for row in rows}
+
+    def _asset_records(self, asset_ids):
+        if not asset_ids:
+            return {}
+        assets = self.session.query(Asset) \
+            .options(noload(Asset.users)) \
+            .filter(Asset.id.in_(asset_ids)) \
+            .all()
+        return {
+            asset.id: AssetRecord(
+                id=asset.id,
+                content_type=asset.content_type,
+                storage=asset.storage,
+                storage_digest=asset.storage_digest,
+                extension=asset.extension,
+                export_filename=asset.export_filename,
+                asset_types=tuple(
+                    AssetTypeRecord(id=asset_type.id, folder_name=asset_type.folder_name, type_=asset_type.type_)
+                    for asset_type in asset.asset_types
+                ),
+                width=asset.width,
+                height=asset.height,
+                duration=asset.duration,
+                updated_at=asset.updated_at,
+            )
+            for asset in assets
+        }
+
+    def _character_records(self, character_ids):
+        if not character_ids:
+            return []
+        characters = self.session.query(Character) \
+            .options(noload(Character.fgimages)) \
+            .filter(Character.id.in_(character_ids)) \
+            .all()
+        return [
+            CharacterRecord(
+                id=character.id,
+                uuid=character.uuid,
+                name=character.name,
+                width=character.width,
+                height=character.height,
+                config=character.config,
+                is_generic=character.is_generic,
+                localizations={
+                    language: CharacterLocalizationRecord(language=language, name=localization.name)
+                    for (language, localization) in character.localizations.items()
+                },
+            )
+            for character in characters
+        ]
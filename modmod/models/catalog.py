@@ -0,0 +1,195 @@
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker, subqueryload
+import transaction
+
+from .attribute_definition import AttributeDefinition
+from .macro import Macro
+from .record import Record
+from . import DBSession
+
+
+class AttributeDefinitionEntry(Record):
+    __slots__ = ('id', 'macro_id', 'name', 'attribute_name', 'asset_type', 'asset_type_id',
+                 'asset_type_key', 'required', 'order', 'default_value', 'localizable', 'serialized')
+
+    is_asset = AttributeDefinition.is_asset
+
+    def serialize(self):
+        return dict(self.serialized)
+
+
+class MacroEntry(Record):
+    __slots__ = ('id', 'name', 'tagname', 'content', 'macro_type', 'is_hidden', 'updated_at',
+                 'attribute_definitions')
+
+    serialize = Macro.serialize
+
+
+class LocalCatalogVersion(object):
+    """Version of the catalog known to this process only"""
+
+    def __init__(self):
+        self.value = 0
+
+    def get(self):
+        return self.value
+
+    def increment(self):
+        self.value += 1
+
+
+class RedisCatalogVersion(object):
+    """Version of the catalog shared by every process using the same Redis"""
+
+    KEY = 'modmod:catalog:version'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get(self):
+        return int(self.connection.get(self.KEY) or 0)
+
+    def increment(self):
+        self.connection.incr(self.KEY)
+
+
+class Catalog(object):
+    """Read-only copy of the macros and attribute definitions
+
+    They only change through the admin endpoints, which call
+    invalidate_after_commit. Every process reloads its copy once it sees a
+    new version, checking the version at most every CHECK_INTERVAL seconds.
+    A key not found reloads it right away if the version changed, otherwise
+    at most every MISSING_RELOAD_INTERVAL seconds, so that unknown keys
+    cannot keep reloading it.
+    """
+
+    CHECK_INTERVAL = 5
+    MISSING_RELOAD_INTERVAL = 1
+
+    def __init__(self, version=None):
+        self.version = version or LocalCatalogVersion()
+        self._lock = threading.Lock()
+        self._loaded_version = None
+        self._checked_at = 0
+        self._loaded_at = 0
+        self._macros = None
+        self._macros_by_tagname = None
+        self._definitions = None
+
+    def configure(self, version):
+        with self._lock:
+            self.version = version
+            self._loaded_version = None
+            self._checked_at = 0
+
+    def invalidate(self):
+        self.version.increment()
+        # Reload on next lookup without waiting for the next check
+        with self._lock:
+            self._loaded_version = None
+            self._checked_at = 0
+
+    def invalidate_after_commit(self):
+        # Other processes must not reload before the change is visible to them
+        transaction.get().addAfterCommitHook(lambda success: success and self.invalidate())
+
+    def _ensure_loaded(self):
+        now = time.monotonic()
+        if self._loaded_version is not None and now - self._checked_at < self.CHECK_INTERVAL:
+            return
+
+        with self._lock:
+            version = self.version.get()
+            self._checked_at = now
+            if version != self._loaded_version:
+                self._load()
+                self._loaded_version = version
+
+    def _load(self):
+        # Own session, outside of the transaction of the request
+        session = sessionmaker(bind=DBSession.bind)()
+        try:
+            macros = session.query(Macro) \
+                .options(subqueryload(Macro.attribute_definitions)
+                         .joinedload(AttributeDefinition.asset_type_ref)) \
+                .all()
+
+            definitions_by_id = {}
+            macros_by_id = {}
+            for macro in macros:
+                definitions = tuple(
+                    AttributeDefinitionEntry(
+                        id=definition.id,
+                        macro_id=definition.macro_id,
+                        name=definition.name,
+                        attribute_name=definition.attribute_name,
+                        asset_type=definition.asset_type,
+                        asset_type_id=definition.asset_type_id,
+                        asset_type_key=definition.asset_type_key,
+                        required=definition.required,
+                        order=definition.order,
+                        default_value=definition.default_value,
+                        localizable=definition.localizable,
+                        serialized=definition.serialize(),
+                    )
+                    for definition in macro.attribute_definitions
+                )
+                for definition in definitions:
+                    definitions_by_id[definition.id] = definition
+
+                macros_by_id[macro.id] = MacroEntry(
+                    id=macro.id,
+                    name=macro.name,
+                    tagname=macro.tagname,
+                    content=macro.content,
+                    macro_type=macro.macro_type,
+                    is_hidden=macro.is_hidden,
+                    updated_at=macro.updated_at,
+                    attribute_definitions=definitions,
+                )
+
+            # Replaced at once for the readers not holding the lock
+            self._definitions = definitions_by_id
+            self._macros_by_tagname = {macro.tagname: macro for macro in macros_by_id.values()}
+            self._macros = macros_by_id
+            self._loaded_at = time.monotonic()
+        finally:
+            session.close()
+
+    def _reload_if_missing(self, mapping, key):
+        if key is None:
+            return None
+
+        # Created by another process since the last check
+        if key not in mapping():
+            with self._lock:
+                # Possibly reloaded by another thread while waiting
+                if key not in mapping():
+                    version = self.version.get()
+                    if version != self._loaded_version or \
+                            time.monotonic() - self._loaded_at >= self.MISSING_RELOAD_INTERVAL:
+                        self._load()
+                        self._loaded_version = version
+        return mapping().get(key)
+
+    def get_macro(self, macro_id):
+        self._ensure_loaded()
+        return self._reload_if_missing(lambda: self._macros, macro_id)
+
+    def get_macro_by_tagname(self, tagname):
+        self._ensure_loaded()
+        return self._reload_if_missing(lambda: self._macros_by_tagname, tagname)
+
+    def get_definition(self, definition_id):
+        self._ensure_loaded()
+        return self._reload_if_missing(lambda: self._definitions, definition_id)
+
+    def get_definitions(self, macro_id):
+        macro = self.get_macro(macro_id)
+        return macro.attribute_definitions if macro else ()
+
+
+catalog = Catalog()
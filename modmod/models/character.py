@@ -170,9 +170,9 @@ class CharacterQuery:
     def fetch_by_oice(self, oice):
         used_character_ids = set(attribute.value \
                                  for block in oice.blocks \
-                                 if block.macro.tagname == 'characterdialog' \
+                                 if block.macro_entry.tagname == 'characterdialog' \
                                  for attribute in block.attributes \
-                                 if attribute.attribute_definition.asset_type == 'character')
+                                 if attribute.definition.asset_type == 'character')
         return self.fetch_by_ids(used_character_ids)
 
     def fetch_character_list_by_user_selected(self, user):
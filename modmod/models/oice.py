@@ -50,7 +50,7 @@ class Oice(Base, BaseMixin):
     view_count = sa.Column(sa.Integer, nullable=False, server_default="0")
 
     blocks = relationship("Block",
-                          order_by="Block.position")
+                          order_by="[Block.position, Block.id]")
 
     localizations = relationship("OiceLocalization",
                                  collection_class=attribute_mapped_collection('language'),
@@ -0,0 +1,40 @@
+import sqlalchemy as sa
+from modmod.models.base import Base, BaseMixin
+from . import DBSession
+
+
+class OiceRevision(Base, BaseMixin):
+    """Last revision given to the blocks of an oice, see block_revision
+
+    Kept apart from the oice row, which it is locked independently of.
+    """
+    __tablename__ = 'oice_revision'
+
+    oice_id = sa.Column(sa.Integer, sa.ForeignKey('oice.id'), nullable=False)
+    revision = sa.Column(sa.Integer, nullable=False, server_default='0')
+
+    __table_args__ = (
+        sa.UniqueConstraint('oice_id', name='oice_revision_oice_uq'),
+    )
+
+
+class OiceRevisionQuery:
+
+    def __init__(self, session=DBSession):
+        self.session = session
+
+    def get_revision(self, oice_id):
+        revision = self.session.query(OiceRevision.revision) \
+                               .filter(OiceRevision.oice_id == oice_id) \
+                               .scalar()
+        return revision or 0
+
+    def fetch_revisions(self, oice_ids):
+        """Revision of each oice by id, 0 for an oice never changed"""
+        revisions = dict.fromkeys(oice_ids, 0)
+        if revisions:
+            revisions.update(
+                self.session.query(OiceRevision.oice_id, OiceRevision.revision)
+                            .filter(OiceRevision.oice_id.in_(revisions))
+            )
+        return revisions
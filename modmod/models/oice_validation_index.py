@@ -0,0 +1,50 @@
+import json
+
+import sqlalchemy as sa
+from modmod.models.base import Base, BaseMixin
+from . import DBSession
+
+
+class OiceValidationIndex(Base, BaseMixin):
+    """What the validator found in each block of an oice, as of a revision
+
+    entries maps the id of every block to its macro, position, errors and
+    the labels and jump targets it defines, see ScriptValidator. The index
+    is only valid for the story language and catalog it was made with.
+    """
+    __tablename__ = 'oice_validation_index'
+
+    oice_id = sa.Column(sa.Integer, sa.ForeignKey('oice.id'), nullable=False, unique=True)
+    revision = sa.Column(sa.Integer, nullable=False)
+    language = sa.Column(sa.Unicode(5), nullable=False)
+    catalog_version = sa.Column(sa.Integer, nullable=False)
+    entries_json = sa.Column('entries', sa.Text(length=2**31), nullable=False)
+
+    @property
+    def entries(self):
+        return {int(block_id): entry for (block_id, entry) in json.loads(self.entries_json).items()}
+
+    @entries.setter
+    def entries(self, entries):
+        self.entries_json = json.dumps(entries)
+
+    def is_valid_for(self, language, catalog_version):
+        return self.language == language and self.catalog_version == catalog_version
+
+
+class OiceValidationIndexQuery:
+
+    def __init__(self, session=DBSession):
+        self.session = session
+
+    @property
+    def query(self):
+        return self.session.query(OiceValidationIndex)
+
+    def fetch_by_oice_ids(self, oice_ids):
+        if not oice_ids:
+            return {}
+        return {
+            index.oice_id: index
+            for index in self.query.filter(OiceValidationIndex.oice_id.in_(oice_ids))
+        }
@@ -0,0 +1,44 @@
+import sqlalchemy as sa
+from sqlalchemy.sql.expression import false
+from modmod.models.base import Base, BaseMixin
+from .oice import Oice
+from . import DBSession
+
+
+class OiceWordCount(Base, BaseMixin):
+    """Number of words of an oice in a language, see word_count"""
+    __tablename__ = 'oice_word_count'
+
+    oice_id = sa.Column(sa.Integer, sa.ForeignKey('oice.id'), nullable=False)
+    language = sa.Column(sa.Unicode(5), nullable=False)
+    count = sa.Column(sa.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        sa.UniqueConstraint('oice_id', 'language', name='oice_word_count_language_uq'),
+    )
+
+
+class OiceWordCountQuery:
+
+    def __init__(self, session=DBSession):
+        self.session = session
+
+    @property
+    def query(self):
+        return self.session.query(OiceWordCount)
+
+    def fetch_oice_count(self, oice_id, language):
+        count = self.session.query(OiceWordCount.count) \
+                            .filter(OiceWordCount.oice_id == oice_id) \
+                            .filter(OiceWordCount.language == language) \
+                            .scalar()
+        return count or 0
+
+    def fetch_story_count(self, story_id, language):
+        count = self.session.query(sa.func.sum(OiceWordCount.count)) \
+                            .join(Oice, Oice.id == OiceWordCount.oice_id) \
+                            .filter(Oice.story_id == story_id) \
+                            .filter(Oice.is_deleted == false()) \
+                            .filter(OiceWordCount.language == language) \
+                            .scalar()
+        return int(count) if count else 0
@@ -0,0 +1,20 @@
+class Record(object):
+    """Plain immutable copy of a model, detached from any session"""
+
+    __slots__ = ()
+
+    # Suffix of the visitor method, like BaseMixin.accept
+    visit_name = None
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            object.__setattr__(self, name, kwargs.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def accept(self, visitor, *args, **kwargs):
+        return getattr(visitor, 'visit_' + self.visit_name)(self, *args, **kwargs)
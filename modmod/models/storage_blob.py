@@ -0,0 +1,127 @@
+import hashlib
+import json
+from datetime import datetime
+
+import sqlalchemy as sa
+from pyramid_safile import FileHandleStore
+
+from modmod.models.base import Base, BaseMixin
+from . import DBSession
+
+
+def handle_digest(handle):
+    """Digest of the descriptor of a handle, the same for every row holding it"""
+    descriptor = json.dumps(handle.descriptor, sort_keys=True)
+    return hashlib.sha1(descriptor.encode('utf-8')).hexdigest()
+
+
+class StorageBlob(Base, BaseMixin):
+    """File stored once for every row holding the same bytes
+
+    The bytes are shared under the same filename and when they went
+    through the same process only, blob_key tells them apart. ref_count is the number of rows holding the handle of the blob, the
+    files of a blob no longer referenced are removed by
+    modmod_collect_storage_blobs.
+    """
+    __tablename__ = 'storage_blob'
+
+    # SHA-256 of the bytes given to the store
+    digest = sa.Column(sa.Unicode(64), nullable=False)
+    # SHA-256 of the digest, the filename and the process, see blob_store.blob_key
+    blob_key = sa.Column(sa.Unicode(64), nullable=False)
+    # The descriptors are too long to be indexed, they are found by their digest
+    handle_digest = sa.Column(sa.Unicode(40), nullable=False)
+    storage = sa.Column(FileHandleStore, nullable=False)
+    size = sa.Column(sa.BigInteger, nullable=False)
+    ref_count = sa.Column(sa.Integer, nullable=False, server_default='0')
+
+    __table_args__ = (
+        sa.UniqueConstraint('blob_key', name='storage_blob_blob_key_uq'),
+        sa.UniqueConstraint('handle_digest', name='storage_blob_handle_digest_uq'),
+        sa.Index('storage_blob_ref_count_idx', 'ref_count', 'updated_at'),
+    )
+
+
+class StorageBlobQuery:
+
+    def __init__(self, session=DBSession):
+        self.session = session
+
+    @property
+    def query(self):
+        return self.session.query(StorageBlob)
+
+    def get_id_by_key(self, blob_key):
+        return self.session.query(StorageBlob.id) \
+                           .filter(StorageBlob.blob_key == blob_key) \
+                           .scalar()
+
+    # The counts are also changed by statements, the locked rows are reloaded
+
+    def lock_by_key(self, blob_key):
+        return self.query \
+                   .filter(StorageBlob.blob_key == blob_key) \
+                   .with_for_update() \
+                   .populate_existing() \
+                   .first()
+
+    def lock_by_id(self, blob_id):
+        return self.query \
+                   .filter(StorageBlob.id == blob_id) \
+                   .with_for_update() \
+                   .populate_existing() \
+                   .first()
+
+    def count_reference(self, handle, delta):
+        # A statement rather than the ORM, it also runs on flush where
+        # changes to loaded rows would not be flushed
+        self.session.execute(
+            StorageBlob.__table__.update()
+                                 .where(StorageBlob.handle_digest == handle_digest(handle))
+                                 .values(ref_count=StorageBlob.ref_count + delta,
+                                         updated_at=datetime.utcnow())
+        )
+
+    def fetch_unreferenced_ids(self, updated_before, after_id, limit):
+        return [
+            blob_id for (blob_id,) in self.session.query(StorageBlob.id)
+                                                  .filter(StorageBlob.id > after_id)
+                                                  .filter(StorageBlob.ref_count <= 0)
+                                                  .filter(StorageBlob.updated_at < updated_before)
+                                                  .order_by(StorageBlob.id)
+                                                  .limit(limit)
+        ]
+
+
+def release_handle(session, handle):
+    """Drop the reference of a row no longer holding a handle"""
+    if handle:
+        StorageBlobQuery(session).count_reference(handle, -1)
+
+
+# Keys of the FileHandleStore columns by mapped class
+_handle_keys = {}
+
+
+def get_handle_keys(cls):
+    if cls not in _handle_keys:
+        _handle_keys[cls] = [
+            prop.key for prop in sa.inspect(cls).column_attrs
+            if isinstance(prop.columns[0].type, FileHandleStore)
+        ]
+    return _handle_keys[cls]
+
+
+def release_deleted_handles(session, flush_context):
+    # The rows deleted by bulk statements release their handles themselves
+    for obj in session.deleted:
+        if isinstance(obj, StorageBlob):
+            continue
+        for key in get_handle_keys(type(obj)):
+            history = sa.inspect(obj).attrs[key].history
+            handles = history.added or history.unchanged
+            if handles:
+                release_handle(session, handles[0])
+
+
+sa.event.listen(DBSession, 'after_flush', release_deleted_handles)
@@ -123,6 +123,12 @@ class Story(Base, BaseMixin):
         elif self.has_translated_language(language):
             self.localizations[language].import_handle(handle)
 
+    def get_cover_storage(self, language=None):
+        if language == self.language or language is None:
+            return self.cover_storage
+        elif self.has_translated_language(language):
+            return self.localizations[language].cover_storage
+
     def import_title_logo_handle(self, handle):
         self.title_logo = handle
 
@@ -150,6 +156,12 @@ class Story(Base, BaseMixin):
 
         # return get_upload_base_url() + self.og_image.url if self.og_image else None
 
+    def get_og_image(self, language=None):
+        if language == self.language or language is None:
+            return self.og_image
+        elif self.has_translated_language(language):
+            return self.localizations[language].og_image
+
     def import_og_image_handle(self, handle, language=None):
         if language == self.language or language is None:
             self.og_image = handle
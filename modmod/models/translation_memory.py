@@ -0,0 +1,53 @@
+import hashlib
+
+import sqlalchemy as sa
+from modmod.models.base import Base, BaseMixin
+from . import DBSession
+
+
+# Digests looked up by each query
+FETCH_CHUNK_SIZE = 500
+
+
+class TranslationMemory(Base, BaseMixin):
+    """Machine translation of a text, reused instead of translating it again"""
+    __tablename__ = 'translation_memory'
+
+    source_language = sa.Column(sa.Unicode(5), nullable=False)
+    target_language = sa.Column(sa.Unicode(5), nullable=False)
+    # The texts are too long to be indexed, they are found by their digest
+    source_digest = sa.Column(sa.Unicode(40), nullable=False)
+    source_text = sa.Column(sa.TEXT, nullable=False)
+    translated_text = sa.Column(sa.TEXT, nullable=False)
+
+    __table_args__ = (
+        sa.UniqueConstraint('source_digest', 'source_language', 'target_language',
+                            name='translation_memory_source_uq'),
+    )
+
+    @staticmethod
+    def digest(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class TranslationMemoryQuery:
+
+    def __init__(self, session=DBSession):
+        self.session = session
+
+    @property
+    def query(self):
+        return self.session.query(TranslationMemory)
+
+    def fetch_translations(self, texts, source_language, target_language):
+        """Translations of the texts found in memory, by text"""
+        digests = sorted(set(TranslationMemory.digest(text) for text in texts))
+
+        translations = {}
+        for start in range(0, len(digests), FETCH_CHUNK_SIZE):
+            rows = self.session.query(TranslationMemory.source_text, TranslationMemory.translated_text) \
+                               .filter(TranslationMemory.source_digest.in_(digests[start:start + FETCH_CHUNK_SIZE])) \
+                               .filter(TranslationMemory.source_language == source_language) \
+                               .filter(TranslationMemory.target_language == target_language)
+            translations.update(rows)
+        return translations
@@ -0,0 +1,121 @@
+"""Word counts of the oices, by language
+
+The words read by the players are counted: the dialogs, talks and asides,
+and the questions and answers of options. They are kept per oice and
+language in OiceWordCount, so reading them never scans the attributes.
+
+Attributes written through the session are counted on flush and added
+when the transaction commits, see block_revision. Bulk statements call
+add_word_counts_on_commit or copy_word_counts themselves and
+rebuild_word_counts recomputes an oice from scratch.
+"""
+import json
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from .attribute import Attribute
+from .block import Block
+from .catalog import catalog
+from .oice_word_count import OiceWordCount
+
+
+# Attribute names counted for each macro tagname
+COUNTED_ATTRIBUTES = {
+    'characterdialog': {'dialog'},
+    'addTalk': {'talk'},
+    'aside': {'text'},
+    'option': {'question', 'answers'},
+}
+
+
+def count_words(tagname, attribute_name, value):
+    """Number of words of an attribute value, one per character"""
+    if not value or attribute_name not in COUNTED_ATTRIBUTES.get(tagname, ()):
+        return 0
+
+    if tagname == 'option' and attribute_name == 'answers':
+        try:
+            return sum(len(answer.get('content') or '') for answer in json.loads(value))
+        except (AttributeError, TypeError, ValueError):
+            return 0
+
+    return len(value)
+
+
+def add_word_count(deltas, oice_id, language, count):
+    # Non localizable attributes do not belong to any language
+    if oice_id is not None and language and count:
+        key = (oice_id, language)
+        deltas[key] = deltas.get(key, 0) + count
+
+
+def add_word_counts(session, deltas):
+    """Add to the stored counts, deltas maps (oice id, language) to a number of words"""
+    table = OiceWordCount.__table__
+    now = datetime.utcnow()
+
+    for ((oice_id, language), delta) in sorted(deltas.items()):
+        if not delta:
+            continue
+        result = session.execute(
+            table.update()
+                 .where(table.c.oice_id == oice_id)
+                 .where(table.c.language == language)
+                 .values(count=table.c.count + delta, updated_at=now)
+        )
+        if not result.rowcount:
+            session.execute(
+                table.insert()
+                     .values(oice_id=oice_id, language=language, count=delta,
+                             created_at=now, updated_at=now)
+            )
+
+
+def copy_word_counts(session, source_oice_id, oice_id):
+    """Give the counts of an oice to its copy"""
+    table = OiceWordCount.__table__
+    now = datetime.utcnow()
+
+    session.execute(
+        table.insert().from_select(
+            ['oice_id', 'language', 'count', 'created_at', 'updated_at'],
+            sa.select([
+                sa.literal(oice_id),
+                table.c.language,
+                table.c.count,
+                sa.literal(now),
+                sa.literal(now),
+            ]).where(table.c.oice_id == source_oice_id)
+        )
+    )
+
+
+def rebuild_word_counts(session, oice_id):
+    """Recompute the counts of an oice from its attributes
+
+    Changes of the oice pending in the transaction would be counted again
+    when it commits, rebuild in a transaction of its own.
+    """
+    rows = session.query(
+            Block.macro_id,
+            Attribute.attribute_definition_id,
+            Attribute.language,
+            Attribute.value,
+        ) \
+        .join(Attribute, Attribute.block_id == Block.id) \
+        .filter(Block.oice_id == oice_id) \
+        .filter(Attribute.language != None)  # noqa: E711
+
+    counts = {}
+    for row in rows:
+        macro = catalog.get_macro(row.macro_id)
+        definition = catalog.get_definition(row.attribute_definition_id)
+        count = count_words(macro.tagname, definition.attribute_name, row.value)
+        add_word_count(counts, oice_id, row.language, count)
+
+    table = OiceWordCount.__table__
+    session.execute(table.delete().where(table.c.oice_id == oice_id))
+    add_word_counts(session, counts)
+
+    return {language: count for ((_, language), count) in counts.items()}
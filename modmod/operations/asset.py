@@ -3,16 +3,48 @@ from ..models import (
     Asset,
 )
 import transaction
-import io
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
 import os
 import subprocess
 import shutil
 import tempfile
-import pyramid_safile
+import zipfile
 from modmod.exc import ValidationError
+from ..config import get_o2_resize_script, get_o2_asset_derivative_dir
+from . import script_export_default as EXPORT_DEFAULT
+from .asset_derivative import AssetDerivativeStore, is_scaled_asset
+from .blob_store import BlobStore
 
 log = logging.getLogger(__name__)
+
+# Encodes of the audio assets, o2engine plays .mp4 on mobile and .ogg elsewhere
+AUDIO_ENCODINGS = (
+    ('.mp4', ['-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart']),
+    ('.ogg', ['-c:a', 'libvorbis', '-qscale:a', '5']),
+)
+
+# ffmpeg processes run at once by a worker process
+TRANSCODE_PROCESSES = 4
+
+transcode_executor = None
+
+
+def get_transcode_executor():
+    global transcode_executor
+    if transcode_executor is None:
+        # Each thread waits for one ffmpeg process
+        transcode_executor = ThreadPoolExecutor(max_workers=TRANSCODE_PROCESSES)
+    return transcode_executor
+
+
+def encode_audio(source_path, target_path, arguments):
+    # no output file will be generated if the ffmpeg operation is unsuccessful
+    subprocess.call(['ffmpeg', '-i', source_path] + arguments + ['-vn', '-sn', '-dn', target_path])
+    return os.path.exists(target_path)
+
+
 def insert_asset(session, asset_to_insert, parent_asset):
 
     if parent_asset:
@@ -101,36 +133,132 @@ def delete_asset(session, asset):
     asset.is_deleted = True
 
 
-def audio_transcodec(original_filename, audio_bytes):
-    fp = io.BufferedRandom(io.BytesIO(audio_bytes))
-    filename = os.path.splitext(original_filename)[0]
-    tempdir = tempfile.mkdtemp()
-    temp_zip = os.path.join(tempfile.mkdtemp(), filename + '.zip')
+def read_image_size(path):
+    # Size of the first frame
+    try:
+        output = subprocess.check_output(['identify', '-format', '[%w,%h]', path + '[0]'])
+        width, height = json.loads(output.decode('utf-8'))
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None
+    return width, height
 
-    fdst = open(os.path.join(tempdir, original_filename), 'wb+')
-    shutil.copyfileobj(fp, fdst)
 
-    mp4_filename = filename + '.mp4'
-    ogg_filename = filename + '.ogg'
+def read_audio_duration(path):
+    try:
+        output = subprocess.check_output([
+            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1', path,
+        ])
+        return float(output.decode('utf-8').strip())
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None
 
-    subprocess.call(['ffmpeg', '-i', original_filename, '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart', '-vn', '-sn', '-dn', mp4_filename], cwd=tempdir)
-    subprocess.call(['ffmpeg', '-i', original_filename, '-c:a', 'libvorbis', '-qscale:a', '5', '-vn', '-sn', '-dn', ogg_filename], cwd=tempdir)
 
-    # no mp4 or ogg files will be generated if ffmpeg operations are unsuccessful
-    file_list = os.listdir(tempdir)
-    if not (mp4_filename in file_list and ogg_filename in file_list):
-        return None
+def update_asset_metadata(asset):
+    """Store the size of an image asset, or the duration of an audio asset"""
+    if not asset.storage:
+        return
 
-    subprocess.call(['zip', '-r', temp_zip, '.'], cwd=tempdir)
+    tempdir = None
+    path = asset.storage.dst
     try:
-        factory = pyramid_safile.get_factory()
-        handle = factory.create_handle(os.path.basename(temp_zip), open(temp_zip, 'rb'))
-        os.remove(temp_zip)
-    except FileNotFoundError:
-        return None
-    else:
-        subprocess.call(['unzip', '-o', handle.dst, '-d', os.path.dirname(handle.dst)])
+        if asset.content_type == 'application/zip':
+            # Transcoded audio, all the members have the same content
+            tempdir = tempfile.mkdtemp()
+            with zipfile.ZipFile(path, 'r') as zip_ref:
+                members = [info for info in zip_ref.infolist() if not info.filename.endswith('/')]
+                if not members:
+                    return
+                path = zip_ref.extract(members[0], tempdir)
+
+        if asset.asset_types[0].type_ == 'audio':
+            asset.duration = read_audio_duration(path)
+        else:
+            size = read_image_size(path)
+            if size:
+                asset.width, asset.height = size
     finally:
-        shutil.rmtree(tempdir)
+        if tempdir:
+            shutil.rmtree(tempdir)
+
+
+def create_asset_derivatives(asset):
+    # Resize the image once at upload instead of in the first build using it
+    derivative_dir = get_o2_asset_derivative_dir()
+    if not derivative_dir or not asset.storage or not is_scaled_asset(asset):
+        return
+
+    store = AssetDerivativeStore(derivative_dir, get_o2_resize_script())
+    try:
+        store.ensure(asset, EXPORT_DEFAULT.SCALE_FACTOR)
+    except Exception:
+        # Builds create the missing derivative lazily
+        log.exception('Failed to create derivative of asset %d' % asset.id)
+
+
+# Date of the members of the audio zips
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class AudioTranscode(object):
+    """Encodes of an uploaded audio file into every AUDIO_ENCODINGS
+
+    The encodes start as soon as the transcode is created and run in
+    parallel, each one an ffmpeg process of the pool shared by the worker.
+    """
+
+    def __init__(self, original_filename, source_path):
+        self.original_filename = original_filename
+        self.source_path = source_path
+        self.filename = os.path.splitext(original_filename)[0]
+        self.tempdir = tempfile.mkdtemp()
+        self.duration = None
+
+        executor = get_transcode_executor()
+        self.encodes = [
+            (os.path.join(self.tempdir, self.filename + extension),
+             executor.submit(encode_audio, source_path, os.path.join(self.tempdir, self.filename + extension),
+                             arguments))
+            for (extension, arguments) in AUDIO_ENCODINGS
+        ]
+
+    @property
+    def members(self):
+        return [(self.source_path, self.original_filename)] + \
+               [(path, os.path.basename(path)) for (path, _) in self.encodes]
+
+    def write_members(self, handle):
+        for (path, name) in self.members:
+            shutil.copyfile(path, os.path.join(os.path.dirname(handle.dst), name))
+
+    def store(self, blob_store=None):
+        """Wait for the encodes and store them, returns the handle or None
+
+        The handle is a zip of the original file and its encodes, like the
+        storage of every audio asset, and they are also written next to it.
+        It comes from blob_store, with one more reference.
+        """
+        try:
+            if not all(future.result() for (_, future) in self.encodes):
+                return None
+
+            self.duration = read_audio_duration(self.encodes[0][0])
+
+            # Audio does not compress, the members are only stored. Dated
+            # alike, identical encodes give the same zip, stored once
+            zip_path = os.path.join(self.tempdir, self.filename + '.zip')
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zip_ref:
+                for (path, name) in self.members:
+                    with open(path, 'rb') as source, \
+                            zip_ref.open(zipfile.ZipInfo(name, ZIP_DATE_TIME), 'w') as target:
+                        shutil.copyfileobj(source, target)
+
+            with open(zip_path, 'rb') as fp:
+                return (blob_store or BlobStore()).store(os.path.basename(zip_path), fp, self.write_members)
+        finally:
+            self.close()
 
-    return handle
+    def close(self):
+        for (_, future) in self.encodes:
+            future.cancel()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
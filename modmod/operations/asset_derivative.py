@@ -0,0 +1,108 @@
+import functools
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import zipfile
+from contextlib import contextmanager
+
+from . import script_export_default as EXPORT_DEFAULT
+
+
+log = logging.getLogger(__name__)
+
+
+def exported_asset_files(asset, filename):
+    """Files of an exported asset as (name, function opening it for reading)
+
+    The members of a zip asset are renamed after filename, keeping their own
+    extension.
+    """
+    if asset.content_type != 'application/zip':
+        return [(filename, functools.partial(open, asset.storage.dst, 'rb'))]
+
+    @contextmanager
+    def open_member(info):
+        with zipfile.ZipFile(asset.storage.dst, 'r') as zip_ref, zip_ref.open(info) as member:
+            yield member
+
+    asset_files = []
+    with zipfile.ZipFile(asset.storage.dst, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            if info.filename.endswith('/'):
+                continue
+            asset_filename_extension = os.path.splitext(info.filename)[1]
+            name = os.path.splitext(filename)[0] + asset_filename_extension
+            asset_files.append((name, functools.partial(open_member, info)))
+    return asset_files
+
+
+def is_scaled_asset(asset):
+    return asset.asset_types[0].folder_name.lower() in EXPORT_DEFAULT.RESIZE_FOLDERS
+
+
+class AssetDerivativeStore(object):
+    """Scaled copies of image assets shared by every build
+
+    Derivatives are kept under ``<store_dir>/<storage digest>/<scale><extension>``,
+    assets holding the same stored file share them, and replacing the file
+    of an asset or changing the scale factor gives a new entry. An entry is resized in a temporary folder and renamed in place once
+    complete, so concurrent builds never see a partial one.
+    """
+
+    DERIVATIVE_NAME = 'asset'
+
+    @staticmethod
+    def can_derive(asset):
+        # Without stored file, nothing identifies the derivatives of an asset
+        return asset.storage_digest is not None
+
+    def __init__(self, store_dir, resize_script):
+        self.store_dir = os.path.abspath(store_dir)
+        self.resize_script = resize_script
+
+    def derivative_dir(self, asset, scale_factor):
+        # The derivative files are named after the extension of the asset
+        return os.path.join(self.store_dir, asset.storage_digest,
+                            '%d%s' % (round(scale_factor * 100), asset.extension or ''))
+
+    def ensure(self, asset, scale_factor):
+        derivative_dir = self.derivative_dir(asset, scale_factor)
+        if os.path.isdir(derivative_dir):
+            return derivative_dir
+
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir, exist_ok=True)
+
+        staging_dir = tempfile.mkdtemp(prefix='.tmp', dir=self.store_dir)
+        try:
+            for (name, open_file) in exported_asset_files(asset, self.DERIVATIVE_NAME + (asset.extension or '')):
+                with open_file() as source, open(os.path.join(staging_dir, name), 'wb') as target:
+                    shutil.copyfileobj(source, target)
+
+            # A failed resize must not be kept as the derivative, the staging folder is dropped
+            subprocess.check_call([self.resize_script, staging_dir, "%d%%" % (scale_factor * 100)])
+
+            os.makedirs(os.path.dirname(derivative_dir), exist_ok=True)
+            try:
+                os.rename(staging_dir, derivative_dir)
+            except OSError:
+                # Created by a concurrent build in the meantime
+                if not os.path.isdir(derivative_dir):
+                    raise
+        finally:
+            if os.path.exists(staging_dir):
+                shutil.rmtree(staging_dir)
+
+        log.info('Created derivative of asset %d at %d%%' % (asset.id, scale_factor * 100))
+        return derivative_dir
+
+    def get_files(self, asset, filename, scale_factor):
+        """Scaled files of an asset as (name, path), named after filename like exported_asset_files"""
+        derivative_dir = self.ensure(asset, scale_factor)
+        stem = os.path.splitext(filename)[0]
+        return [
+            (stem + os.path.splitext(name)[1], os.path.join(derivative_dir, name))
+            for name in sorted(os.listdir(derivative_dir))
+        ]
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import shutil
+
+import pyramid_safile
+from sqlalchemy.exc import IntegrityError
+
+from ..models import (
+    DBSession,
+    StorageBlob,
+    StorageBlobQuery,
+    handle_digest,
+    release_handle,
+)
+
+
+log = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+
+
+def hash_file(fp):
+    """SHA-256 and size of what is left to read in fp, which is rewound"""
+    start = fp.tell()
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: fp.read(READ_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    fp.seek(start)
+    return (digest.hexdigest(), size)
+
+
+def blob_key(digest, filename, process=None):
+    """Key of the blobs of the same bytes, stored under the same filename and
+    through the same process"""
+    process_name = '%s.%s' % (process.__module__, process.__qualname__) if process else ''
+    return hashlib.sha256('\0'.join([digest, filename, process_name]).encode('utf-8')).hexdigest()
+
+
+def remove_handle_files(handle):
+    # Every handle has its own folder, which also holds the files made from it
+    folder = os.path.dirname(handle.dst)
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+
+
+class BlobStore(object):
+    """Files stored once by the SHA-256 of their bytes
+
+    Storing bytes already stored under the same filename and through the
+    same process, or referencing the handle of a stored file, returns the
+    same handle and counts one more reference instead of writing a copy.
+    Every row holding a handle of the store releases it once it no
+    longer does. Handles created before the store are not counted, they are
+    shared as they are and never collected.
+    """
+
+    def __init__(self, session=DBSession):
+        self.session = session
+
+    def store(self, filename, fp, process=None):
+        """Handle of the bytes of the seekable fp, with one more reference
+
+        process is called with the handle when the bytes are new, before
+        they are shared. Bytes are found by their blob_key before processing,
+        so it must always give the same result for the same bytes.
+        """
+        (digest, size) = hash_file(fp)
+        key = blob_key(digest, filename, process)
+
+        # Not locked by the lookup, under InnoDB locking a missing key would
+        # lock the gap around it and deadlock the concurrent new uploads
+        blob_id = StorageBlobQuery(self.session).get_id_by_key(key)
+        if blob_id:
+            blob = StorageBlobQuery(self.session).lock_by_id(blob_id)
+            # Unless collected in the meantime
+            if blob:
+                blob.ref_count += 1
+                return blob.storage
+
+        factory = pyramid_safile.get_factory()
+        handle = factory.create_handle(filename, fp)
+        if process:
+            process(handle)
+
+        try:
+            with self.session.begin_nested():
+                self.session.add(StorageBlob(
+                    digest=digest,
+                    blob_key=key,
+                    handle_digest=handle_digest(handle),
+                    storage=handle,
+                    size=size,
+                    ref_count=1,
+                ))
+        except IntegrityError:
+            # Stored by another request at the same time
+            log.info('Storage blob %s stored twice, keeping the first' % key)
+            remove_handle_files(handle)
+            blob = StorageBlobQuery(self.session).lock_by_key(key)
+            blob.ref_count += 1
+            return blob.storage
+
+        return handle
+
+    def add_reference(self, handle):
+        """Share a handle held by a row with another row"""
+        if handle:
+            StorageBlobQuery(self.session).count_reference(handle, 1)
+        return handle
+
+    def release(self, handle):
+        """Drop the reference of a row no longer holding the handle
+
+        Rows deleted through the session release theirs on flush.
+        """
+        release_handle(self.session, handle)
+
+    def replace(self, previous_handle, filename, fp, process=None):
+        handle = self.store(filename, fp, process)
+        self.release(previous_handle)
+        return handle
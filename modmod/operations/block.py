@@ -1,132 +1,200 @@
 # pylama:ignore=E711,ignore=C901
 # Need to use == None because sqlalchemy overrided the == operator
-from sqlalchemy.orm.session import make_transient
+import sqlalchemy as sa
+from sqlalchemy.orm import joinedload
 from zope.sqlalchemy import mark_changed
-from google.cloud import translate
 import logging
+from datetime import datetime
 from ..models import (
     DBSession,
     Attribute,
     Block,
+    Oice,
+    OiceWordCountQuery,
+    add_word_count,
+    add_word_counts_on_commit,
+    bury_blocks,
+    catalog,
+    copy_word_counts,
+    count_words,
+    touch_blocks,
 )
-from ..config import get_gcloud_json_path, get_gcloud_project_id
+from .translation import TranslationEngine
 
 
 log = logging.getLogger(__name__)
 
 
-def insert_block(session, block_to_insert, parent_block):
+# Distance between the positions of consecutive blocks, leaving room to
+# insert or move a block by writing its own row only
+POSITION_GAP = 1024
+
+# Blocks written by each statement of insert_blocks
+INSERT_CHUNK_SIZE = 500
+
+
+def get_position_between(lower, upper):
+    """Free position strictly between two positions, None if they are adjacent"""
+    if upper - lower < 2:
+        return None
+    return lower + (upper - lower) // 2
+
 
+def lock_block_positions(session, oice_id):
+    """Lock the oice row until the end of the transaction
+
+    Placing a block reads the positions around it, concurrent inserts and
+    moves in the same oice wait for each other instead of taking the same
+    position. The positions are then read with locking reads, which see the
+    blocks committed in the meantime.
     """
+    session.query(Oice.id).filter(Oice.id == oice_id).with_for_update().one()
+
+
+def get_block_position(session, block):
+    if block is None:
+        return None
+    return session.query(Block.position).filter(Block.id == block.id).with_for_update().scalar()
 
-        with the following custom queries, the modle objects cached by
-        sqlalchemy will not be updated even after a transaction.
 
-        To verify the changes are actually made, do another query and
-        sqlalchemy will return the group of model objects with updated
-        properties.
+def get_position_after(session, oice_id, parent_position, block_id=None):
+    """Position for a block placed after parent_position, at the top if None
 
+    block_id is the block being moved, which is ignored. The positions must
+    be locked by lock_block_positions.
     """
+    lower = parent_position if parent_position is not None else -1
 
-    if parent_block:
-        insert_index = parent_block.position+1
-    else:
-        insert_index = 0
-
-    session.query(Block) \
-           .filter(
-                Block.oice == block_to_insert.oice,
-                Block.position >= insert_index
-            ) \
-           .update(
-                {Block.position: Block.position+1}
-            )
+    query = session.query(Block.position) \
+                   .filter(
+                        Block.oice_id == oice_id,
+                        Block.position > lower
+                    )
+    if block_id is not None:
+        query = query.filter(Block.id != block_id)
+    next_block = query.order_by(Block.position, Block.id).with_for_update().first()
 
-    block_to_insert.position = insert_index
-    session.add(block_to_insert)
+    if next_block is None:
+        return max(lower, 0) + POSITION_GAP
+    return get_position_between(lower, next_block.position)
 
 
-def move_under(block, new_parent_block, session=DBSession):
+def renumber_blocks(session, oice_id):
+    """Spread the blocks of an oice POSITION_GAP apart, keeping their order
 
-    new_index = 0
-    if new_parent_block:
-        new_index = new_parent_block.position+1
+    The first block is also left POSITION_GAP after 0 to insert blocks above it.
+    """
+    rows = session.query(Block.id, Block.position) \
+                  .filter(Block.oice_id == oice_id) \
+                  .order_by(Block.position, Block.id) \
+                  .with_for_update() \
+                  .all()
 
-        if block.oice != new_parent_block.oice:
-            raise Exception('Source block and parent block are not in the same KS file')
+    mappings = [
+        {'id': row.id, 'position': position}
+        for (position, row) in zip(range(POSITION_GAP, (len(rows) + 1) * POSITION_GAP, POSITION_GAP), rows)
+        if row.position != position
+    ]
+    session.bulk_update_mappings(Block, mappings)
+    touch_blocks(session, oice_id, [mapping['id'] for mapping in mappings])
 
-    if block.position > new_index:
-        move_up(block, new_index, session)
-    elif block.position < new_index:
+    # Loaded blocks read their new position on next access
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Block) and obj.oice_id == oice_id and obj.id is not None:
+            session.expire(obj, ['position'])
 
-        # because the original block is removed, so need to -1
-        new_index -= 1
-        move_down(block, new_index, session)
+    log.info('Renumbered %d blocks of oice %d' % (len(rows), oice_id))
 
 
-def move_up(block, new_index, session=DBSession):
+def insert_block(session, block_to_insert, parent_block):
+    """Place block_to_insert after parent_block, or first without a parent
 
-    if block.position < new_index:
-        raise 'Cannot move up, direction is not correct'
-    elif block.position == new_index:
-        return
+    Only the new row is written unless the blocks around it are adjacent,
+    then the blocks of the oice are renumbered once.
+    """
+    oice_id = block_to_insert.oice.id
 
-    session.query(Block) \
-           .filter(
-                Block.oice_id == block.oice_id,
-                Block.position >= new_index,
-                Block.position < block.position
-            ) \
-           .update(
-                {Block.position: Block.position+1}
-            )
+    # The new block has no position yet, it must not be flushed while looking for one
+    with session.no_autoflush:
+        lock_block_positions(session, oice_id)
+        position = get_position_after(session, oice_id, get_block_position(session, parent_block))
+        if position is None:
+            renumber_blocks(session, oice_id)
+            position = get_position_after(session, oice_id, get_block_position(session, parent_block))
 
-    block.position = new_index
+    block_to_insert.position = position
+    session.add(block_to_insert)
 
 
-def move_down(block, new_index, session=DBSession):
+def move_under(block, new_parent_block, session=DBSession):
 
-    if block.position > new_index:
-        raise 'Cannot move down, direction is not correct'
-    elif block.position == new_index:
+    if new_parent_block:
+        if block.oice != new_parent_block.oice:
+            raise Exception('Source block and parent block are not in the same KS file')
+        if new_parent_block.id == block.id:
+            return
+
+    lock_block_positions(session, block.oice_id)
+    parent_position = get_block_position(session, new_parent_block)
+
+    # Already in place
+    lower = parent_position if parent_position is not None else -1
+    next_block = session.query(Block.id) \
+                        .filter(
+                            Block.oice_id == block.oice_id,
+                            Block.position > lower
+                        ) \
+                        .order_by(Block.position, Block.id) \
+                        .with_for_update() \
+                        .first()
+    if next_block and next_block.id == block.id:
         return
 
-    session.query(Block) \
-           .filter(
-                Block.oice_id == block.oice_id,
-                Block.position > block.position,
-                Block.position <= new_index
-            ) \
-           .update(
-                {Block.position: Block.position-1}
-            )
+    position = get_position_after(session, block.oice_id, parent_position, block_id=block.id)
+    if position is None:
+        renumber_blocks(session, block.oice_id)
+        parent_position = get_block_position(session, new_parent_block)
+        position = get_position_after(session, block.oice_id, parent_position, block_id=block.id)
 
-    block.position = new_index
+    block.position = position
 
 
 def delete_block(session, block):
+    # The following blocks keep their position, gaps do not change the order
+    session.delete(block)
 
-    session.query(Block) \
-           .filter(
-                Block.oice_id == block.oice_id,
-                Block.position > block.position
-            ) \
-           .update(
-                {Block.position: Block.position-1}
-            )
 
-    DBSession.delete(block)
+def delete_blocks(session, oice_id, block_ids):
+    """Delete blocks of an oice with bulk statements, leaving their tombstones
+
+    The word counts are not updated, rebuild_word_counts once done.
+    """
+    if not block_ids:
+        return
+
+    attribute_table = Attribute.__table__
+    block_table = Block.__table__
+
+    session.execute(attribute_table.delete().where(attribute_table.c.block_id.in_(block_ids)))
+    session.execute(
+        block_table.delete()
+                   .where(block_table.c.oice_id == oice_id)
+                   .where(block_table.c.id.in_(block_ids))
+    )
+    bury_blocks(session, oice_id, block_ids)
+    mark_changed(session())
 
 
 def update_block_attributes(session, block, attributes, language):
     attr_defs = {}
-    for attr_def in block.macro.attribute_definitions:
+    # Through macro_entry, a new block has no macro_id before it is flushed
+    for attr_def in block.macro_entry.attribute_definitions:
         attr_defs[attr_def.attribute_name] = attr_def
 
     attrs = {}
     for a in block.attributes:
-        if not a.attribute_definition.localizable or a.language == language:
-            attrs[a.attribute_definition.attribute_name] = a
+        if not a.definition.localizable or a.language == language:
+            attrs[a.definition.attribute_name] = a
 
     for (key, value) in attributes.items():
         if key == "parentId" or key == "macroId" or key not in attr_defs:
@@ -152,14 +220,14 @@ def update_block_attributes(session, block, attributes, language):
                 attr_language = language
             if is_asset:
                 attr_to_be_add = Attribute(
-                    attribute_definition=attr_defs[key],
+                    attribute_definition_id=attr_defs[key].id,
                     block=block,
                     asset_id=value,
                     language=attr_language
                 )
             else:
                 attr_to_be_add = Attribute(
-                    attribute_definition=attr_defs[key],
+                    attribute_definition_id=attr_defs[key].id,
                     block=block,
                     value=value,
                     language=attr_language
@@ -167,150 +235,329 @@ def update_block_attributes(session, block, attributes, language):
             session.add(attr_to_be_add)
 
 
+def load_blocks(session, block_ids, refresh=False):
+    """Blocks by id with everything needed to update and serialize them
+
+    The blocks come with their attributes, oice and story in one query, the
+    macros and attribute definitions are read from the catalog. refresh overwrites the blocks already loaded in
+    the session, to read changes made by bulk statements.
+    """
+    if not block_ids:
+        return {}
+
+    query = session.query(Block) \
+                   .options(joinedload(Block.oice).joinedload(Oice.story)) \
+                   .filter(Block.id.in_(block_ids))
+    if refresh:
+        query = query.populate_existing()
+
+    return {block.id: block for block in query}
+
+
+def update_blocks_attributes(session, changes):
+    """Apply attribute changes to many blocks with bulk statements
+
+    changes is a list of (block, attributes, language) like the arguments of
+    update_block_attributes, which has the same effect for a single block.
+    The blocks must be loaded again with load_blocks(refresh=True) to see the
+    changes.
+    """
+    now = datetime.utcnow()
+    attr_defs_by_macro = {}
+    updates = {}
+    inserts = {}
+    updated_attributes = {}
+
+    for (block, attributes, language) in changes:
+        if block.macro_id not in attr_defs_by_macro:
+            attr_defs_by_macro[block.macro_id] = {
+                attr_def.attribute_name: attr_def
+                for attr_def in catalog.get_definitions(block.macro_id)
+            }
+        attr_defs = attr_defs_by_macro[block.macro_id]
+
+        attrs = {}
+        for a in block.attributes:
+            if not a.definition.localizable or a.language == language:
+                attrs[a.definition.attribute_name] = a
+
+        for (key, value) in attributes.items():
+            if key == "parentId" or key == "macroId" or key not in attr_defs:
+                # not a valid attribute name
+                continue
+
+            is_asset = attr_defs[key].is_asset
+
+            if key in attrs:
+                # modfiy existing attribute, skipping unchanged values like a flush
+                attr = attrs[key]
+                column = 'asset_id' if is_asset and value else 'value'
+                if getattr(attr, column) == value and attr.id not in updates:
+                    continue
+                mapping = updates.setdefault(attr.id, {'id': attr.id, 'updated_at': now})
+                updated_attributes[attr.id] = (block, attr)
+                mapping[column] = value
+
+            else:
+                # make new attribute, the last value wins if a block is given twice
+                attr_language = language if attr_defs[key].localizable else None
+                mapping = {
+                    'created_at': now,
+                    'updated_at': now,
+                    'attribute_definition_id': attr_defs[key].id,
+                    'block_id': block.id,
+                    'language': attr_language,
+                }
+                if is_asset:
+                    mapping['asset_id'] = value
+                else:
+                    mapping['value'] = value
+                inserts[(block.id, key, attr_language)] = mapping
+
+    if updates:
+        session.bulk_update_mappings(Attribute, list(updates.values()))
+    if inserts:
+        session.bulk_insert_mappings(Attribute, list(inserts.values()))
+    if updates or inserts:
+        changed_block_ids = set(mapping['block_id'] for mapping in inserts.values())
+        changed_block_ids.update(updated_attributes[attr_id][0].id for attr_id in updates)
+        blocks_by_oice = {}
+        for (block, _, _) in changes:
+            if block.id in changed_block_ids:
+                # Bulk statements do not emit the attribute events
+                block.invalidate_attributes_cache()
+                blocks_by_oice.setdefault(block.oice_id, set()).add(block.id)
+        for (oice_id, block_ids) in blocks_by_oice.items():
+            touch_blocks(session, oice_id, block_ids)
+
+        # Bulk statements are not counted on flush either
+        word_counts = {}
+        for (attr_id, mapping) in updates.items():
+            (block, attr) = updated_attributes[attr_id]
+            if 'value' in mapping:
+                tagname = block.macro_entry.tagname
+                name = attr.definition.attribute_name
+                count = count_words(tagname, name, mapping['value']) - count_words(tagname, name, attr.value)
+                add_word_count(word_counts, block.oice_id, attr.language, count)
+        blocks_by_id = {block.id: block for (block, _, _) in changes}
+        for ((block_id, key, attr_language), mapping) in inserts.items():
+            block = blocks_by_id[block_id]
+            count = count_words(block.macro_entry.tagname, key, mapping.get('value'))
+            add_word_count(word_counts, block.oice_id, attr_language, count)
+        add_word_counts_on_commit(session, word_counts)
+
+        mark_changed(session())
+
+
 def ensure_block_default_value(session, block, language):
 
     attrs = {}
     for a in block.attributes:
-        attrs[a.attribute_definition.attribute_name] = a
+        attrs[a.definition.attribute_name] = a
 
-    for attr_def in block.macro.attribute_definitions:
+    for attr_def in block.macro_entry.attribute_definitions:
         attr_language = language if attr_def.localizable else None
         if attr_def.default_value is not None and attr_def.attribute_name not in attrs:
             attr = Attribute(
-                attribute_definition=attr_def,
+                attribute_definition_id=attr_def.id,
                 block=block,
                 value=attr_def.default_value,
                 language=attr_language)
             session.add(attr)
 
 
-def fork_blocks(DBSession, oice, blocks):
-    batch_attributes = []
-    block_id_pos_dict = {}
-    new_block_pos_dict = {}
-    new_oice_id = oice.id
-    for block in blocks:
-        attributes = block.attributes
-        DBSession.expunge(block)
-        block_id_pos_dict[block.id] = block.position
-        block.id = None
-        block.oice_id = new_oice_id
-        make_transient(block)
-        if attributes:
-            batch_attributes.extend(attributes)
-            # handle attributes in batch for better performance
-            # fork_attributes(DBSession, block, attributes)
-    batch_attributes.sort(key=lambda attr: attr.asset_id is None)
-    session = DBSession()
-    session.bulk_save_objects(blocks)
-    new_blocks = DBSession.query(Block) \
-        .filter(Block.oice_id == new_oice_id) \
-        .order_by(Block.position) \
-        .all()
-    for block in new_blocks:
-        new_block_pos_dict[block.position] = block
-    for attr in batch_attributes:
-        make_transient(attr)
-        attr.id = None
-        attr.block_id = new_block_pos_dict[block_id_pos_dict[attr.block_id]].id
-    session.bulk_save_objects(batch_attributes)
-    mark_changed(session)
-    return blocks
+def make_attribute_values(macro_id, attributes):
+    """Attribute values of a new block, by attribute name
+
+    The default values of the macro overwritten by attributes, the same as
+    ensure_block_default_value followed by update_block_attributes. Each
+    value is a (definition, value, asset_id) tuple.
+    """
+    attr_defs = {}
+    for attr_def in catalog.get_definitions(macro_id):
+        attr_defs[attr_def.attribute_name] = attr_def
+
+    values = {}
+    for attr_def in attr_defs.values():
+        if attr_def.default_value is not None:
+            values[attr_def.attribute_name] = (attr_def, attr_def.default_value, None)
+
+    for (key, value) in attributes.items():
+        if key == "parentId" or key == "macroId" or key not in attr_defs:
+            # not a valid attribute name
+            continue
+
+        attr_def = attr_defs[key]
+        if key in values:
+            (_, old_value, old_asset_id) = values[key]
+            if attr_def.is_asset and value:
+                values[key] = (attr_def, old_value, value)
+            else:
+                values[key] = (attr_def, value, old_asset_id)
+        elif attr_def.is_asset:
+            values[key] = (attr_def, None, value)
+        else:
+            values[key] = (attr_def, value, None)
+
+    return values
+
+
+def insert_blocks(session, oice_id, blocks, language, position, progress=None):
+    """Append blocks to an oice with bulk statements
+
+    blocks is a list of (macro_id, attributes), the first one placed at
+    position and the next ones POSITION_GAP apart. They are written
+    INSERT_CHUNK_SIZE blocks at a time, the ids of a chunk being read back by
+    position, and progress is called with the number of blocks written after
+    each chunk. Returns the ids of the new blocks.
+    """
+    if not blocks:
+        return []
+
+    now = datetime.utcnow()
+    block_table = Block.__table__
+    attribute_table = Attribute.__table__
+
+    block_ids = []
+    word_counts = {}
+    for start in range(0, len(blocks), INSERT_CHUNK_SIZE):
+        chunk = blocks[start:start + INSERT_CHUNK_SIZE]
+        first_position = position + start * POSITION_GAP
+        last_position = first_position + (len(chunk) - 1) * POSITION_GAP
+
+        session.execute(block_table.insert(), [
+            {
+                'created_at': now,
+                'updated_at': now,
+                'oice_id': oice_id,
+                'macro_id': macro_id,
+                'position': first_position + index * POSITION_GAP,
+            }
+            for (index, (macro_id, _)) in enumerate(chunk)
+        ])
+
+        ids_by_position = dict(session.execute(
+            sa.select([block_table.c.position, block_table.c.id])
+              .where(block_table.c.oice_id == oice_id)
+              .where(block_table.c.position.between(first_position, last_position))
+        ).fetchall())
+
+        attribute_rows = []
+        for (index, (macro_id, attributes)) in enumerate(chunk):
+            block_id = ids_by_position[first_position + index * POSITION_GAP]
+            block_ids.append(block_id)
+            tagname = catalog.get_macro(macro_id).tagname
+
+            for (key, (attr_def, value, asset_id)) in make_attribute_values(macro_id, attributes).items():
+                attr_language = language if attr_def.localizable else None
+                attribute_rows.append({
+                    'created_at': now,
+                    'updated_at': now,
+                    'attribute_definition_id': attr_def.id,
+                    'block_id': block_id,
+                    'value': value,
+                    'asset_id': asset_id,
+                    'language': attr_language,
+                })
+                add_word_count(word_counts, oice_id, attr_language, count_words(tagname, key, value))
+
+        if attribute_rows:
+            session.execute(attribute_table.insert(), attribute_rows)
+
+        if progress:
+            progress(start + len(chunk), len(blocks))
+
+    # Bulk statements are not tracked on flush
+    touch_blocks(session, oice_id, block_ids)
+    add_word_counts_on_commit(session, word_counts)
+    mark_changed(session())
+    return block_ids
+
+
+def fork_blocks(session, oice, source_oice_id):
+    """Copy the blocks and attributes of an oice into another one
+
+    Both are copied by INSERT ... SELECT statements, so no block or attribute
+    is loaded whatever the length of the oice. The copies are numbered
+    POSITION_GAP apart in the (position, id) order of the source, which the
+    attributes number their source block by again to find its copy. Returns
+    the number of blocks.
+    """
+    now = datetime.utcnow()
+    block_table = Block.__table__
+    attribute_table = Attribute.__table__
+
+    def numbered_positions(alias):
+        # Unique even where the source blocks share a position
+        return (sa.func.row_number().over(order_by=(alias.c.position, alias.c.id)) * POSITION_GAP) \
+            .label('position')
+
+    source_block = block_table.alias('source_block')
+    result = session.execute(
+        block_table.insert().from_select(
+            ['created_at', 'updated_at', 'oice_id', 'macro_id', 'position'],
+            sa.select([
+                sa.literal(now),
+                sa.literal(now),
+                sa.literal(oice.id),
+                source_block.c.macro_id,
+                numbered_positions(source_block),
+            ]).where(source_block.c.oice_id == source_oice_id)
+        )
+    )
+
+    source_position = sa.select([source_block.c.id, numbered_positions(source_block)]) \
+                        .where(source_block.c.oice_id == source_oice_id) \
+                        .alias('source_position')
+    new_block = block_table.alias('new_block')
+    session.execute(
+        attribute_table.insert().from_select(
+            ['created_at', 'updated_at', 'attribute_definition_id', 'block_id', 'value', 'asset_id', 'language'],
+            sa.select([
+                sa.literal(now),
+                sa.literal(now),
+                attribute_table.c.attribute_definition_id,
+                new_block.c.id,
+                attribute_table.c.value,
+                attribute_table.c.asset_id,
+                attribute_table.c.language,
+            ]).select_from(
+                attribute_table
+                .join(source_position, source_position.c.id == attribute_table.c.block_id)
+                .join(new_block, sa.and_(new_block.c.oice_id == oice.id,
+                                         new_block.c.position == source_position.c.position))
+            )
+        )
+    )
+
+    copy_word_counts(session, source_oice_id, oice.id)
+    mark_changed(session())
+    return result.rowcount
 
 
 def count_words_of_block(session, story=None, oice=None, language=None):
     if not language:
         language = story.language if story else oice.language
 
-    sql = '''
-    SELECT
-        SUM(BlockWordCount.count)
-    FROM (
-             SELECT
-                A.`block_id` AS block_id,
-                CHAR_LENGTH(
-                    IF(
-                        M.`tagname` = 'option' AND AD.`attribute_name` = 'answers',
-                        REPLACE(TRIM(LEADING '["' FROM TRIM(TRAILING '"]' FROM A.`value`->'$[*].content')), '", "', ''),
-                        A.`value`
-                    )
-                ) AS count
-            FROM
-                `attribute` AS A
-                JOIN `attribute_definition` AD
-                    ON A.`attribute_definition_id` = AD.`id`
-                JOIN `macro` M
-                    ON AD.`macro_id` = M.`id`
-            WHERE
-                (
-                    A.`language` = '%s'
-                    AND
-                    (
-                        (
-                            M.`tagname` = 'characterdialog'
-                            AND AD.`attribute_name` = 'dialog'
-                        )
-                        OR (
-                            M.`tagname` = 'addTalk'
-                            AND AD.`attribute_name` = 'talk'
-                        )
-                        OR (
-                            M.`tagname` = 'aside'
-                            AND AD.`attribute_name` = 'text'
-                        )
-                        OR (
-                            M.`tagname` = 'option'
-                            AND (
-                                AD.`attribute_name` = 'question'
-                                OR AD.`attribute_name` = 'answers'
-                            )
-                        )
-                    )
-                )
-        ) BlockWordCount
-        JOIN `block` B
-            ON BlockWordCount.`block_id` = B.`id`
-    ''' % language
-
     if story:
-        sql += '''
-            JOIN `oice` O
-                ON B.`oice_id` = O.`id`
-        WHERE O.`story_id` = %d
-            AND O.`is_deleted` = false
-        ''' % story.id
-
+        return OiceWordCountQuery(session).fetch_story_count(story.id, language)
     elif oice:
-        sql += '''WHERE B.`oice_id` = %d''' % oice.id
-
+        return OiceWordCountQuery(session).fetch_oice_count(oice.id, language)
     else:
         return 0
 
-    result = session.execute(sql).scalar()
-
-    return int(result) if result else 0
-
 
 def translate_block(block, target_language, source_language=None, client=None):
-    if client is None:
-        client = translate.Client.from_service_account_json(
-            get_gcloud_json_path()
-        )
     target_language_code = target_language.lower()[:2]
 
     if not source_language:
         source_language = block.oice.story.language
 
-    attr_list = []
-    text_list = []
     attrs = block.get_localizable_attributes(source_language)
-    for name, a in attrs.items():
-        attr_list.append((attrs, name))
-        text_list.append(a)
-
-    if text_list:
-        results = client.translate(text_list, target_language=target_language_code, model=translate.NMT)
-        for (r, (a, name)) in zip(results, attr_list):
-            a[name] = r['translatedText']
+    if attrs:
+        engine = TranslationEngine(source_language, target_language_code, client)
+        for name, a in attrs.items():
+            engine.request_item(a, attrs, name)
+        engine.run()
 
         update_block_attributes(DBSession, block, attrs, target_language)
@@ -0,0 +1,119 @@
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__name__)
+
+
+# Bump this whenever the layout of the cache or the build key changes
+CACHE_VERSION = 1
+
+OPERATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TEMPLATE_DIR = os.path.abspath(os.path.join(OPERATIONS_DIR, '..', 'res', 'novelspherejs', 'template_project'))
+
+# Modules whose content ends up in the generated project
+GENERATOR_MODULES = [
+    'character_script_data.py',
+    'script_export_default.py',
+    'script_export_serializer.py',
+    'script_exporter.py',
+]
+
+_template_version = None
+
+
+def get_template_version():
+    """Digest of the NovelSphere template and the code generating the scripts
+
+    It is computed once per process, a deploy changing either of them makes
+    every cached build stale.
+    """
+    global _template_version
+    if _template_version is None:
+        digest = hashlib.sha1(str(CACHE_VERSION).encode('utf-8'))
+
+        paths = [os.path.join(OPERATIONS_DIR, name) for name in GENERATOR_MODULES]
+        for root, dirs, files in os.walk(TEMPLATE_DIR):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(files))
+
+        for path in paths:
+            digest.update(os.path.relpath(path, OPERATIONS_DIR).encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+
+        _template_version = digest.hexdigest()
+    return _template_version
+
+
+class BuildCache(object):
+    """Keep the last build of every oice under ``o2.build_cache_dir``
+
+    For each oice the cache holds the built artifact together with the key it
+    was built from, and the NovelSphere project used as the input of the build
+    script. An unchanged oice is restored by copying the artifact, a changed
+    one reuses the project so that only the changed files are regenerated.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+
+    def oice_dir(self, oice):
+        return os.path.join(self.cache_dir, 'oice', oice.uuid)
+
+    def project_dir(self, oice):
+        return os.path.join(self.oice_dir(oice), 'project')
+
+    def artifact_dir(self, oice):
+        return os.path.join(self.oice_dir(oice), 'build')
+
+    def _key_path(self, oice):
+        return os.path.join(self.oice_dir(oice), 'build.key')
+
+    @contextmanager
+    def lock(self, oice):
+        # Builds of the same oice share the cached project, serialize them
+        oice_dir = self.oice_dir(oice)
+        if not os.path.exists(oice_dir):
+            os.makedirs(oice_dir, exist_ok=True)
+
+        with open(os.path.join(oice_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_artifact(self, oice, key):
+        try:
+            with open(self._key_path(oice), 'r') as f:
+                cached_key = f.read().strip()
+        except FileNotFoundError:
+            return None
+
+        artifact_dir = self.artifact_dir(oice)
+        if cached_key != key or not os.path.isdir(artifact_dir):
+            return None
+
+        return artifact_dir
+
+    def store_artifact(self, oice, key, build_path):
+        artifact_dir = self.artifact_dir(oice)
+        key_path = self._key_path(oice)
+
+        # Drop the key first so that a half written artifact is never served
+        if os.path.exists(key_path):
+            os.remove(key_path)
+        if os.path.exists(artifact_dir):
+            shutil.rmtree(artifact_dir)
+
+        shutil.copytree(build_path, artifact_dir)
+
+        with open(key_path, 'w') as f:
+            f.write(key)
+
@@ -0,0 +1,207 @@
+import logging
+from datetime import datetime
+
+from redis import WatchError
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
+from rq.registry import StartedJobRegistry
+
+
+log = logging.getLogger(__name__)
+
+
+# Lanes in priority order, each one is a queue served by its own workers
+LANE_PREVIEW = 'preview'
+LANE_PUBLISH = 'publish'
+LANE_BATCH = 'batch'
+LANE_EXPORT = 'export'
+LANE_AUDIO = 'audio'
+LANES = (LANE_PREVIEW, LANE_PUBLISH, LANE_BATCH, LANE_EXPORT, LANE_AUDIO)
+
+JOB_TIMEOUT = 600
+
+# Status of a job removed from its queue before it ran
+CANCELED = 'canceled'
+
+# Number of recent waiting times kept per lane
+WAIT_SAMPLES = 100
+
+BATCH_TTL = 7 * 24 * 3600
+
+
+class BuildScheduler(object):
+    """Enqueue jobs in priority lanes
+
+    A job enqueued with a key replaces the job of the same key still waiting
+    in its lane, so repeated builds of an oice run once with the latest
+    arguments. Jobs enqueued with a batch id can be followed and cancelled
+    together.
+
+    How many jobs of a lane run at once is the number of workers serving it,
+    see the ``worker.concurrency.<lane>`` settings of modmod_worker.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.queues = {}
+
+    def queue(self, lane):
+        if lane not in LANES:
+            raise ValueError('Unknown lane: %s' % lane)
+        if lane not in self.queues:
+            self.queues[lane] = Queue(lane, connection=self.connection)
+        return self.queues[lane]
+
+    def pending_key(self, lane):
+        return 'modmod:build:pending:' + lane
+
+    def wait_key(self, lane):
+        return 'modmod:build:wait:' + lane
+
+    def batch_key(self, batch_id):
+        return 'modmod:build:batch:' + batch_id
+
+    def enqueue(self, lane, func, args, key=None, batch_id=None):
+        queue = self.queue(lane)
+
+        job = Job.create(func, args=args, timeout=JOB_TIMEOUT, connection=self.connection)
+        job.meta['key'] = key
+        job.meta['batch_id'] = batch_id
+
+        if key is None:
+            queue.enqueue_job(job)
+        else:
+            previous_id = self._enqueue_pending(queue, job, key)
+            if previous_id:
+                self.cancel_job(previous_id.decode('utf-8'))
+
+        if batch_id:
+            pipeline = self.connection.pipeline()
+            pipeline.sadd(self.batch_key(batch_id), job.id)
+            pipeline.expire(self.batch_key(batch_id), BATCH_TTL)
+            pipeline.execute()
+
+        return job
+
+    def _enqueue_pending(self, queue, job, key):
+        """Enqueue job as the pending job of key, returns the id of the job it replaced
+
+        Concurrent enqueues of the same key are retried until each one has
+        replaced the job enqueued before it, so a single one stays pending.
+        """
+        pending_key = self.pending_key(queue.name)
+        with self.connection.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(pending_key)
+                    previous_id = pipeline.hget(pending_key, key)
+                    pipeline.multi()
+                    queue.enqueue_job(job, pipeline=pipeline)
+                    pipeline.hset(pending_key, key, job.id)
+                    pipeline.execute()
+                    return previous_id
+                except WatchError:
+                    continue
+
+    def cancel_job(self, job_id):
+        try:
+            job = Job.fetch(job_id, connection=self.connection)
+        except NoSuchJobError:
+            return False
+
+        if job.get_status() != JobStatus.QUEUED:
+            return False
+
+        job.cancel()
+        job.set_status(CANCELED)
+        # Kept as long as its batch to report it, then dropped
+        job.cleanup(BATCH_TTL)
+        log.info('Cancelled job %s of lane %s' % (job.id, job.origin))
+        return True
+
+    def job_started(self, job):
+        """Called by a worker before running job"""
+        lane = job.origin
+        if lane not in LANES:
+            return
+
+        key = job.meta.get('key')
+        if key is not None:
+            pending_key = self.pending_key(lane)
+            with self.connection.pipeline() as pipeline:
+                pipeline.watch(pending_key)
+                pending_id = pipeline.hget(pending_key, key)
+                pipeline.multi()
+                if pending_id and pending_id.decode('utf-8') == job.id:
+                    pipeline.hdel(pending_key, key)
+                try:
+                    pipeline.execute()
+                except WatchError:
+                    # Replaced by a newer job in the meantime
+                    pass
+
+        if job.enqueued_at:
+            wait = (datetime.utcnow() - job.enqueued_at).total_seconds()
+            pipeline = self.connection.pipeline()
+            pipeline.lpush(self.wait_key(lane), wait)
+            pipeline.ltrim(self.wait_key(lane), 0, WAIT_SAMPLES - 1)
+            pipeline.execute()
+
+    def lane_stats(self, lane):
+        queue = self.queue(lane)
+
+        oldest_wait = 0
+        job_ids = queue.get_job_ids(0, 1)
+        if job_ids:
+            try:
+                job = Job.fetch(job_ids[0], connection=self.connection)
+                if job.enqueued_at:
+                    oldest_wait = (datetime.utcnow() - job.enqueued_at).total_seconds()
+            except NoSuchJobError:
+                pass
+
+        waits = [float(wait) for wait in self.connection.lrange(self.wait_key(lane), 0, -1)]
+
+        return {
+            'lane': lane,
+            'queued': queue.count,
+            'running': StartedJobRegistry(lane, connection=self.connection).count,
+            'oldestWait': oldest_wait,
+            'averageWait': sum(waits) / len(waits) if waits else 0,
+        }
+
+    def stats(self):
+        return [self.lane_stats(lane) for lane in LANES]
+
+    def batch_job_ids(self, batch_id):
+        return [job_id.decode('utf-8') for job_id in self.connection.smembers(self.batch_key(batch_id))]
+
+    def batch_progress(self, batch_id):
+        counts = {}
+        job_ids = self.batch_job_ids(batch_id)
+        for job_id in job_ids:
+            try:
+                status = Job.fetch(job_id, connection=self.connection).get_status()
+            except NoSuchJobError:
+                # Result expired, only kept for finished jobs
+                status = JobStatus.FINISHED
+            counts[status] = counts.get(status, 0) + 1
+
+        return {
+            'batchId': batch_id,
+            'jobCount': len(job_ids),
+            'queued': counts.get(JobStatus.QUEUED, 0),
+            'started': counts.get(JobStatus.STARTED, 0),
+            'finished': counts.get(JobStatus.FINISHED, 0),
+            'failed': counts.get(JobStatus.FAILED, 0),
+            'canceled': counts.get(CANCELED, 0),
+        }
+
+    def cancel_batch(self, batch_id):
+        """Cancel the jobs of a batch still waiting in their queue"""
+        canceled = 0
+        for job_id in self.batch_job_ids(batch_id):
+            if self.cancel_job(job_id):
+                canceled += 1
+        return canceled
@@ -0,0 +1,240 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+log = logging.getLogger(__name__)
+
+
+# Files served with a fresh copy on every visit
+NO_CACHE_FILES = {
+    'script.js',
+}
+
+
+def md5_b64(filename, blocksize=65536):
+    hash = hashlib.md5()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            hash.update(block)
+    return base64.standard_b64encode(hash.digest()).decode('ascii')
+
+
+class UploadReport(object):
+
+    def __init__(self):
+        self.uploaded_files = 0
+        self.uploaded_bytes = 0
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+        self._lock = threading.Lock()
+
+    def add_uploaded(self, size):
+        with self._lock:
+            self.uploaded_files += 1
+            self.uploaded_bytes += size
+
+    def add_skipped(self, size):
+        with self._lock:
+            self.skipped_files += 1
+            self.skipped_bytes += size
+
+    def serialize(self):
+        return {
+            'uploadedFiles': self.uploaded_files,
+            'uploadedBytes': self.uploaded_bytes,
+            'skippedFiles': self.skipped_files,
+            'skippedBytes': self.skipped_bytes,
+        }
+
+    def __str__(self):
+        return 'uploaded %d files (%d bytes), skipped %d files (%d bytes)' % (
+            self.uploaded_files, self.uploaded_bytes, self.skipped_files, self.skipped_bytes)
+
+
+class LocalBlob(object):
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.cache_control = None
+
+    @property
+    def path(self):
+        return os.path.join(self.bucket.root, *self.name.split('/'))
+
+    @property
+    def md5_hash(self):
+        return md5_b64(self.path) if os.path.isfile(self.path) else None
+
+    def upload_from_filename(self, filename):
+        folder = os.path.dirname(self.path)
+        os.makedirs(folder, exist_ok=True)
+        # Never seen partially written, as for a bucket
+        (fd, temp_path) = tempfile.mkstemp(prefix='.tmp', dir=folder)
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, temp_path)
+            os.replace(temp_path, self.path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def patch(self):
+        pass
+
+
+class LocalBucket(object):
+    """Folder standing in for a bucket of ``google.cloud.storage``
+
+    Serves to upload the builds without Google Cloud, in development or to
+    try BuildUploader.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def list_blobs(self, prefix=''):
+        for (dir_, _, file_names) in os.walk(self.root):
+            for file_name in file_names:
+                if file_name.startswith('.tmp'):
+                    continue
+                rel_path = os.path.relpath(os.path.join(dir_, file_name), self.root)
+                name = '/'.join(rel_path.split(os.sep))
+                if name.startswith(prefix):
+                    yield LocalBlob(self, name)
+
+
+class BuildUploader(object):
+    """Upload a build folder under ``prefix`` of a bucket
+
+    The md5 of every uploaded file is remembered in a manifest, files whose
+    digest did not change since the last upload are skipped without asking the
+    bucket. Without a manifest on disk the digests are seeded by listing the
+    blobs under the prefix once.
+
+    bucket_factory returns a new bucket, called once by every thread using
+    one since the clients of ``google.cloud.storage`` are not thread safe.
+    The bucket only needs ``blob(name)`` and ``list_blobs(prefix=...)``, the
+    blobs ``md5_hash``, ``cache_control``, ``upload_from_filename(filename=...)``
+    and ``patch()``, as provided by ``google.cloud.storage`` or LocalBucket.
+    """
+
+    def __init__(self, bucket_factory, prefix, manifest_path=None,
+                 max_workers=8, max_retries=3, retry_delay=1.0):
+        self.bucket_factory = bucket_factory
+        self._local = threading.local()
+        self.prefix = prefix.rstrip('/')
+        self.manifest_path = manifest_path
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+    @property
+    def bucket(self):
+        """Bucket of the calling thread"""
+        bucket = getattr(self._local, 'bucket', None)
+        if bucket is None:
+            bucket = self._local.bucket = self.bucket_factory()
+        return bucket
+
+    def load_manifest(self):
+        if self.manifest_path and os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    manifest = json.load(f)
+                if manifest.get('prefix') == self.prefix:
+                    return manifest['files']
+            except (OSError, ValueError, KeyError):
+                log.warning('Ignore unreadable upload manifest: ' + self.manifest_path)
+
+        return {
+            blob.name: blob.md5_hash
+            for blob in self.bucket.list_blobs(prefix=self.prefix + '/')
+            if blob.md5_hash
+        }
+
+    def save_manifest(self, files):
+        if not self.manifest_path:
+            return
+
+        manifest_dir = os.path.dirname(self.manifest_path)
+        if manifest_dir and not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir, exist_ok=True)
+
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'prefix': self.prefix, 'files': files}, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def blob_path(self, rel_path):
+        return '/'.join([self.prefix] + rel_path.split(os.sep))
+
+    def upload_file(self, blob_path, file_path):
+        file_name = os.path.basename(file_path)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                blob = self.bucket.blob(blob_path)
+                log.info('Uploading to google cloud: ' + file_name)
+                blob.upload_from_filename(filename=file_path)
+                if file_name in NO_CACHE_FILES:
+                    blob.cache_control = "private, max-age=0, no-transform"
+                    blob.patch()
+                return
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_delay * (2 ** attempt)
+                log.warning('Upload of %s failed, retry in %.1fs' % (blob_path, delay), exc_info=True)
+                time.sleep(delay)
+
+    def upload(self, build_path):
+        """Upload the files of build_path, returning an UploadReport"""
+        report = UploadReport()
+        files = self.load_manifest()
+        uploaded = {}
+        pending = []
+
+        for dir_, _, file_names in os.walk(build_path):
+            for file_name in file_names:
+                file_path = os.path.join(dir_, file_name)
+                blob_path = self.blob_path(os.path.relpath(file_path, build_path))
+                size = os.path.getsize(file_path)
+                md5_hash = md5_b64(file_path)
+
+                if files.get(blob_path) == md5_hash:
+                    log.info('Identical md5 exist on gcloud, skipping: ' + file_name)
+                    report.add_skipped(size)
+                else:
+                    pending.append((blob_path, file_path, size, md5_hash))
+
+        def upload(item):
+            blob_path, file_path, size, md5_hash = item
+            self.upload_file(blob_path, file_path)
+            # Each key is written by a single task
+            uploaded[blob_path] = md5_hash
+            report.add_uploaded(size)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # Consume the results to raise the first failure
+                for _ in executor.map(upload, pending):
+                    pass
+        finally:
+            # Keep the progress of a partial upload for the next attempt
+            files.update(uploaded)
+            self.save_manifest(files)
+
+        log.info('Upload of %s: %s' % (self.prefix, report))
+        return report
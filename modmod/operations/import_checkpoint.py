@@ -0,0 +1,58 @@
+CHECKPOINT_TTL = 7 * 24 * 3600
+
+
+class ImportCheckpoint(object):
+    """Progress of a script import committed chunk by chunk
+
+    Before a chunk is committed, its first block id and the line following it
+    are saved as pending, and the ids of its blocks are added to the list of
+    the import. A job run again for the same import skips the lines already
+    committed, a pending chunk counting as committed once its first block
+    exists. The list of ids is what a failed import deletes.
+    """
+
+    def __init__(self, connection, job_id):
+        self.connection = connection
+        self.key = 'modmod:import:' + job_id
+        self.block_ids_key = self.key + ':blocks'
+
+    def get_line(self, block_exists):
+        """First line of the script not committed yet"""
+        values = self.connection.hgetall(self.key)
+        line = int(values.get(b'line', 1))
+        pending_line = int(values.get(b'pending_line', line))
+        if pending_line != line and block_exists(int(values[b'pending_block_id'])):
+            return pending_line
+        return line
+
+    def begin_chunk(self, next_line, block_ids):
+        if not block_ids:
+            return
+        pipeline = self.connection.pipeline()
+        pipeline.hset(self.key, 'pending_line', next_line)
+        pipeline.hset(self.key, 'pending_block_id', block_ids[0])
+        pipeline.rpush(self.block_ids_key, *block_ids)
+        pipeline.expire(self.key, CHECKPOINT_TTL)
+        pipeline.expire(self.block_ids_key, CHECKPOINT_TTL)
+        pipeline.execute()
+
+    def commit_chunk(self, next_line):
+        pipeline = self.connection.pipeline()
+        pipeline.hset(self.key, 'line', next_line)
+        pipeline.hset(self.key, 'pending_line', next_line)
+        pipeline.expire(self.key, CHECKPOINT_TTL)
+        pipeline.execute()
+
+    def iter_block_ids(self, count):
+        """Ids of the blocks inserted by the import, count at a time"""
+        start = 0
+        while True:
+            block_ids = [int(block_id) for block_id in
+                         self.connection.lrange(self.block_ids_key, start, start + count - 1)]
+            if not block_ids:
+                return
+            yield block_ids
+            start += count
+
+    def clear(self):
+        self.connection.delete(self.key, self.block_ids_key)
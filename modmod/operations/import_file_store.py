@@ -1,17 +1,18 @@
 # pylama:ignore=W0401
 import os
-import pyramid_safile
 from ..models import (
     DBSession,
     AssetType,
     Asset
 )
+from .blob_store import BlobStore
 from .script_import_model import *
 
 
 class TemporaryAsset:
 
-    def __init__(self, path, asset_types):
+    def __init__(self, session, path, asset_types):
+        self.session = session
         self.path = path
         self.asset_types = asset_types
         self._asset = None
@@ -34,8 +35,8 @@ class TemporaryAsset:
         if self._asset is not None:
             return self._asset
         name = os.path.basename(self.path)
-        factory = pyramid_safile.get_factory()
-        handle = factory.create_handle(name, open(self.path, 'rb'))
+        with open(self.path, 'rb') as fp:
+            handle = BlobStore(self.session).store(name, fp)
         self._asset = Asset.from_handle(
             handle,
             asset_types=self.asset_types
@@ -79,7 +80,7 @@ class ImportFileStore(object):
             if asset_type is None:
                 continue
 
-            temp_asset = TemporaryAsset(path, [asset_type])
+            temp_asset = TemporaryAsset(self.session, path, [asset_type])
             self._assets.append(temp_asset)
         return self._assets
 
@@ -1,5 +1,15 @@
 SCREEN_SIZE = 1080
 
+# Images are exported at half of the size they are uploaded
+SCALE_FACTOR = 0.5
+
+# Project folders of the images scaled by the scale factor
+RESIZE_FOLDERS = [
+    'bgimage',
+    'fgimage',
+    'image',
+]
+
 NOVELSPHERE_CONFIG = {
     'title': 'oice',
     'scWidth': SCREEN_SIZE,
@@ -1,9 +1,11 @@
 # FIXME
 # pylama:ignore=C901
 
+import io
 import json
 import logging
 import re
+from collections import OrderedDict
 
 from urllib.parse import quote
 from modmod.exc import ValidationError
@@ -17,8 +19,9 @@ log = logging.getLogger(__name__)
 
 class ScriptVisitor(object):
 
-    def __init__(self, story=None, characters=[], scale_factor=1):
+    def __init__(self, story=None, characters=[], scale_factor=1, manifest=None):
         self.story = story
+        self.manifest = manifest
         self._character_id_map = {
             character.id: character
             for character in characters
@@ -39,6 +42,11 @@ class ScriptVisitor(object):
         self.prev_character_name = None
         self.prev_message_block = None
 
+    def _get_localized_attributes(self, block, language=None):
+        if self.manifest is not None:
+            return self.manifest.get_localized_attributes(block, language)
+        return block.get_localized_attributes(language)
+
     def _post_oice_action(self, action):
         if not action or type(action) is not dict:
             return ''
@@ -55,24 +63,26 @@ class ScriptVisitor(object):
             self.prev_character_name = None
 
         for attr in block.attributes:
+            # Adjust a copy of the value, the attribute itself is left untouched
+            value = attr.value
             if attr.attribute_definition.attribute_name in script_export_default.SCALABLE_ATTRIBUTES:
-                if attr.value:
-                    attr.value = int(float(attr.value) * self.scale_factor)
+                if value:
+                    value = str(int(float(value) * self.scale_factor))
 
             if block.macro.tagname in script_export_default.FADING_AUDIO_MACROS \
                     and attr.attribute_definition.attribute_name == 'time' \
-                    and int(attr.value) < 1:
+                    and int(value) < 1:
                 # Fading time cannot less than 1
-                attr.value = 1
+                value = '1'
 
             if attr.attribute_definition.asset_type == 'reference':
                 if attr.attribute_definition.attribute_name == 'rule' or not attr.asset_id:
                     continue
 
-            elif not attr.value:
+            elif not value:
                 continue
 
-            script += ' ' + attr.accept(self, language)
+            script += ' ' + self.visit_attribute(attr, language, value)
 
         return script + '\n'
 
@@ -91,20 +101,23 @@ class ScriptVisitor(object):
         for attr in block.attributes:
             if attr.attribute_definition.attribute_name == 'storage' and attr.asset_id:
                 # Get item size and calculate the position on screen
-                image_path = attr.asset.storage.url
-
-                try:
-                    command = [
-                        "identify",
-                        "-format",
-                        '[%w,%h]',
-                        str(image_path)
-                    ]
-                    output_size = check_output(command).decode("utf-8")
-                except CalledProcessError as e:
-                    raise 'Error occurs when getting item image size: %s' % str(e)
-
-                width, height = json.loads(output_size)
+                width, height = attr.asset.width, attr.asset.height
+                if width is None or height is None:
+                    # Asset uploaded before the size was stored
+                    image_path = attr.asset.storage.url
+
+                    try:
+                        command = [
+                            "identify",
+                            "-format",
+                            '[%w,%h]',
+                            str(image_path)
+                        ]
+                        output_size = check_output(command).decode("utf-8")
+                    except CalledProcessError as e:
+                        raise 'Error occurs when getting item image size: %s' % str(e)
+
+                    width, height = json.loads(output_size)
                 screen_size = script_export_default.SCREEN_SIZE
                 top = int(self.scale_factor * (screen_size - height) / 2)
                 left = int(self.scale_factor * (screen_size - width) / 2)
@@ -118,14 +131,14 @@ class ScriptVisitor(object):
         return script
 
     def visit_jump_block(self, block, language):
-        attrs = block.get_localized_attributes()
+        attrs = self._get_localized_attributes(block)
         return '@oice_jump storage="%(storage)s" target="%(target)s"\n' % {
             'storage': language + '.ks',
             'target': attrs['target'],
         }
 
     def visit_label_block(self, block, language):
-        attrs = block.get_localized_attributes(language)
+        attrs = self._get_localized_attributes(block, language)
 
         # TODO: Temporal fix on missing character name after jump
         # Reset scene
@@ -144,12 +157,12 @@ class ScriptVisitor(object):
         return value + "\n@optionclear"
 
     def visit_comment_block(self, block, language):
-        attrs = block.get_localized_attributes(language)
+        attrs = self._get_localized_attributes(block, language)
 
         return ';' + attrs.get('text', '') + '\n'
 
     def visit_option_block(self, block, language):
-        attrs = block.get_localized_attributes(language)
+        attrs = self._get_localized_attributes(block, language)
         question = attrs.get('question', '')
         script = '@optionstart\n' + ScriptVisitor.print_dialog_text(question) + '\n'
 
@@ -201,7 +214,7 @@ class ScriptVisitor(object):
         return ('@autowait' if self.autoplay else '@l') + "\n"
 
     def visit_addTalk_block(self, block, language):
-        attrs = block.get_localized_attributes(language)
+        attrs = self._get_localized_attributes(block, language)
         script = ''
 
         # dialogs
@@ -216,7 +229,7 @@ class ScriptVisitor(object):
         return script
 
     def visit_aside_block(self, block, language):
-        attrs = block.get_localized_attributes(language)
+        attrs = self._get_localized_attributes(block, language)
 
         name = attrs.get('name', None)
         if self.prev_character_name != name:
@@ -245,7 +258,7 @@ class ScriptVisitor(object):
         return script
 
     def visit_characterdialog_block(self, block, language):
-        attrs = block.get_localized_attributes(language)
+        attrs = self._get_localized_attributes(block, language)
         script = ''
 
         character = self._character_id_map.get(int(attrs['character']), None)
@@ -441,32 +454,35 @@ class ScriptVisitor(object):
         self.prev_character = None
         return character_script_data.fg_exit[position] + "\n"
 
-    def visit_attribute(self, attribute, language):
+    def visit_attribute(self, attribute, language, value=None):
         name = attribute.attribute_definition.attribute_name
+        if value is None:
+            value = attribute.value
         if attribute.attribute_definition.asset_type == "reference":
             value = attribute.asset.accept(self)
         elif attribute.attribute_definition.asset_type == "color":
-            value = re.sub('^#', '0x', attribute.value)
+            value = re.sub('^#', '0x', value)
         elif attribute.attribute_definition.localizable:
-            value = attribute.block.get_localizable_attributes(language)[name]
-        else:
-            value = attribute.value
+            value = attribute.block.get_resolved_attributes(language)[name].value
         return name + '="' + value + '"'
 
     def visit_asset(self, asset):
         return asset.export_filename
 
-    def visit_oice(self, oice, language):
+    def write_oice(self, oice, language, output):
+        """Write the script of the oice block by block to output, a text file"""
         self._initialize_oice()
-        script = ''
 
         for block in oice.blocks:
-            script += ";#%(id)s\n%(block)s\n" % ({
+            output.write(";#%(id)s\n%(block)s\n" % ({
                 "id": block.id,
                 "block": block.accept(self, language)
-            })
+            }))
 
-        return script
+    def visit_oice(self, oice, language):
+        output = io.StringIO()
+        self.write_oice(oice, language, output)
+        return output.getvalue()
 
     def visit_story(self, story):
         scripts = {}
@@ -488,63 +504,52 @@ class CharacterScene(object):
         return self.character.id
 
 
-class CharacterVisitor(object):
-
-    def visit_default_block(self, block):
-        return set(
-            [attribute.value for attribute
-             in block.attributes
-             if attribute.attribute_definition.attribute_name == 'character']
-        )
-
-    def visit_oice(self, oice):
-        used_characters = set()
-        for block in oice.blocks:
-            character_set = block.accept(self)
-            used_characters.update(character_set)
-        return used_characters
+class BuildManifest(object):
+    """Everything a build uses from an oice, collected in a single pass over its blocks
 
+    It holds the used macros and assets in order of first use, the ids of
+    the used characters as found in the attributes, and the localized
+    attributes of every block in each language.
+    """
 
-class AssetVisitor(object):
+    def __init__(self, oice, languages):
+        self.default_language = oice.story.language
+        self.languages = list(languages)
+        if self.default_language not in self.languages:
+            self.languages.append(self.default_language)
 
-    def visit_default_block(self, block):
-        return set(
-            [attr.asset for attr
-             in block.attributes
-             if attr.asset is not None]
-        )
+        self.macros = OrderedDict()
+        self.assets = OrderedDict()
+        self.character_ids = set()
+        self._localized_attributes = {language: {} for language in self.languages}
 
-    def visit_asset(self, asset):
-        return asset.export_filename_with_ext
-
-    def visit_oice(self, oice):
-        used_assets = set()
         for block in oice.blocks:
-            asset_set = block.accept(self)
-            used_assets.update(asset_set)
-        return used_assets
-
-    def visit_story(self, story):
-        used_assets = set()
-        for oice in story.oice:
-            used_assets.update(oice.accept(self))
-        return used_assets
-
+            self.macros.setdefault(block.macro.id, block.macro)
+            self._collect_block(block)
 
-class MacroVisitor(object):
+    def _collect_block(self, block):
+        for attribute in block.attributes:
+            if attribute.asset is not None:
+                self.assets.setdefault(attribute.asset.id, attribute.asset)
+            if attribute.attribute_definition.attribute_name == 'character':
+                self.character_ids.add(attribute.value)
 
-    def visit_default_block(self, block):
-        return set([block.macro])
+        # Resolved once per language and kept by the block for the visitors
+        for language in self.languages:
+            self._localized_attributes[language][block.id] = block.get_localized_attributes(language)
 
-    def visit_oice(self, oice):
-        used_macro = set()
-        for block in oice.blocks:
-            macro_set = block.accept(self)
-            used_macro.update(macro_set)
-        return used_macro
+    @property
+    def used_macros(self):
+        return list(self.macros.values())
 
-    def visit_story(self, story):
-        used_macro = set()
-        for oice in story.oice:
-            used_macro.update(oice.accept(self))
-        return used_macro
+    @property
+    def used_assets(self):
+        return list(self.assets.values())
+
+    def get_localized_attributes(self, block, language=None):
+        if not language:
+            language = self.default_language
+        try:
+            return self._localized_attributes[language][block.id]
+        except KeyError:
+            return block.get_localized_attributes(language)
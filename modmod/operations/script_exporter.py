@@ -1,18 +1,23 @@
+import filecmp
 import fileinput
+import functools
+import hashlib
+import io
 import json
 import logging
 import os
 import shutil
 import subprocess
 import tempfile
+import time
 import zipfile
 
 from . import script_export_default as EXPORT_DEFAULT
+from .asset_derivative import exported_asset_files, is_scaled_asset
+from .build_cache import TEMPLATE_DIR, get_template_version
 from .script_export_serializer import (
+    BuildManifest,
     ScriptVisitor,
-    AssetVisitor,
-    MacroVisitor,
-    CharacterVisitor,
 )
 from ..models import (
     DBSession,
@@ -37,11 +42,19 @@ PROJECT_FOLDERS = [
 ]
 
 
-RESIZE_FOLDERS = [
-    'bgimage',
-    'fgimage',
-    'image',
-]
+# Extensions of media files not worth deflating
+STORED_EXTENSIONS = {
+    '.gif',
+    '.jpeg',
+    '.jpg',
+    '.m4a',
+    '.mp3',
+    '.mp4',
+    '.ogg',
+    '.png',
+}
+
+RESIZE_FOLDERS = EXPORT_DEFAULT.RESIZE_FOLDERS
 
 
 # Utils
@@ -57,6 +70,67 @@ def subpath(base_path, folder_name):
     return None
 
 
+def write_content(content):
+    return lambda file: file.write(content)
+
+
+def write_if_changed(path, write):
+    # Keep the mtime of unchanged files in a reused project
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        write(file)
+
+    if os.path.exists(path) and filecmp.cmp(temp_path, path, shallow=False):
+        os.remove(temp_path)
+        return False
+
+    os.replace(temp_path, path)
+    return True
+
+
+class ProjectZipWriter(object):
+    """Write the files of a project into a zip archive
+
+    Media already compressed by their format are stored as is, other files
+    are deflated.
+    """
+
+    def __init__(self, zip_file):
+        self.zip_file = zip_file
+        self.directories = set()
+
+    def compress_type(self, arcname):
+        if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def add_directory(self, arcname):
+        arcname = arcname.rstrip('/') + '/'
+        if arcname in self.directories or arcname == './':
+            return
+        self.directories.add(arcname)
+        info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+        info.external_attr = (0o40755 << 16) | 0x10
+        self.zip_file.writestr(info, b'')
+
+    def write_file(self, path, arcname):
+        self.zip_file.write(path, arcname, compress_type=self.compress_type(arcname))
+
+    def write_text(self, write, arcname):
+        info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+        info.compress_type = self.compress_type(arcname)
+        info.external_attr = 0o644 << 16
+        with io.TextIOWrapper(self.zip_file.open(info, 'w'), encoding='utf-8') as text:
+            write(text)
+
+    def write_stream(self, fileobj, arcname):
+        info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+        info.compress_type = self.compress_type(arcname)
+        info.external_attr = 0o644 << 16
+        with self.zip_file.open(info, 'w') as target:
+            shutil.copyfileobj(fileobj, target)
+
+
 # Generate path for [move] tag
 def get_move_path_string(x, y):
     return '({}, {}, 255)'.format(x, y)
@@ -67,7 +141,8 @@ class ScriptExporter(object):
                  oice_view_url=None, oice_communication_url=None,
                  og_image_button_url=None, og_image_origin_url=None,
                  characters=[],
-                 scale_factor=0.5):
+                 scale_factor=EXPORT_DEFAULT.SCALE_FACTOR,
+                 derivative_store=None):
         self.resize_script = resize_script
         self.export_path = export_path
         self.oice = oice
@@ -77,30 +152,70 @@ class ScriptExporter(object):
         self.is_offline = oice_communication_url is None
         self.og_image_button_url = og_image_button_url
         self.og_image_origin_url = og_image_origin_url
-        self.script_visitor = ScriptVisitor(oice.story, characters, scale_factor)
+        self.characters = characters
         self.scale_factor = scale_factor
+        self.derivative_store = derivative_store
 
-        self._used_assets = None
-        self._used_macro = None
-        self._used_character_ids = None
+        self._manifest = None
+        self._script_visitor = None
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = BuildManifest(self.oice, self.oice.story.supported_languages)
+        return self._manifest
+
+    @property
+    def script_visitor(self):
+        if self._script_visitor is None:
+            self._script_visitor = ScriptVisitor(self.oice.story, self.characters, self.scale_factor,
+                                                 manifest=self.manifest)
+        return self._script_visitor
 
     @property
     def used_macro(self):
-        if self._used_macro is None:
-            self._used_macro = self.oice.accept(MacroVisitor())
-        return self._used_macro
+        return self.manifest.used_macros
 
     @property
     def used_assets(self):
-        if self._used_assets is None:
-            self._used_assets = self.oice.accept(AssetVisitor())
-        return self._used_assets
+        return self.manifest.used_assets
 
     @property
     def used_character_ids(self):
-        if self._used_character_ids is None:
-            self._used_character_ids = self.oice.accept(CharacterVisitor())
-        return self._used_character_ids
+        return self.manifest.character_ids
+
+    def fingerprint_items(self):
+        story = self.oice.story
+
+        yield ('template', get_template_version())
+        yield ('resize', self.resize_script, self.scale_factor)
+        yield ('oice', self.oice.id, self.title, self.is_offline, self.oice_communication_url)
+        yield ('story', story.language, story.supported_languages)
+
+        for block in self.oice.blocks:
+            yield ('block', block.id, block.macro_id, sorted(
+                (attr.attribute_definition_id, attr.language or '', attr.value, attr.asset_id)
+                for attr in block.attributes
+            ))
+
+        for macro in sorted(self.used_macro, key=lambda m: m.id):
+            yield ('macro', macro.id, macro.tagname, macro.content, macro.updated_at)
+
+        for character in sorted(self.characters, key=lambda c: c.id):
+            yield ('character', character.id, character.uuid, character.name, character.width,
+                   character.height, character.config, character.is_generic,
+                   sorted((language, l.name) for language, l in character.localizations.items()))
+
+        for asset in sorted(self.used_assets, key=lambda a: a.id):
+            yield ('asset', asset.id, asset.export_filename_with_ext, asset.content_type, asset.storage_digest)
+
+    def fingerprint(self):
+        """Content hash of everything the generated project depends on"""
+        digest = hashlib.sha1()
+        for item in self.fingerprint_items():
+            digest.update(json.dumps(item, default=str, ensure_ascii=False).encode('utf-8'))
+            digest.update(b'\n')
+        return digest.hexdigest()
 
     # Calculate character config
     def get_character_config(self, character):
@@ -188,7 +303,15 @@ class ScriptExporter(object):
     def export_used_character_config(self):
         character_configs = {}
 
-        used_characters = CharacterQuery(DBSession).fetch_by_ids(self.used_character_ids)
+        # Characters of the dialogs are given, query only those used by other macros
+        used_characters = [character for character in self.characters
+                           if str(character.id) in self.used_character_ids]
+        missing_character_ids = self.used_character_ids - set(str(character.id) for character in used_characters)
+        missing_character_ids.discard('')
+        missing_character_ids.discard(None)
+        if missing_character_ids:
+            used_characters += CharacterQuery(DBSession).fetch_by_ids(missing_character_ids)
+
         for character in used_characters:
             character_configs[character.uuid] = self.get_character_config(character)
 
@@ -207,9 +330,11 @@ class ScriptExporter(object):
 
         target_path = os.path.join(folder, filename)
         shutil.copyfile(asset.storage.dst, target_path)
+        exported_paths = [target_path]
 
         # If the asset file is kind of zip file
         if asset.content_type == 'application/zip':
+            exported_paths = []
             # Unzip to tmp/
             temp_extract_path = os.path.join(folder, 'tmp')
             zip_ref = zipfile.ZipFile(target_path, 'r')
@@ -222,46 +347,120 @@ class ScriptExporter(object):
                 for asset_filename in files:
                     new_asset_filename = os.path.splitext(filename)[0]  # filename
                     asset_filename_extension = os.path.splitext(asset_filename)[1]  # extension
-                    shutil.move(
-                        os.path.join(root, asset_filename),
-                        os.path.join(folder,new_asset_filename + asset_filename_extension)
-                    )
+                    extracted_path = os.path.join(folder, new_asset_filename + asset_filename_extension)
+                    shutil.move(os.path.join(root, asset_filename), extracted_path)
+                    exported_paths.append(extracted_path)
                 # Remove the tmp/ foler
                 shutil.rmtree(temp_extract_path)
 
-    def export_assets(self, data_path):
+        # Paths relative to data_path
+        return [os.path.relpath(path, data_path) for path in exported_paths]
+
+    def export_derivative(self, asset, filename, data_path):
+        folder = subpath(data_path, asset.asset_types[0].folder_name)
+        if folder is None:
+            folder = os.path.join(data_path, asset.asset_types[0].folder_name)
+        create_if_not_exist(folder)
+
+        exported_paths = []
+        for (name, path) in self.derivative_store.get_files(asset, filename, self.scale_factor):
+            shutil.copyfile(path, os.path.join(folder, name))
+            exported_paths.append(os.path.relpath(os.path.join(folder, name), data_path))
+        return exported_paths
+
+    def is_derived(self, asset):
+        return self.derivative_store is not None and is_scaled_asset(asset) \
+            and self.derivative_store.can_derive(asset)
+
+    def resize_images_in(self, folder_path):
+        subprocess.call([self.resize_script, folder_path, "%d%%" % (self.scale_factor * 100)])
+
+    def resize_images(self, data_path):
+        for folder in RESIZE_FOLDERS:
+            self.resize_images_in(os.path.join(data_path, folder))
+
+    def export_assets(self, data_path, exported_assets=None):
+        """Export used assets into data_path
+
+        exported_assets maps the filename of every asset already exported in
+        data_path to the paths it produced. When it is given only the missing
+        assets are exported, and those no longer used are removed.
+        Returns the mapping for the assets of this oice.
+        """
         # Add assets
         asset_map = {}
 
         for asset in self.used_assets:
-            filename = asset.accept(AssetVisitor())
+            filename = asset.export_filename_with_ext
             asset_map[filename] = asset
 
-        for (filename, asset) in asset_map.items():
-            self.export_asset(asset, filename, data_path)
+        if exported_assets is None:
+            exported_assets = {}
+            for (filename, asset) in asset_map.items():
+                if not self.is_derived(asset):
+                    exported_assets[filename] = self.export_asset(asset, filename, data_path)
 
-        # Resize all image assets
-        for folder in RESIZE_FOLDERS:
-            subprocess.call([self.resize_script, os.path.join(data_path, folder), "%d%%" % (self.scale_factor * 100)])
+            # Resize all image assets
+            self.resize_images(data_path)
 
-    def create_novelspherejs_project_from_oice(self):
-        # Initial project from template
-        project_dir = tempfile.mkdtemp()
-        data_dir = os.path.join(project_dir, 'data')
-        scenario_dir = os.path.join(data_dir, 'scenario')
-        plugin_dir = os.path.join(project_dir, 'plugin')
+            # Derivatives are already scaled
+            for (filename, asset) in asset_map.items():
+                if self.is_derived(asset):
+                    exported_assets[filename] = self.export_derivative(asset, filename, data_path)
+
+            return exported_assets
+
+        for filename in set(exported_assets) - set(asset_map):
+            for path in exported_assets.pop(filename):
+                if os.path.exists(os.path.join(data_path, path)):
+                    os.remove(os.path.join(data_path, path))
+
+        missing_assets = {
+            filename: asset
+            for (filename, asset) in asset_map.items()
+            if filename not in exported_assets
+            or not all(os.path.exists(os.path.join(data_path, path)) for path in exported_assets[filename])
+        }
+
+        for (filename, asset) in list(missing_assets.items()):
+            if self.is_derived(asset):
+                exported_assets[filename] = self.export_derivative(asset, filename, data_path)
+                del missing_assets[filename]
+
+        if not missing_assets:
+            return exported_assets
+
+        # Resize the missing assets aside, the exported ones are already scaled
+        staging_path = tempfile.mkdtemp()
+        for name in os.listdir(data_path):
+            if os.path.isdir(os.path.join(data_path, name)):
+                os.makedirs(os.path.join(staging_path, name))
+
+        for (filename, asset) in missing_assets.items():
+            exported_assets[filename] = self.export_asset(asset, filename, staging_path)
 
-        file_parent_dir = os.path.dirname(os.path.abspath(__file__))
-        template_dir = os.path.abspath(os.path.join(file_parent_dir, '..', 'res', 'novelspherejs', 'template_project'))
+        self.resize_images(staging_path)
 
-        shutil.copytree(os.path.join(template_dir, 'data'), data_dir)
-        shutil.copytree(os.path.join(template_dir, 'plugin'), plugin_dir)
+        for filename in missing_assets:
+            for path in exported_assets[filename]:
+                target_path = os.path.join(data_path, path)
+                create_if_not_exist(os.path.dirname(target_path))
+                shutil.move(os.path.join(staging_path, path), target_path)
 
-        for folder_name in PROJECT_FOLDERS:
-            create_if_not_exist(os.path.join(data_dir, folder_name))
+        shutil.rmtree(staging_path)
+
+        return exported_assets
+
+    def generate_project_files(self):
+        """Generated files of the project as (path relative to the project, write)
+
+        write(file) writes the content of the file to a text file, the
+        scripts of the oice are written block by block.
+        """
+        files = []
 
         # Generate config.json
-        config = EXPORT_DEFAULT.NOVELSPHERE_CONFIG
+        config = dict(EXPORT_DEFAULT.NOVELSPHERE_CONFIG)
         config['title'] = self.title
         config['defaultLanguage'] = self.oice.story.language
 
@@ -272,8 +471,7 @@ class ScriptExporter(object):
 
         config_script = json.dumps(config, ensure_ascii=False, indent=4)
 
-        with open(os.path.join(project_dir, 'config.json'), 'w') as config_file:
-            config_file.write(config_script)
+        files.append(('config.json', write_content(config_script)))
 
         # Generate .ks script files in different languages
         ks_files = dict()
@@ -297,18 +495,17 @@ class ScriptExporter(object):
 
             script += '''@call storage="%s.ks"\n@jump target="endOice"\n''' % language
 
-            ks_files[language] = self.oice.accept(self.script_visitor, language) + '\n@return'
+            ks_files[language] = functools.partial(self.write_oice_script, language)
 
         if len(languages) > 1:
             script += '[endif]\n'
 
         script += EXPORT_DEFAULT.POST_OICE_SCRIPT
 
-        ks_files['first'] = script
+        ks_files['first'] = write_content(script)
 
-        for filename, script in ks_files.items():
-            with open(os.path.join(scenario_dir, filename + '.ks'), 'w') as file:
-                file.write(script)
+        for filename, write in ks_files.items():
+            files.append(('data/scenario/' + filename + '.ks', write))
 
         # Include default variables
         # Since config.json cannot be retrieved in ks so we inject some values of it into ks variables
@@ -343,8 +540,7 @@ class ScriptExporter(object):
         }
         definition_script = EXPORT_DEFAULT.OICE_DEFAULTS_SCRIPT % str(oice_defaults)
 
-        with open(os.path.join(scenario_dir, '_definition.ks'), 'w') as file:
-            file.write(definition_script)
+        files.append(('data/scenario/_definition.ks', write_content(definition_script)))
 
         # Include interactions and handlers
         interaction_script = ''
@@ -357,8 +553,7 @@ class ScriptExporter(object):
 
         interaction_script += EXPORT_DEFAULT.KS_SCRIPT_RETURN
 
-        with open(os.path.join(scenario_dir, '_interaction.ks'), 'w') as file:
-            file.write(interaction_script)
+        files.append(('data/scenario/_interaction.ks', write_content(interaction_script)))
 
         # Include all used macro
         macro_script = ""
@@ -369,38 +564,196 @@ class ScriptExporter(object):
 
         macro_script += EXPORT_DEFAULT.KS_SCRIPT_RETURN
 
-        with open(os.path.join(scenario_dir, '_macro.ks'), 'w') as file:
-            file.write(macro_script)
+        files.append(('data/scenario/_macro.ks', write_content(macro_script)))
 
         # Include used character configuration
         npcdata_script = self.export_used_character_config()
 
-        with open(os.path.join(scenario_dir, '_npcdata.ks'), 'w') as file:
-            file.write(npcdata_script)
+        files.append(('data/scenario/_npcdata.ks', write_content(npcdata_script)))
+
+        return files
+
+    def write_oice_script(self, language, file):
+        self.script_visitor.write_oice(self.oice, language, file)
+        file.write('\n@return')
+
+    @staticmethod
+    def _project_manifest_path(project_dir):
+        # Kept beside the project so that it is not picked up by the build script
+        return os.path.normpath(project_dir) + '.json'
+
+    def create_novelspherejs_project_from_oice(self, project_dir=None):
+        """Generate the NovelSphere project of the oice
+
+        A project_dir left by a previous build of the same oice is updated in
+        place, only the files that changed since are rewritten.
+        """
+        manifest = None
+        manifest_path = None
+        if project_dir is None:
+            project_dir = tempfile.mkdtemp()
+        else:
+            manifest_path = self._project_manifest_path(project_dir)
+            try:
+                with open(manifest_path, 'r') as manifest_file:
+                    manifest = json.load(manifest_file)
+            except (OSError, ValueError):
+                manifest = None
+            else:
+                # Mark the project dirty until it is completely generated
+                os.remove(manifest_path)
+
+            if manifest is None or manifest.get('template') != get_template_version():
+                manifest = None
+                if os.path.exists(project_dir):
+                    shutil.rmtree(project_dir)
+                os.makedirs(project_dir)
+
+        data_dir = os.path.join(project_dir, 'data')
+        plugin_dir = os.path.join(project_dir, 'plugin')
+
+        if manifest is None:
+            # Initial project from template
+            shutil.copytree(os.path.join(TEMPLATE_DIR, 'data'), data_dir)
+            shutil.copytree(os.path.join(TEMPLATE_DIR, 'plugin'), plugin_dir)
+
+            for folder_name in PROJECT_FOLDERS:
+                create_if_not_exist(os.path.join(data_dir, folder_name))
+
+        generated_paths = []
+        for (path, write) in self.generate_project_files():
+            write_if_changed(os.path.join(project_dir, *path.split('/')), write)
+            generated_paths.append(path)
+
+        if manifest is not None:
+            # Remove scripts of languages no longer supported
+            for path in set(manifest.get('files', [])) - set(generated_paths):
+                os.remove(os.path.join(project_dir, *path.split('/')))
 
         # Include used assets
-        self.export_assets(data_dir)
+        exported_assets = self.export_assets(data_dir, manifest['assets'] if manifest else None)
+
+        if manifest_path is not None:
+            with open(manifest_path, 'w') as manifest_file:
+                json.dump({
+                    'template': get_template_version(),
+                    'files': sorted(generated_paths),
+                    'assets': exported_assets,
+                }, manifest_file)
 
         return project_dir
 
     def export(self):
-        project_dir = self.create_novelspherejs_project_from_oice()
+        """Write the project of the oice as a zip archive at export_path
+
+        Generated scripts and asset files are written straight into the
+        archive, only the images to be resized are copied aside, one folder
+        at a time, for the resize script to work on.
+        """
+        with zipfile.ZipFile(self.export_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            writer = ProjectZipWriter(zip_file)
+
+            resize_files = {folder: [] for folder in RESIZE_FOLDERS}
+
+            # Template of the project
+            for template_folder in ['data', 'plugin']:
+                for root, dirs, files in os.walk(os.path.join(TEMPLATE_DIR, template_folder)):
+                    dirs.sort()
+                    rel_dir = os.path.relpath(root, TEMPLATE_DIR).replace(os.sep, '/')
+                    writer.add_directory(rel_dir)
+                    for name in sorted(files):
+                        path = os.path.join(root, name)
+                        folder = rel_dir[len('data/'):] if rel_dir.startswith('data/') else None
+                        if folder in resize_files:
+                            resize_files[folder].append((name, functools.partial(open, path, 'rb')))
+                        else:
+                            writer.write_file(path, rel_dir + '/' + name)
+
+            folders = set(PROJECT_FOLDERS)
+            folders.update(name for name in os.listdir(os.path.join(TEMPLATE_DIR, 'data'))
+                           if os.path.isdir(os.path.join(TEMPLATE_DIR, 'data', name)))
+            for folder in sorted(folders):
+                writer.add_directory('data/' + folder)
+
+            for (path, write) in self.generate_project_files():
+                writer.write_text(write, path)
+
+            # Include used assets
+            for asset in self.used_assets:
+                filename = asset.export_filename_with_ext
+                folder = next((f for f in folders if f.lower() == asset.asset_types[0].folder_name.lower()), None)
+                if folder is None:
+                    folder = asset.asset_types[0].folder_name
+                    writer.add_directory('data/' + folder)
+                    folders.add(folder)
+
+                if folder in resize_files and self.is_derived(asset):
+                    for (name, path) in self.derivative_store.get_files(asset, filename, self.scale_factor):
+                        writer.write_file(path, 'data/%s/%s' % (folder, name))
+                    continue
+
+                for (name, open_member) in exported_asset_files(asset, filename):
+                    if folder in resize_files:
+                        resize_files[folder].append((name, open_member))
+                    else:
+                        with open_member() as member:
+                            writer.write_stream(member, 'data/%s/%s' % (folder, name))
 
-        subprocess.call(['zip', '-r', self.export_path, '.'], cwd=project_dir)
-        shutil.rmtree(project_dir)
+            # Resize images folder by folder to bound the disk usage
+            for folder in RESIZE_FOLDERS:
+                if not resize_files[folder]:
+                    continue
+                resize_path = tempfile.mkdtemp()
+                try:
+                    for (name, open_member) in resize_files[folder]:
+                        with open_member() as member, open(os.path.join(resize_path, name), 'wb') as target:
+                            shutil.copyfileobj(member, target)
+
+                    self.resize_images_in(resize_path)
+
+                    for name in sorted(os.listdir(resize_path)):
+                        writer.write_file(os.path.join(resize_path, name), 'data/%s/%s' % (folder, name))
+                finally:
+                    shutil.rmtree(resize_path)
 
 
 class KSScriptBuilder(ScriptExporter):
 
-    def __init__(self, build_script, *args, **kwargs):
+    def __init__(self, build_script, *args, build_cache=None, **kwargs):
         self.build_script = build_script
+        self.build_cache = build_cache
         super(KSScriptBuilder, self).__init__(*args, **kwargs)
 
-    def build(self):
-        project_dir = super(KSScriptBuilder, self).create_novelspherejs_project_from_oice()
+    def fingerprint_items(self):
+        yield from super(KSScriptBuilder, self).fingerprint_items()
+        yield ('build', self.build_script)
+        yield ('og', self.oice_view_url, self.og_image_button_url, self.og_image_origin_url,
+               self.oice.og_description)
 
+    def build(self):
+        if self.build_cache is None:
+            project_dir = super(KSScriptBuilder, self).create_novelspherejs_project_from_oice()
+            self._build_project(project_dir)
+            shutil.rmtree(project_dir)
+            return
+
+        key = self.fingerprint()
+        with self.build_cache.lock(self.oice):
+            artifact_dir = self.build_cache.get_artifact(self.oice, key)
+            if artifact_dir is not None:
+                log.info('Reuse cached build of oice %d' % self.oice.id)
+                if os.path.exists(self.export_path):
+                    shutil.rmtree(self.export_path)
+                shutil.copytree(artifact_dir, self.export_path)
+                return
+
+            project_dir = super(KSScriptBuilder, self).create_novelspherejs_project_from_oice(
+                self.build_cache.project_dir(self.oice))
+            self._build_project(project_dir)
+            self.build_cache.store_artifact(self.oice, key, self.export_path)
+
+    def _build_project(self, project_dir):
         subprocess.call([self.build_script, project_dir, self.export_path])
-        shutil.rmtree(project_dir)
 
         # Add og meta into index.html
         index_html_path = os.path.join(self.export_path, "index.html")
@@ -1,6 +1,8 @@
 # encoding: utf-8
 
 from collections import defaultdict
+import copy
+import threading
 
 import ply.lex as lex
 import ply.yacc as yacc
@@ -8,14 +10,67 @@ import ply.yacc as yacc
 import re
 
 version = 1
-section = ''
-characters = defaultdict(list)
-backgrounds = defaultdict(list)
-macro_names = set()
-blocks = []
-line_number = 1
 
-def parse_script(script):
+# Lines after which a script parsed in chunks is cut at the next statement
+CHUNK_LINES = 2000
+
+# A line starting with these starts a statement, any other line may be the
+# continuation of a dialog
+STATEMENT_STARTS = ('[', '{', '<', '//')
+
+
+class ScriptImportContext(object):
+    """State of one parse, what the script declared and the blocks it made"""
+
+    def __init__(self, script=''):
+        # Text being parsed, starting at line first_line of the script
+        self.script = script
+        self.first_line = 1
+        self.section = ''
+        self.characters = defaultdict(list)
+        self.backgrounds = defaultdict(list)
+        self.macro_names = set()
+        self.blocks = []
+        self.line_number = 1
+
+    def add_block(self, macro_name, attributes):
+        self.macro_names.add(macro_name)
+        self.blocks.append({
+            "macro": macro_name,
+            "attributes": attributes
+        })
+
+    def raise_syntax_error(self, key, line = None):
+        if not line:
+            line = self.line_number
+        lines = self.script.split('\n')
+        index = line - self.first_line
+        raise ScriptImportParserError(key, {
+                  'line': line,
+                  'content': lines[index] if 0 <= index < len(lines) else '',
+              })
+
+    def result(self):
+        character_ids = set(character['id'] for character in self.characters.values())
+        asset_ids = set(self.backgrounds.values())
+
+        return [character_ids, asset_ids, self.macro_names, self.blocks]
+
+
+class _UnexpectedToken(Exception):
+
+    def __init__(self, token):
+        self.token = token
+
+
+class ScriptImportParser(object):
+    """Grammar of the import scripts
+
+    The lexer and the parsing tables are built once, when the parser is
+    created. Each parse works on its own copies of them and keeps what it
+    reads in a ScriptImportContext, so the parser can be shared by threads.
+    """
+
     tokens = [
         # symbols
         'EQUAL', 'COLON', 'COMMENT',
@@ -45,35 +100,77 @@ def parse_script(script):
     # ignore space or tabs
     t_ignore       = ' \t'
 
-    def t_INTEGER(t):
+    def __init__(self):
+        self.lexer = lex.lex(module=self)
+        # Tables are generated in memory, nothing is written next to the module
+        self.parser = yacc.yacc(module=self, write_tables=False, debug=False)
+
+    def parse(self, script):
+        context = ScriptImportContext()
+        self.parse_text(context, script)
+        return context.result()
+
+    def parse_chunks(self, context, lines, chunk_lines=CHUNK_LINES):
+        """Parse a script read line by line, a chunk of lines at a time
+
+        Yields (first line, next line, blocks) for every chunk, with only the
+        blocks of that chunk, so a script of any length is parsed in bounded
+        memory. context keeps the declarations and the used ids of the whole
+        script.
+        """
+        for (first_line, next_line, text, last) in iter_script_chunks(lines, chunk_lines):
+            self.parse_text(context, text, first_line, last)
+            blocks = context.blocks
+            context.blocks = []
+            yield (first_line, next_line, blocks)
+
+    def parse_text(self, context, text, first_line=1, last=True):
+        context.script = text
+        context.first_line = first_line
+
+        lexer = self.lexer.clone()
+        lexer.lineno = first_line
+        lexer.context = context
+        # The parser keeps its stacks on itself while parsing
+        parser = copy.copy(self.parser)
+
+        try:
+            parser.parse(text, lexer=lexer)
+        except _UnexpectedToken as error:
+            if error.token:
+                context.raise_syntax_error('ERR_IMPORT_SCRIPT_SYNTAX_ERROR', error.token.lineno)
+            elif last:
+                context.raise_syntax_error('ERR_IMPORT_SCRIPT_SYNTAX_ERROR_UNEXPECTED_EOF')
+            else:
+                # The next chunk starts a statement, this one is left incomplete
+                context.raise_syntax_error('ERR_IMPORT_SCRIPT_SYNTAX_ERROR')
+
+    def t_INTEGER(self, t):
         r'\d+'
         t.value = int(t.value)
         return t
 
-    def t_STRING(t):
-    	r'[^\n\[\]\{\}\<\>\=\"@\/\;\:]+'
-    	if t.value in reserved:
-    	    t.type = reserved[t.value]
-    	return t
+    def t_STRING(self, t):
+        r'[^\n\[\]\{\}\<\>\=\"@\/\;\:]+'
+        if t.value in self.reserved:
+            t.type = self.reserved[t.value]
+        return t
 
-    def t_NEWLINE(t):
+    def t_NEWLINE(self, t):
         r'\n'
         t.lexer.lineno += 1
         return t
 
-    def t_COMMENT(t):
+    def t_COMMENT(self, t):
         r'\/{2}.*'
         return t
 
-    def t_error(e):
+    def t_error(self, e):
         raise ScriptImportParserError('ERR_IMPORT_SCRIPT_TOKENIZATION_ERROR', {
                   'message': str(e),
               })
 
-    # Build the lexer
-    lex.lex()
-
-    def p_file(p):
+    def p_file(self, p):
         '''
         file :
              | file section_tag
@@ -89,35 +186,34 @@ def parse_script(script):
             p[0] = p[1]
         else:
             p[0] = p[1]     # newline
-            global line_number
-            line_number = line_number + 1
+            p.lexer.context.line_number += 1
 
-    def p_section_tag(p):
+    def p_section_tag(self, p):
         '''
         section_tag : '<' expression '>'
                     | '<' '/' expression '>'
         '''
-        global section
+        context = p.lexer.context
         p[0] = p[2].lower() if len(p) == 4 else p[3].lower()
         if p[0] not in ['declaration', 'script']:
-            raise_syntax_error('ERR_IMPORT_SCRIPT_UNRECOGNIZED_SECTION_TAG')
-        section = '' if section == p[0] else p[0]
+            context.raise_syntax_error('ERR_IMPORT_SCRIPT_UNRECOGNIZED_SECTION_TAG')
+        context.section = '' if context.section == p[0] else p[0]
 
     # scripts
-    def p_script(p):
+    def p_script(self, p):
         '''
         script : character_script
                | background_script
                | aside_script
         '''
-        if section != 'script':
-            raise_syntax_error('ERR_IMPORT_SCRIPT_SHOULD_NOT_WRITE_SCRIPT_IN_DECLARATION')
+        if p.lexer.context.section != 'script':
+            p.lexer.context.raise_syntax_error('ERR_IMPORT_SCRIPT_SHOULD_NOT_WRITE_SCRIPT_IN_DECLARATION')
 
-    def p_script_character(p):
+    def p_script_character(self, p):
         '''character_script : character_tag COLON dialog'''
         p[3] = parse_dialog(p[3])
 
-        character = characters[p[1]]
+        character = p.lexer.context.characters[p[1]]
         attributes = {
             "character": character['id'],
             "dialog": p[3],
@@ -125,9 +221,9 @@ def parse_script(script):
         if 'name' in character:
             attributes['name'] = character['name']
 
-        add_block('characterdialog', attributes)
+        p.lexer.context.add_block('characterdialog', attributes)
 
-    def p_script_aside(p):
+    def p_script_aside(self, p):
         '''aside_script : aside_tag COLON dialog'''
         p[3] = parse_dialog(p[3])
 
@@ -135,9 +231,9 @@ def parse_script(script):
             'text': p[3],
         }
 
-        add_block('aside', attributes)
+        p.lexer.context.add_block('aside', attributes)
 
-    def p_dialog(p):
+    def p_dialog(self, p):
         '''
         dialog : expression
                | dialog NEWLINE
@@ -145,35 +241,34 @@ def parse_script(script):
         '''
         p[0] = ''.join(str(s) if s else '' for s in p)
         if len(p) > 2:
-            global line_number
-            line_number = line_number + 1
+            p.lexer.context.line_number += 1
 
-    def p_script_background(p):
+    def p_script_background(self, p):
         '''background_script : background_tag'''
-        background = backgrounds[p[1]]
+        background = p.lexer.context.backgrounds[p[1]]
         attributes = {
             'storage': background,
         }
-        add_block('bg', attributes)
+        p.lexer.context.add_block('bg', attributes)
 
-    def p_script_comment(p):
+    def p_script_comment(self, p):
         '''comment : COMMENT'''
         p[0] = p[1][2:]
-        if p[0] and section == 'script':
-            add_block('comment', { 'text': p[0] })
+        if p[0] and p.lexer.context.section == 'script':
+            p.lexer.context.add_block('comment', { 'text': p[0] })
 
     # declaration
 
-    def p_declaration(p):
+    def p_declaration(self, p):
         '''
         declaration : character_declaration
                     | background_declaration
                     | version_declaration
         '''
-        if section != 'declaration':
-            raise_syntax_error('ERR_IMPORT_SCRIPT_SHOULD_NOT_WRITE_DECLARATION_IN_SCRIPT')
+        if p.lexer.context.section != 'declaration':
+            p.lexer.context.raise_syntax_error('ERR_IMPORT_SCRIPT_SHOULD_NOT_WRITE_DECLARATION_IN_SCRIPT')
 
-    def p_declaration_character(p):
+    def p_declaration_character(self, p):
         '''
         character_declaration : character_tag EQUAL INTEGER
                               | character_tag EQUAL INTEGER '@' expression
@@ -181,94 +276,110 @@ def parse_script(script):
         asset_object = { 'id': p[3] }
         if len(p) == 6:
             asset_object['name'] = p[5]
-        characters[p[1]] = asset_object
+        p.lexer.context.characters[p[1]] = asset_object
 
-    def p_declaration_background(p):
+    def p_declaration_background(self, p):
         '''background_declaration : background_tag EQUAL INTEGER'''
-        backgrounds[p[1]] = p[3]
+        p.lexer.context.backgrounds[p[1]] = p[3]
 
-    def p_declaration_version(p):
+    def p_declaration_version(self, p):
         '''version_declaration : expression EQUAL INTEGER'''
         if p[1] == 'version' and version != p[3]:
             print('version not match')
 
     # tags
 
-    def p_character_tag(p):
+    def p_character_tag(self, p):
         '''character_tag : SQUARE_OPEN expression SQUARE_CLOSE'''
+        context = p.lexer.context
         p[0] = p[2]
-        if section == 'script' and not characters[p[0]]:
-            raise_syntax_error('ERR_IMPORT_SCRIPT_USING_UNDECLARED_CHARACTER')
+        if context.section == 'script' and not context.characters[p[0]]:
+            context.raise_syntax_error('ERR_IMPORT_SCRIPT_USING_UNDECLARED_CHARACTER')
 
-    def p_background_tag(p):
+    def p_background_tag(self, p):
         '''background_tag : CURLY_OPEN expression CURLY_CLOSE'''
+        context = p.lexer.context
         p[0] = p[2]
-        if section == 'script' and not backgrounds[p[0]]:
-            raise_syntax_error('ERR_IMPORT_SCRIPT_USING_UNDECLARED_BACKGROUND')
+        if context.section == 'script' and not context.backgrounds[p[0]]:
+            context.raise_syntax_error('ERR_IMPORT_SCRIPT_USING_UNDECLARED_BACKGROUND')
 
-    def p_aside_tag(p):
+    def p_aside_tag(self, p):
         '''aside_tag : SQUARE_OPEN NARRATOR SQUARE_CLOSE'''
         p[0] = p[2]
 
     # expression
 
-    def p_expression_str(p):
+    def p_expression_str(self, p):
         '''expression : STRING'''
         p[0] = p[1].strip()     # remove leading and trailing spaces
 
-    def p_expression_int(p):
+    def p_expression_int(self, p):
         '''expression : INTEGER'''
         p[0] = p[1]
 
+    def p_error(self, p):
+        # Reported by parse, which knows the script being parsed
+        raise _UnexpectedToken(p)
 
-    def p_error(p):
-        if not p:
-            raise_syntax_error('ERR_IMPORT_SCRIPT_SYNTAX_ERROR_UNEXPECTED_EOF')
-        else:
-            raise_syntax_error('ERR_IMPORT_SCRIPT_SYNTAX_ERROR', p.lineno)
-
-    # helper function for script
-    def parse_dialog(dialog):
-        # remove newline at the end of dialog
-        dialog = dialog.rstrip('\n')
-        # handle **xxxx** => [keyword]xxxx[endkeyword]
-        keywords = re.findall('\*{2}[^\*]+\*{2}', dialog)
-        for keyword in keywords:
-            dialog = dialog.replace(keyword, '[keyword]%s[endkeyword]' % keyword[2:-2])
-
-        # handle !~ 2000~! => [wait time=2000]
-        keywords = re.findall('!~[^~!]+~!', dialog)
-        for keyword in keywords:
-            wait_time = keyword[2:-2].strip()
-            if not wait_time.isdigit():
-                raise ScriptImportParserError('ERR_IMPORT_SCRIPT_WAIT_TIME_IS_NOT_AN_INTEGER')
-            dialog = dialog.replace(keyword, '[wait time=%s]' % wait_time)
-
-        return dialog
-
-    yacc.yacc()
-
-    def add_block(macro_name, attributes):
-        macro_names.add(macro_name)
-        blocks.append({
-            "macro": macro_name,
-            "attributes": attributes
-        })
 
-    def raise_syntax_error(key, line = None):
-        if not line:
-            line = line_number
-        raise ScriptImportParserError(key, {
-                  'line': line,
-                  'content': script.split('\n')[line - 1],
-              })
+def iter_script_chunks(lines, chunk_lines=CHUNK_LINES):
+    """Group the lines of a script in chunks of about chunk_lines lines
 
-    result = yacc.parse(script)
+    A chunk only ends before a line starting a statement, never inside a
+    dialog. Yields (first line, next line, text, is last chunk).
+    """
+    chunk = []
+    first_line = 1
+    line_number = 1
+    for line in lines:
+        if len(chunk) >= chunk_lines and line.lstrip(' \t').startswith(STATEMENT_STARTS):
+            yield (first_line, line_number, ''.join(chunk), False)
+            chunk = []
+            first_line = line_number
+        chunk.append(line)
+        line_number += 1
+    yield (first_line, line_number, ''.join(chunk), True)
+
+
+# helper function for script
+def parse_dialog(dialog):
+    # remove newline at the end of dialog
+    dialog = dialog.rstrip('\n')
+    # handle **xxxx** => [keyword]xxxx[endkeyword]
+    keywords = re.findall('\*{2}[^\*]+\*{2}', dialog)
+    for keyword in keywords:
+        dialog = dialog.replace(keyword, '[keyword]%s[endkeyword]' % keyword[2:-2])
+
+    # handle !~ 2000~! => [wait time=2000]
+    keywords = re.findall('!~[^~!]+~!', dialog)
+    for keyword in keywords:
+        wait_time = keyword[2:-2].strip()
+        if not wait_time.isdigit():
+            raise ScriptImportParserError('ERR_IMPORT_SCRIPT_WAIT_TIME_IS_NOT_AN_INTEGER')
+        dialog = dialog.replace(keyword, '[wait time=%s]' % wait_time)
+
+    return dialog
+
+
+_parser = None
+_parser_lock = threading.Lock()
+
+
+def get_parser():
+    global _parser
+    if _parser is None:
+        with _parser_lock:
+            if _parser is None:
+                _parser = ScriptImportParser()
+    return _parser
+
+
+def parse_script(script):
+    return get_parser().parse(script)
 
-    character_ids = set(character['id'] for character in characters.values())
-    asset_ids = set(backgrounds.values())
 
-    return [character_ids, asset_ids, macro_names, blocks]
+def parse_script_chunks(context, lines, chunk_lines=CHUNK_LINES):
+    return get_parser().parse_chunks(context, lines, chunk_lines)
 
 
 class ScriptImportParserError(Exception):
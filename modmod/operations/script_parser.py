@@ -1,11 +1,18 @@
 # pylama:ignore=C901,ignore=W612,ignore=E501
+import copy
+import threading
+
 import ply.lex as lex
 import ply.yacc as yacc
 
-def parse(input_text):
 
-    # we need this to close at_tag
-    input_text = input_text+"\n"
+class KsParser(object):
+    """Grammar of the ks scripts
+
+    The lexer and the parsing tables are built once, when the parser is
+    created. Each parse works on its own copies of them, so the parser can be
+    shared by threads.
+    """
 
     tokens = [
         'OPEN_TAG_SQUARE', 'CLOSE_TAG_SQUARE',
@@ -33,25 +40,38 @@ def parse(input_text):
     t_ASTERISK = r'\*'
     t_PIPE = r'[\s\t]*\|[\s\t]*'
 
-    def t_IDENTIFIER(t):
+    def __init__(self):
+        self.lexer = lex.lex(module=self)
+        # Tables are generated in memory, nothing is written next to the module
+        self.parser = yacc.yacc(module=self, write_tables=False, debug=False)
+
+    def parse(self, input_text):
+        # we need this to close at_tag
+        input_text = input_text+"\n"
+
+        lexer = self.lexer.clone()
+        lexer.lineno = 1
+        # The parser keeps its stacks on itself while parsing
+        parser = copy.copy(self.parser)
+
+        return parser.parse(input_text, lexer=lexer)
+
+    def t_IDENTIFIER(self, t):
         r'[^\s\t\n\[\]\=\"@\;\*\|\&]+'
-        if t.value in reserved:
-            t.type = reserved[t.value]
+        if t.value in self.reserved:
+            t.type = self.reserved[t.value]
         return t
 
-    def t_NEWLINE(t):
+    def t_NEWLINE(self, t):
         r'\n'
         t.lexer.lineno += 1
         return t
 
-    def t_error(e):
+    def t_error(self, e):
         # TODO: error handling
         print('t error')
 
-    # Build the lexer
-    lex.lex()
-
-    def p_file(p):
+    def p_file(self, p):
         '''file :
                 | file tags
                 | file comment_line
@@ -72,7 +92,7 @@ def parse(input_text):
             # ignore new line
             p[0] = p[1]
 
-    def p_tags(p):
+    def p_tags(self, p):
         '''tags : square_tag
                 | at_tag
                 | text_tags
@@ -80,7 +100,7 @@ def parse(input_text):
                 | iscript_tag'''
         p[0] = p[1]
 
-    def p_square_tag(p):
+    def p_square_tag(self, p):
         '''square_tag : OPEN_TAG_SQUARE in_tag_space IDENTIFIER in_tag_space CLOSE_TAG_SQUARE
                       | OPEN_TAG_SQUARE in_tag_space IDENTIFIER in_tag_space attributes in_tag_space CLOSE_TAG_SQUARE
                       | square_tag NEWLINE'''
@@ -100,7 +120,7 @@ def parse(input_text):
         elif len(p) == 3:
             p[0] = p[1]
 
-    def p_at_tag(p):
+    def p_at_tag(self, p):
         '''at_tag : OPEN_TAG_AT IDENTIFIER NEWLINE
                   | OPEN_TAG_AT IDENTIFIER in_tag_space attributes NEWLINE
                   | at_tag NEWLINE'''
@@ -120,7 +140,7 @@ def parse(input_text):
         elif len(p) == 3:
             p[0] = p[1]
 
-    def p_text_tags(p):
+    def p_text_tags(self, p):
         '''text_tags : text_tag
                      | text_tags NEWLINE
                      | text_tags NEWLINE text_tag'''
@@ -133,7 +153,7 @@ def parse(input_text):
             p[1].append(p[3])
             p[0] = p[1]
 
-    def p_text_tag(p):
+    def p_text_tag(self, p):
         '''text_tag : IDENTIFIER
                     | SPACE
                     | EQUAL
@@ -162,7 +182,7 @@ def parse(input_text):
             p[1]['attributes']['text'] += p[2]
             p[0] = p[1]
 
-    def p_label_tag(p):
+    def p_label_tag(self, p):
         '''label_tag : ASTERISK IDENTIFIER NEWLINE
                      | ASTERISK IDENTIFIER PIPE string_in_quote NEWLINE'''
         if len(p) == 4:
@@ -183,7 +203,7 @@ def parse(input_text):
                 'line': p.lineno(1)
             }
 
-    def p_iscript_tag(p):
+    def p_iscript_tag(self, p):
         '''iscript_tag : open_iscript_tag iscript_content end_script_tag'''
         p[0] = {
             'tagname': 'iscript',
@@ -193,17 +213,17 @@ def parse(input_text):
             'line': p.lineno(1)
         }
 
-    def p_open_iscript_tag(p):
+    def p_open_iscript_tag(self, p):
         '''open_iscript_tag : OPEN_TAG_SQUARE in_tag_space ISCRIPT in_tag_space CLOSE_TAG_SQUARE
                             | OPEN_TAG_AT ISCRIPT NEWLINE
                             | open_iscript_tag NEWLINE'''
 
-    def p_end_script_tag(p):
+    def p_end_script_tag(self, p):
         '''end_script_tag : OPEN_TAG_SQUARE in_tag_space ENDSCRIPT in_tag_space CLOSE_TAG_SQUARE
                           | OPEN_TAG_AT ENDSCRIPT NEWLINE
                           | end_script_tag NEWLINE'''
 
-    def p_iscript_content(p):
+    def p_iscript_content(self, p):
         '''iscript_content : 
                            | iscript_content IDENTIFIER
                            | iscript_content SPACE
@@ -226,11 +246,11 @@ def parse(input_text):
         else:
             p[0] = p[1] + p[2]
 
-    def p_in_tag_space(p):
+    def p_in_tag_space(self, p):
         '''in_tag_space :
                         | SPACE'''
 
-    def p_attributes(p):
+    def p_attributes(self, p):
         '''attributes : attribute
                       | attributes attribute_separator attribute'''
         if len(p) == 2:
@@ -241,11 +261,11 @@ def parse(input_text):
             p[1][p[3]['name']] = p[3]['value']
             p[0] = p[1]
 
-    def p_attribute_separator(p):
+    def p_attribute_separator(self, p):
         '''attribute_separator : TAB
                                | SPACE'''
 
-    def p_attribute(p):
+    def p_attribute(self, p):
         '''attribute : IDENTIFIER
                      | ASTERISK 
                      | IDENTIFIER EQUAL attribute_value'''
@@ -266,7 +286,7 @@ def parse(input_text):
                 'value': p[3]
             }
 
-    def p_attribute_value(p):
+    def p_attribute_value(self, p):
         '''attribute_value : string_without_quote
                            | QUOTE string_in_quote QUOTE
                            | AND QUOTE string_in_quote QUOTE'''
@@ -279,7 +299,7 @@ def parse(input_text):
         elif len(p) == 5:
             p[0] = p[1]+p[3]
 
-    def p_attribute_string(p):
+    def p_attribute_string(self, p):
         '''string_without_quote : IDENTIFIER
                                 | ASTERISK
                                 | AND
@@ -290,7 +310,7 @@ def parse(input_text):
         else:
             p[0] = p[1]
 
-    def p_string_in_quote(p):
+    def p_string_in_quote(self, p):
         '''string_in_quote : 
                            | string_in_quote IDENTIFIER
                            | string_in_quote SPACE
@@ -311,7 +331,7 @@ def parse(input_text):
         else:
             p[0] = p[1] + p[2]
 
-    def p_comment_line(p):
+    def p_comment_line(self, p):
         '''comment_line : comment NEWLINE'''
         p[0] = {
             'tagname': 'comment',
@@ -321,7 +341,7 @@ def parse(input_text):
             'line': p.lineno(1)
         }
 
-    def p_comment(p):
+    def p_comment(self, p):
         '''comment : SEMICOLON
                    | comment IDENTIFIER
                    | comment SPACE
@@ -340,17 +360,29 @@ def parse(input_text):
         else:
             p[0] = p[1] + p[2]
 
-    def p_error(p):
+    def p_error(self, p):
         if not p:
             raise KsParserError('Syntax error, unexpected EOF')
         else:
             raise KsParserError('Line %d, Syntax error, unexpected %s' % (p.lineno,p.type))
 
-    yacc.yacc()
 
-    result = yacc.parse(input_text)
+_parser = None
+_parser_lock = threading.Lock()
+
+
+def get_parser():
+    global _parser
+    if _parser is None:
+        with _parser_lock:
+            if _parser is None:
+                _parser = KsParser()
+    return _parser
+
+
+def parse(input_text):
+    return get_parser().parse(input_text)
 
-    return result
 
 class KsParserError(Exception):
 
@@ -358,4 +390,4 @@ class KsParserError(Exception):
         self.value = value
 
     def __str__(self):
-        return self.value
\ No newline at end of file
+        return self.value
@@ -1,9 +1,15 @@
 import json
 import logging
-from sqlalchemy.orm import joinedload
+from sqlalchemy.exc import IntegrityError
 from ..models import (
     DBSession,
-    Oice
+    Block,
+    BlockTombstoneQuery,
+    Oice,
+    OiceRevisionQuery,
+    OiceValidationIndex,
+    OiceValidationIndexQuery,
+    catalog,
 )
 
 
@@ -28,7 +34,6 @@ class ScriptValidator(object):
                 self._oice_map['first.ks'] = self.oice
             else:
                 oices = DBSession.query(Oice) \
-                                 .options(joinedload('blocks')) \
                                  .filter(Oice.story_id == self.story.id)
                 for oice in oices:
                     self._oice_map[oice.filename] = oice
@@ -76,22 +81,36 @@ class ScriptValidator(object):
 
     def get_errors(self):
         errors = {}
+        entries_by_oice = ValidationIndexer().refresh(self.oice_map.values())
 
         for (filename, ks) in self.oice_map.items():
-            this_errors = self.errors_in_oice(ks)
+            this_errors = self.errors_in_oice(ks, entries_by_oice[ks.id])
             if this_errors:
                 errors[filename] = this_errors
         return errors
 
-    def errors_in_oice(self, oice):
+    def errors_in_oice(self, oice, entries=None):
+        """Errors of the blocks of an oice, from their entries in the validation index"""
+        if entries is None:
+            entries = ValidationIndexer().refresh([oice])[oice.id]
+
         error_blocks_map = {}
         error_map = {}
 
-        for block in oice.blocks:
-            block_errors = self.errors_in_block(block)
-            if block_errors:
+        blocks = sorted(
+            (IndexedBlock(block_id, oice.id, entry) for (block_id, entry) in entries.items()),
+            key=lambda b: (b.position, b.id),
+        )
+        for block in blocks:
+            entry = entries[block.id]
+            for label in entry['labels']:
+                self.define_label(label)
+            for (attribute_name, target) in entry['jumpTargets']:
+                self.define_jump_target(block, attribute_name, target)
+
+            if entry['errors']:
                 error_blocks_map[block.id] = block
-                error_map[block.id] = block_errors
+                error_map[block.id] = list(entry['errors'])
 
         # Validate jump targets
         undefined_targets = self.jump_targets - self.labels
@@ -111,21 +130,27 @@ class ScriptValidator(object):
                         'value': target,
                     })
 
+        block_orders = {block.id: index for (index, block) in enumerate(blocks)}
+
         return [
             {
-                "block": block.serialize_min(),
+                "block": block.serialize_min(block_orders.get(block.id)),
                 'errors': error_map[block.id],
             }
-            for block in sorted(error_blocks_map.values(), key=lambda b: b.position)
+            for block in sorted(error_blocks_map.values(), key=lambda b: (b.position, b.id))
         ]
 
-    def errors_in_block(self, block):
+    @staticmethod
+    def index_block(block):
+        """What the validation finds in a block alone, for the validation index"""
         errors = []
+        labels = []
+        jump_targets = []
 
-        macro_name = block.macro.tagname
-        existing_attributes = {attr.attribute_definition.attribute_name: attr for attr in block.attributes}
+        macro_name = block.macro_entry.tagname
+        existing_attributes = {attr.definition.attribute_name: attr for attr in block.attributes}
 
-        for attribute_definition in block.macro.attribute_definitions:
+        for attribute_definition in catalog.get_definitions(block.macro_id):
 
             attribute_name = attribute_definition.attribute_name
             is_asset       = attribute_definition.is_asset
@@ -161,10 +186,10 @@ class ScriptValidator(object):
                         })
 
                     elif macro_name == 'label'  and attribute_name == 'name':
-                        self.define_label(value)
+                        labels.append(value)
 
                     elif macro_name == 'jump'   and attribute_name == 'target':
-                        self.define_jump_target(block, attribute_name, value)
+                        jump_targets.append((attribute_name, value))
 
                     elif macro_name == 'option' and attribute_name == 'answers':
                         try:
@@ -181,7 +206,7 @@ class ScriptValidator(object):
                                 target = answer['target']
 
                                 if target:
-                                    self.define_jump_target(block, attribute_name, target)
+                                    jump_targets.append((attribute_name, target))
 
                                 else:
                                     errors.append({
@@ -190,4 +215,104 @@ class ScriptValidator(object):
                                         'value': target,
                                     })
 
-        return errors
+        return {
+            'macroId': block.macro_id,
+            'position': block.position,
+            'errors': errors,
+            'labels': labels,
+            'jumpTargets': jump_targets,
+        }
+
+
+class IndexedBlock(object):
+    """Block as recorded in the validation index, enough to report its errors"""
+
+    def __init__(self, block_id, oice_id, entry):
+        self.id = block_id
+        self.oice_id = oice_id
+        self.macro_id = entry['macroId']
+        self.position = entry['position']
+
+    def serialize_min(self, order=None):
+        macro = catalog.get_macro(self.macro_id)
+        return {
+            'id': self.id,
+            'oiceId': self.oice_id,
+            'macroId': self.macro_id,
+            'macroName': macro.tagname if macro else None,
+            'order': self.position if order is None else order,
+        }
+
+
+class ValidationIndexer(object):
+    """Keep the validation index of oices up to date with their blocks
+
+    Only the blocks changed since the revision of the index are validated
+    again, and the deleted ones are dropped from it. The whole oice is
+    validated when the story language or the catalog changed.
+    """
+
+    def __init__(self, session=DBSession):
+        self.session = session
+
+    def refresh(self, oices):
+        """Entries of the index of each oice by oice id"""
+        oices = list(oices)
+        oice_ids = [oice.id for oice in oices]
+        if not oice_ids:
+            return {}
+
+        # Read before the blocks, a block changed meanwhile is seen again next time
+        revisions = OiceRevisionQuery(self.session).fetch_revisions(oice_ids)
+        indexes = OiceValidationIndexQuery(self.session).fetch_by_oice_ids(oice_ids)
+        catalog_version = catalog.version.get()
+
+        entries_by_oice = {}
+        for oice in oices:
+            index = indexes.get(oice.id)
+            revision = revisions[oice.id]
+            language = oice.story.language
+
+            if index is not None and index.is_valid_for(language, catalog_version):
+                if index.revision == revision:
+                    entries_by_oice[oice.id] = index.entries
+                    continue
+
+                entries = index.entries
+                for block_id in BlockTombstoneQuery(self.session).fetch_block_ids_since(oice.id, index.revision):
+                    entries.pop(block_id, None)
+                blocks = self.session.query(Block) \
+                                     .filter(Block.oice_id == oice.id) \
+                                     .filter(Block.revision > index.revision)
+            else:
+                entries = {}
+                blocks = self.session.query(Block) \
+                                     .filter(Block.oice_id == oice.id)
+
+            for block in blocks:
+                entries[block.id] = ScriptValidator.index_block(block)
+
+            self._save(oice.id, index, revision, language, catalog_version, entries)
+            entries_by_oice[oice.id] = entries
+
+        return entries_by_oice
+
+    def _save(self, oice_id, index, revision, language, catalog_version, entries):
+        is_new = index is None
+        if is_new:
+            index = OiceValidationIndex(oice_id=oice_id)
+
+        index.revision = revision
+        index.language = language
+        index.catalog_version = catalog_version
+        index.entries = entries
+
+        if not is_new:
+            return
+
+        try:
+            with self.session.begin_nested():
+                self.session.add(index)
+        except IntegrityError:
+            # Indexed by another request at the same time
+            log.info('Validation index of oice %d created concurrently' % oice_id)
@@ -1,44 +1,38 @@
+import sqlalchemy as sa
 from sqlalchemy.orm.session import make_transient
-import pyramid_safile
+from sqlalchemy.sql.expression import true
+from zope.sqlalchemy import mark_changed
 import logging
-from google.cloud import translate
 from modmod.exc import ValidationError
 from ..models import (
-    StoryQuery
+    Attribute,
+    AttributeDefinition,
+    Block,
+    Oice,
+    OiceLocalization,
+    OiceWordCount,
+    StoryQuery,
+    touch_blocks,
 )
-from ..config import get_gcloud_json_path, get_gcloud_project_id
-from .oice import translate_oice
+from .blob_store import BlobStore
+from .oice import request_oice_translation
+from .translation import TranslationEngine
 from ..views.util import get_language_code_for_translate
 
 
 log = logging.getLogger(__name__)
 
 def fork_story(session, story, is_self_forking=False):
-    handle = None
-    if story.cover_storage:
-        try:
-            cover_storage = story.cover_storage
-            factory = pyramid_safile.get_factory()
-            handle = factory.create_handle(cover_storage.filename, open(cover_storage.dst, 'rb'))
-        except FileNotFoundError as e:
-            log.error(str(e))
-
-    og_image_handle = None
-    if story.og_image:
-        try:
-            og_image = story.og_image
-            factory = pyramid_safile.get_factory()
-            og_image_handle = factory.create_handle(og_image.filename, open(og_image.dst, 'rb'))
-        except FileNotFoundError as e:
-            log.error(str(e))
-
     session.expunge(story)
     original_story = StoryQuery(session).get_story_by_id(story.id)
     story.fork_of = story.id
     story.id = None
     if is_self_forking:
         story.name = story.name + '(1)'
-    story.import_handle(handle)
+    # The fork holds the images of the story instead of copies of them
+    blob_store = BlobStore(session)
+    for handle in (story.cover_storage, story.title_logo, story.hero_image, story.og_image):
+        blob_store.add_reference(handle)
     make_transient(story)
     session.add(story)
     story.localizations = original_story.localizations
@@ -47,25 +41,65 @@ def fork_story(session, story, is_self_forking=False):
 
 
 def remove_story_localization(session, story, language):
-    if story.has_translated_language(language):
-        session.delete(story.localizations[language])
-        for o in story.oice:
-            if language in o.localizations:
-                session.delete(o.localizations[language])
-            for b in o.blocks:
-                for attribute in b.attributes:
-                    if attribute.attribute_definition.localizable and attribute.language == language:
-                        session.delete(attribute)
-        session.flush()
-    else:
+    """Remove a language from a story, its oices and their blocks
+
+    The oice localizations and localized attributes are deleted by a few
+    statements whatever the length of the story. The changed blocks get a
+    new revision and the word counts of the language are dropped.
+    """
+    if not story.has_translated_language(language):
         raise ValueError('ERR_LANGUAGE_NOT_EXIST_IN_STORY')
 
+    session.delete(story.localizations[language])
+    session.flush()
+
+    oice_ids = sa.select([Oice.id]).where(Oice.story_id == story.id)
+    localized_attributes = sa.and_(
+        Attribute.language == language,
+        Attribute.block_id.in_(sa.select([Block.id]).where(Block.oice_id.in_(oice_ids))),
+        Attribute.attribute_definition_id.in_(
+            sa.select([AttributeDefinition.id]).where(AttributeDefinition.localizable == true())
+        ),
+    )
+
+    changed_blocks = session.query(Block.oice_id, Block.id) \
+                            .filter(Block.id.in_(sa.select([Attribute.block_id]).where(localized_attributes))) \
+                            .all()
+
+    session.execute(Attribute.__table__.delete().where(localized_attributes))
+    session.execute(
+        OiceLocalization.__table__.delete()
+                                  .where(OiceLocalization.language == language)
+                                  .where(OiceLocalization.oice_id.in_(oice_ids))
+    )
+    session.execute(
+        OiceWordCount.__table__.delete()
+                               .where(OiceWordCount.language == language)
+                               .where(OiceWordCount.oice_id.in_(oice_ids))
+    )
+
+    block_ids_by_oice = {}
+    for (oice_id, block_id) in changed_blocks:
+        block_ids_by_oice.setdefault(oice_id, set()).add(block_id)
+    for (oice_id, block_ids) in block_ids_by_oice.items():
+        touch_blocks(session, oice_id, block_ids)
+
+    # The objects already loaded still hold the deleted rows
+    changed_block_ids = set(block_id for (_, block_id) in changed_blocks)
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Attribute) and obj.block_id in changed_block_ids and obj.language == language:
+            session.expunge(obj)
+        elif isinstance(obj, Block) and obj.id in changed_block_ids:
+            # Also drops the attributes resolved by the block
+            session.expire(obj, ['attributes'])
+        elif isinstance(obj, Oice) and obj.story_id == story.id:
+            session.expire(obj, ['localizations'])
+    session.expire(story, ['localizations'])
+
+    mark_changed(session())
+
 
 def translate_story(story, target_language, source_language=None, translated_story={}, translated_oices=[], client=None):
-    if client is None:
-        client = translate.Client.from_service_account_json(
-            get_gcloud_json_path()
-        )
     if not source_language:
         source_language = story.language
 
@@ -74,32 +108,37 @@ def translate_story(story, target_language, source_language=None, translated_sto
     story.set_name(translated_story['name'], target_language)
     story.set_description(translated_story['description'], target_language)
 
+    # All the episodes share the requests and the translation memory
+    engine = TranslationEngine(source_language, target_language_code, client)
+    saves = []
     for o in story.oice:
         translated_oice_name = next((oice['name'] for oice in translated_oices if oice['id'] == o.id), None)
-        translate_oice(o, target_language, source_language, translated_oice_name, client)
+        saves.append(request_oice_translation(engine, o, target_language, source_language, translated_oice_name))
+
+    engine.run()
+    for save in saves:
+        save()
 
 
 def translate_story_preview(story, target_language, source_language=None, client=None):
-    if client is None:
-        client = translate.Client.from_service_account_json(
-            get_gcloud_json_path()
-        )
     if not source_language:
         source_language = story.language
 
     target_language_code = get_language_code_for_translate(target_language)
+    engine = TranslationEngine(source_language, target_language_code, client)
+
+    story_result = {'id': story.id}
+    engine.request_item(story.get_name(source_language), story_result, 'name')
+    engine.request_item(story.get_description(source_language), story_result, 'description')
 
-    story_text_list = [story.get_name(source_language), story.get_description(source_language)]
-    story_results = client.translate(story_text_list, target_language=target_language_code, model=translate.NMT)
+    oice_results = []
+    for oice in story.oice:
+        oice_result = {'id': oice.id}
+        engine.request_item(oice.get_name(source_language), oice_result, 'name')
+        oice_results.append(oice_result)
 
-    oices = story.oice
-    oice_text_list = [oice.get_name(source_language) for oice in oices]
-    oice_results = client.translate(oice_text_list, target_language=target_language_code, model=translate.NMT)
+    engine.run()
     return {
-        'story': {
-            'id': story.id,
-            'name': story_results[0]['translatedText'],
-            'description': story_results[1]['translatedText'],
-        },
-        'oices': [{ 'id': oices[i].id, 'name': result['translatedText'] } for i, result in enumerate(oice_results)],
+        'story': story_result,
+        'oices': oice_results,
     }
@@ -0,0 +1,151 @@
+import functools
+import html
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import translate
+from sqlalchemy.exc import IntegrityError
+
+from ..config import get_gcloud_json_path
+from ..models import (
+    DBSession,
+    TranslationMemory,
+    TranslationMemoryQuery,
+)
+
+
+log = logging.getLogger(__name__)
+
+
+# Limits of a single request to the Cloud Translation API
+MAX_TEXTS_PER_REQUEST = 128
+MAX_CHARACTERS_PER_REQUEST = 5000
+
+# Requests sent at once by an engine
+DEFAULT_CONCURRENCY = 4
+
+
+def create_translate_client():
+    return translate.Client.from_service_account_json(get_gcloud_json_path())
+
+
+class TranslationEngine(object):
+    """Translate many texts with as few requests as possible
+
+    Texts are queued with request() and all translated by run(). The ones
+    found in the translation memory are not sent, identical texts are sent
+    once, and the rest is packed into requests as large as the API allows,
+    sent by up to concurrency threads. New translations are added to the
+    memory.
+
+    The requests are sent by clients made by client_factory, one for every
+    thread as the Cloud Translation clients are not thread safe. client is
+    anything with their translate method, used by every thread instead, such
+    as a fake one in tests.
+    """
+
+    def __init__(self, source_language, target_language_code, client=None,
+                 session=DBSession, concurrency=DEFAULT_CONCURRENCY, client_factory=None):
+        if client is not None:
+            client_factory = lambda: client
+        elif client_factory is None:
+            client_factory = create_translate_client
+        self.client_factory = client_factory
+        self._local = threading.local()
+        self.source_language = source_language
+        self.target_language_code = target_language_code
+        self.session = session
+        self.concurrency = concurrency
+        self._callbacks = {}
+        self.request_count = 0
+
+    @property
+    def client(self):
+        """Client of the calling thread"""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.client_factory()
+        return client
+
+    def request(self, text, callback):
+        """Call callback with the translation of text once run"""
+        self._callbacks.setdefault(text, []).append(callback)
+
+    def request_item(self, text, mapping, key):
+        """Store the translation of text in mapping[key] once run"""
+        self.request(text, functools.partial(mapping.__setitem__, key))
+
+    def run(self):
+        callbacks = self._callbacks
+        self._callbacks = {}
+
+        translations = {}
+        texts = []
+        for text in callbacks:
+            if text and text.strip():
+                texts.append(text)
+            else:
+                translations[text] = text
+
+        translations.update(TranslationMemoryQuery(self.session).fetch_translations(
+            texts, self.source_language, self.target_language_code))
+        missing = [text for text in texts if text not in translations]
+
+        if missing:
+            new_translations = self._translate(missing)
+            translations.update(new_translations)
+            self._remember(new_translations)
+
+        for (text, text_callbacks) in callbacks.items():
+            for callback in text_callbacks:
+                callback(translations[text])
+
+    def _batches(self, texts):
+        batch = []
+        length = 0
+        for text in texts:
+            if batch and (len(batch) == MAX_TEXTS_PER_REQUEST
+                          or length + len(text) > MAX_CHARACTERS_PER_REQUEST):
+                yield batch
+                batch = []
+                length = 0
+            batch.append(text)
+            length += len(text)
+        if batch:
+            yield batch
+
+    def _translate_batch(self, batch):
+        results = self.client.translate(batch, target_language=self.target_language_code, model=translate.NMT)
+        return [html.unescape(result['translatedText']) for result in results]
+
+    def _translate(self, texts):
+        batches = list(self._batches(texts))
+        self.request_count += len(batches)
+
+        # Only the requests run in the threads, the session stays in this one
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = executor.map(self._translate_batch, batches)
+
+            translations = {}
+            for (batch, translated_texts) in zip(batches, results):
+                translations.update(zip(batch, translated_texts))
+        return translations
+
+    def _remember(self, translations):
+        memories = [
+            TranslationMemory(
+                source_language=self.source_language,
+                target_language=self.target_language_code,
+                source_digest=TranslationMemory.digest(text),
+                source_text=text,
+                translated_text=translated_text,
+            )
+            for (text, translated_text) in translations.items()
+        ]
+        try:
+            with self.session.begin_nested():
+                self.session.add_all(memories)
+        except IntegrityError:
+            # Some were translated by another request at the same time
+            log.info('Translation memory of %d texts not saved' % len(memories))
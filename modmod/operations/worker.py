@@ -1,13 +1,13 @@
+import functools
 import os
 import sys
 import tempfile
 import logging
 import shutil
-import hashlib
-import base64
+import time
 from datetime import datetime
-from rq import Queue, use_connection
-from redis import Redis
+from rq import get_current_job
+from redis import ConnectionPool, Redis
 from google.cloud import storage
 import requests
 from sqlalchemy import engine_from_config
@@ -19,18 +19,40 @@ from ..models import (
     AssetQuery,
     AssetType,
     Block,
+    BuildSnapshotQuery,
     DBSession,
     CharacterQuery,
     LibraryQuery,
-    Macro,
     OiceQuery,
     ProjectExport,
+    RedisCatalogVersion,
     UserQuery,
+    catalog,
+    rebuild_word_counts,
+)
+from .asset import AudioTranscode
+from .asset_derivative import AssetDerivativeStore
+from .blob_store import BlobStore
+from .build_cache import BuildCache
+from .build_scheduler import (
+    BuildScheduler,
+    LANE_AUDIO,
+    LANE_BATCH,
+    LANE_EXPORT,
+    LANE_PREVIEW,
+    LANE_PUBLISH,
+)
+from .build_uploader import BuildUploader, LocalBucket
+from .import_checkpoint import ImportCheckpoint
+from .block import (
+    INSERT_CHUNK_SIZE,
+    POSITION_GAP,
+    delete_blocks,
+    insert_blocks,
+    lock_block_positions,
 )
-from .asset import audio_transcodec
-from .block import ensure_block_default_value, update_block_attributes
 from .script_exporter import ScriptExporter, KSScriptBuilder
-from .script_import_parser import parse_script, ScriptImportParserError
+from .script_import_parser import ScriptImportContext, ScriptImportParserError, parse_script_chunks
 from ..views.util import (
     update_user_mailchimp_stage,
     init_slack,
@@ -42,44 +64,133 @@ log = logging.getLogger(__name__)
 settings = None
 safile_settings = None
 
+# Shared by every enqueue of the process
+redis_pool = None
+scheduler = None
+
+
+def get_safile_settings(_settings):
+    return {
+        'file.storages': ['fs:' + _settings['upload_dir']],
+        'fs.' + _settings['upload_dir'] + '.asset_path': '/upload/',
+    }
+
 
 def init_worker(_settings, _safile_settings):
     global settings
     global safile_settings
+    global redis_pool
+    global scheduler
     settings = _settings
     safile_settings = _safile_settings
+    redis_pool = None
+    scheduler = None
+    # Every process reloads the catalog once an admin changed it
+    catalog.configure(RedisCatalogVersion(get_redis()))
 
 
-def run_export(_settings,
-               _safile_settings,
-               story_export_id):
+def setup_worker_process(_settings):
+    """Prepare a worker process once, before it runs any job
 
-    pyramid_safile.init_factory(_safile_settings)
+    The jobs share the settings, the safile factory and the connection pool
+    of the database engine set up here.
+    """
+    init_worker(_settings, get_safile_settings(_settings))
 
-    engine = engine_from_config(_settings)
+    pyramid_safile.init_factory(safile_settings)
+
+    engine = engine_from_config(settings)
     DBSession.configure(bind=engine)
 
+
+def get_redis():
+    global redis_pool
+    if redis_pool is None:
+        redis_pool = ConnectionPool(
+            host=settings["redis.host"],
+            port=settings["redis.port"],
+            password=settings["redis.password"],
+        )
+    return Redis(connection_pool=redis_pool)
+
+
+def get_scheduler():
+    global scheduler
+    if scheduler is None:
+        scheduler = BuildScheduler(get_redis())
+    return scheduler
+
+
+def worker_job(func):
+    """Leave the session clean for the next job run by the same process"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        job = get_current_job()
+        if job:
+            get_scheduler().job_started(job)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            transaction.abort()
+            DBSession.remove()
+    return wrapper
+
+
+def get_bucket_factory(_settings):
+    if _settings.get('gcloud.local_bucket_dir'):
+        return functools.partial(LocalBucket, _settings['gcloud.local_bucket_dir'])
+
+    def create_bucket():
+        # One client for every thread uploading, they are not thread safe
+        client = storage.Client.from_service_account_json(
+                os.path.abspath(_settings["gcloud.json_path"]),
+                project=_settings["gcloud.project_id"]
+            )
+        return client.get_bucket(_settings["gcloud.bucket_id"])
+    return create_bucket
+
+
+def get_derivative_store(_settings):
+    if _settings.get('o2.asset_derivative_dir'):
+        return AssetDerivativeStore(_settings['o2.asset_derivative_dir'], _settings['o2.resize_script'])
+    return None
+
+
+@worker_job
+def run_export(story_export_id):
     with transaction.manager:
         story_export = DBSession.query(ProjectExport) \
                                 .filter(ProjectExport.id == story_export_id) \
                                 .one()
 
-        characters = CharacterQuery(DBSession).fetch_by_oice(story_export.oice)
+        snapshot = BuildSnapshotQuery(DBSession).load(story_export.oice_id)
 
-        temp_zip = os.path.join(tempfile.mkdtemp(), 'data.zip')
+    # The export only reads the snapshot, no transaction is kept open meanwhile
+    temp_folder = tempfile.mkdtemp()
+    try:
+        temp_zip = os.path.join(temp_folder, 'data.zip')
         exporter = ScriptExporter(
-            _settings["o2.resize_script"],
-            story_export.oice,
+            settings["o2.resize_script"],
+            snapshot.oice,
             temp_zip,
-            characters=characters,
+            characters=snapshot.characters,
+            derivative_store=get_derivative_store(settings),
         )
 
         exporter.export()
 
-        factory = pyramid_safile.get_factory()
-        handle = factory.create_handle('data.zip', open(temp_zip, 'rb'))
+        with transaction.manager:
+            story_export = DBSession.query(ProjectExport) \
+                                    .filter(ProjectExport.id == story_export_id) \
+                                    .one()
+
+            factory = pyramid_safile.get_factory()
+            with open(temp_zip, 'rb') as zip_file:
+                handle = factory.create_handle('data.zip', zip_file)
 
-        story_export.exported_files = handle
+            story_export.exported_files = handle
+    finally:
+        shutil.rmtree(temp_folder)
 
     send_result_request('export', {
         'id': story_export_id,
@@ -95,37 +206,19 @@ class ExportWorker(object):
         self.story_export_id = story_export_id
 
     def run(self):
-        global settings
-        global safile_settings
-
-        redis = Redis(settings["redis.host"], settings["redis.port"], password=settings["redis.password"])
-        use_connection(redis)
-        q = Queue()
-
-        result = q.enqueue(
+        result = get_scheduler().enqueue(
+            LANE_EXPORT,
             run_export,
             args=(
-                settings,
-                safile_settings,
                 self.story_export_id,
             ),
-            timeout=600
         )
 
         print(result)
 
 
-def md5_b64(filename, blocksize=65536):
-    hash = hashlib.md5()
-    with open(filename, "rb") as f:
-        for block in iter(lambda: f.read(blocksize), b""):
-            hash.update(block)
-    return base64.standard_b64encode(hash.digest()).decode('ascii')
-
-
-def run_build(_settings,
-              _safile_settings,
-              oice_id,
+@worker_job
+def run_build(oice_id,
               ks_view_url,
               oice_communication_url,
               og_image_button_url,
@@ -133,106 +226,91 @@ def run_build(_settings,
               email,
               isPreview,
               batchId):
+    with transaction.manager:
+        snapshot = BuildSnapshotQuery(DBSession).load(oice_id)
+
+    oice = snapshot.oice
+    payload = {
+        'title': oice.filename,
+        'id': oice_id,
+        'url': ks_view_url
+    }
+    if batchId:
+        payload["batchId"] = batchId
+
+    # The build only reads the snapshot, no transaction is kept open meanwhile
+    try:
+        temp_folder = tempfile.mkdtemp()
+        output_path = temp_folder + '/build'
+        builder = KSScriptBuilder(
+            settings["o2.build_script"],
+            settings["o2.resize_script"],
+            oice,
+            output_path,
+            ks_view_url,
+            oice_communication_url,
+            og_image_button_url,
+            og_image_origin_url,
+            characters=snapshot.characters,
+            derivative_store=get_derivative_store(settings),
+            build_cache=BuildCache(settings['o2.build_cache_dir'])
+                        if settings.get('o2.build_cache_dir') else None,
+        )
 
-    pyramid_safile.init_factory(_safile_settings)
-
-    engine = engine_from_config(_settings)
-    DBSession.configure(bind=engine)
+        builder.build()
 
-    with transaction.manager:
-        oice = OiceQuery(DBSession).get_by_id(oice_id)
-        characters = CharacterQuery(DBSession).fetch_by_oice(oice)
+        view_path = settings["o2.output_dir"] % {'ks_uuid': oice.uuid}
 
-        payload = {
-            'title': oice.filename,
-            'id': oice_id,
-            'url': ks_view_url
-        }
-        if batchId:
-            payload["batchId"] = batchId
+        # remove the old version
+        if os.path.exists(view_path):
+            shutil.rmtree(view_path)
+        if not isPreview and settings["gcloud.enable_upload"] in {'1', 'true', True}:
+            manifest_path = None
+            if settings.get("gcloud.upload_manifest_dir"):
+                manifest_path = os.path.join(settings["gcloud.upload_manifest_dir"], oice.uuid + '.json')
 
-        try:
-            temp_folder = tempfile.mkdtemp()
-            output_path = temp_folder + '/build'
-            builder = KSScriptBuilder(
-                _settings["o2.build_script"],
-                _settings["o2.resize_script"],
-                oice,
-                output_path,
-                ks_view_url,
-                oice_communication_url,
-                og_image_button_url,
-                og_image_origin_url,
-                characters=characters,
+            uploader = BuildUploader(
+                get_bucket_factory(settings),
+                'view/' + oice.uuid,
+                manifest_path=manifest_path,
+                max_workers=int(settings.get("gcloud.upload_workers", 8)),
             )
+            uploader.upload(output_path)
 
-            builder.build()
-
-            view_path = _settings["o2.output_dir"] % {'ks_uuid': oice.uuid}
-
-            # remove the old version
-            if os.path.exists(view_path):
-                shutil.rmtree(view_path)
-            if not isPreview and _settings["gcloud.enable_upload"] in {'1', 'true', True}:
-                client = storage.Client.from_service_account_json(
-                        os.path.abspath(_settings["gcloud.json_path"]),
-                        project=_settings["gcloud.project_id"]
-                    )
-                if client:
-                    bucket = client.get_bucket(_settings["gcloud.bucket_id"])
-
-                    for dir_, _, files in os.walk(output_path):
-                        for fileName in files:
-                            relDir = os.path.relpath(dir_, output_path)
-                            if '.' != relDir:
-                                blob_path = os.path.join('view', oice.uuid, relDir, fileName)
-                            else:
-                                blob_path = os.path.join('view', oice.uuid, fileName)
-                            blob = bucket.get_blob(blob_path)
-                            if blob:
-                                md5_hash = blob.md5_hash
-                                if md5_hash:
-                                    if md5_b64(os.path.join(dir_, fileName)) == md5_hash:
-                                        log.info('Identical md5 exist on gcloud, skipping: ' + fileName)
-                                        continue
-                            else:
-                                blob = bucket.blob(blob_path)
-                            log.info('Uploading to google cloud: ' + fileName)
-                            blob.upload_from_filename(filename=os.path.join(dir_, fileName))
-                            if fileName == 'script.js':
-                                blob.cache_control = "private, max-age=0, no-transform"
-                                blob.patch()
-
-            if not isPreview:
-                oice.story.updated_at = datetime.utcnow()
-
-            # move the new build to folder
-            shutil.move(
-                output_path, _settings["o2.output_dir"] % {'ks_uuid': oice.uuid})
-            shutil.rmtree(temp_folder)
-        except Exception:
-            if email:
-                update_user_mailchimp_stage(email=email, stage=3)
-
-            log.exception('')
-
-            payload["message"] = str(sys.exc_info()[1])
-            send_result_request('build', payload)
+        # move the new build to folder
+        shutil.move(
+            output_path, settings["o2.output_dir"] % {'ks_uuid': oice.uuid})
+        shutil.rmtree(temp_folder)
 
-        else:
-            if init_slack(_settings) and not isPreview and oice.is_public():
-                author = oice.story.users[0]
-                if not author.is_admin():
-                    send_oice_publish_message_into_slack(
-                        author,
-                        oice,
-                        ks_view_url,
-                        og_image_origin_url)
-            if email:
-                update_user_mailchimp_stage(email=email, stage=4)
+        if not isPreview:
+            with transaction.manager:
+                OiceQuery(DBSession).get_by_id(oice_id).story.updated_at = datetime.utcnow()
+    except Exception:
+        if email:
+            update_user_mailchimp_stage(email=email, stage=3)
+
+        log.exception('')
+
+        payload["message"] = str(sys.exc_info()[1])
+        send_result_request('build', payload)
 
-            payload["message"] = "ok"
-            send_result_request('build', payload)
+    else:
+        if init_slack(settings) and not isPreview:
+            with transaction.manager:
+                oice = OiceQuery(DBSession).get_by_id(oice_id)
+                if oice.is_public():
+                    author = oice.story.users[0]
+                    if not author.is_admin():
+                        send_oice_publish_message_into_slack(
+                            author,
+                            oice,
+                            ks_view_url,
+                            og_image_origin_url)
+        if email:
+            update_user_mailchimp_stage(email=email, stage=4)
+
+        payload["message"] = "ok"
+        send_result_request('build', payload)
 
 
 class KSBuildWorker(object):
@@ -247,17 +325,18 @@ class KSBuildWorker(object):
         self.og_image_origin_url = og_image_origin_url
 
     def run(self, email, isPreview = False, batchId = ""):
-        global settings
-        global safile_settings
+        if isPreview:
+            lane = LANE_PREVIEW
+        elif batchId:
+            lane = LANE_BATCH
+        else:
+            lane = LANE_PUBLISH
 
-        redis = Redis(settings["redis.host"], settings["redis.port"], password=settings["redis.password"])
-        use_connection(redis)
-        q = Queue()
-        result = q.enqueue(
+        # A build still waiting for the same oice is replaced by this one
+        result = get_scheduler().enqueue(
+            lane,
             run_build,
             args=(
-                settings,
-                safile_settings,
                 self.oice_id,
                 self.ks_view_url,
                 self.oice_communication_url,
@@ -267,12 +346,22 @@ class KSBuildWorker(object):
                 isPreview,
                 batchId
             ),
-            timeout=600
+            key=self.oice_id,
+            batch_id=batchId,
         )
 
 
-def import_oice_script(_settings, _safile_settings, user_email, job_id, oice_id, script, language):
+@worker_job
+def import_oice_script(user_email, job_id, oice_id, script_path, language):
+    """Append the blocks of a script spooled at script_path to an oice
+
+    The script is read twice, a chunk of lines at a time: once to validate
+    what it uses, then to insert its blocks, committing every chunk. A run of
+    the same job after a crash goes on from its ImportCheckpoint, an import
+    failing after some chunks were committed deletes their blocks.
+    """
     socket_url = 'import/' + job_id
+    checkpoint = ImportCheckpoint(get_redis(), job_id)
 
     try:
         # Parsing
@@ -280,17 +369,19 @@ def import_oice_script(_settings, _safile_settings, user_email, job_id, oice_id,
             'stage': 'parsing',
         })
 
+        context = ScriptImportContext()
+        line_count = 0
+        with open(script_path, encoding='utf-8') as script:
+            for (_, next_line, _) in parse_script_chunks(context, script):
+                line_count = next_line - 1
+
         used_character_ids, \
         used_asset_ids, \
         used_macro_names, \
-        serialized_blocks = parse_script(script)
-
-        pyramid_safile.init_factory(_safile_settings)
-
-        engine = engine_from_config(_settings)
-        DBSession.configure(bind=engine)
+        _ = context.result()
 
         oice = OiceQuery(DBSession).get_by_id(oice_id)
+        oice_id = oice.id
         used_library_ids = set()
 
         send_result_request(socket_url, {
@@ -334,53 +425,71 @@ def import_oice_script(_settings, _safile_settings, user_email, job_id, oice_id,
                           })
         user.libraries_selected.extend(used_libraries)
 
-        # Insert blocks to database
-        macros = DBSession.query(Macro).filter(Macro.tagname.in_(used_macro_names)).all()
-        macros_dict = dict((macro.tagname, macro) for macro in macros)
-
-        parent_block = DBSession.query(Block) \
-                                .filter(Block.oice_id == oice.id) \
-                                .order_by(Block.position.desc()) \
-                                .first()
-        position = parent_block.position + 1 if parent_block else 0
-
-        characters_dict = dict((character.id, character) for character in characters)
-
-        for index, block_dict in enumerate(serialized_blocks):
-            macro_name = block_dict['macro']
-            macro = macros_dict[macro_name]
-
-            block = Block(macro=macro, oice=oice, position=position + index)
-            DBSession.add(block)
-
-            ensure_block_default_value(DBSession, block, language)
-
-            attributes = block_dict['attributes']
-            if macro_name == 'characterdialog':
-                character = characters_dict[attributes['character']]
-
-                if 'name' in attributes and not character.is_generic:
-                    raise ScriptImportParserError('ERR_IMPORT_SCRIPT_CHARACTER_FORBID_RENAME', {
-                              'characterId': character.id,
-                          })
-
-                # set fg as the first one for character
-                attributes['fg'] = next(fg.id for fg in character.fgimages)
+        # The session is closed by every commit, keep what the chunks need
+        macros_dict = dict((name, catalog.get_macro_by_tagname(name)) for name in used_macro_names)
+        generic_character_ids = set(character.id for character in characters if character.is_generic)
+        # fg of a character is set as the first one
+        first_fg_ids = dict(
+            (character.id, next((fg.id for fg in character.fgimages), None))
+            for character in characters
+        )
 
-            update_block_attributes(DBSession, block, attributes, language)
+        start_line = checkpoint.get_line(
+            lambda block_id: DBSession.query(Block.id).filter(Block.id == block_id).first() is not None)
 
-            send_result_request(socket_url, {
-                'stage': 'inserting',
-                'progress': float(index + 1) / len(serialized_blocks) * 100,
-            })
+        # Insert blocks to database
+        reporter = ProgressReporter(socket_url, 'inserting')
+        context = ScriptImportContext()
+        with open(script_path, encoding='utf-8') as script:
+            for (first_line, next_line, serialized_blocks) in parse_script_chunks(context, script):
+                if first_line < start_line:
+                    # Committed by a previous run of the job
+                    continue
+
+                new_blocks = []
+                for block_dict in serialized_blocks:
+                    macro_name = block_dict['macro']
+                    macro = macros_dict[macro_name]
+
+                    attributes = block_dict['attributes']
+                    if macro_name == 'characterdialog':
+                        character_id = attributes['character']
+
+                        if 'name' in attributes and character_id not in generic_character_ids:
+                            raise ScriptImportParserError('ERR_IMPORT_SCRIPT_CHARACTER_FORBID_RENAME', {
+                                      'characterId': character_id,
+                                  })
+
+                        attributes['fg'] = first_fg_ids[character_id]
+
+                    new_blocks.append((macro.id, attributes))
+
+                lock_block_positions(DBSession, oice_id)
+                last_position = DBSession.query(Block.position) \
+                                         .filter(Block.oice_id == oice_id) \
+                                         .order_by(Block.position.desc(), Block.id.desc()) \
+                                         .with_for_update() \
+                                         .first()
+                position = last_position.position + POSITION_GAP if last_position else POSITION_GAP
+
+                block_ids = insert_blocks(DBSession, oice_id, new_blocks, language, position)
+                checkpoint.begin_chunk(next_line, block_ids)
+                transaction.commit()
+                checkpoint.commit_chunk(next_line)
+
+                reporter.update(next_line - 1, line_count)
 
     except ScriptImportParserError as error:
+        transaction.abort()
+        remove_imported_blocks(oice_id, checkpoint)
         send_result_request(socket_url, {
             'error': True,
             'key': error.key,
             'interpolation': error.interpolation,
         })
     except Exception as error:
+        transaction.abort()
+        remove_imported_blocks(oice_id, checkpoint)
         send_result_request(socket_url, {
             'error': True,
             'key': 'ERR_IMPORT_SCRIPT_UNKNOWN_ERROR',
@@ -388,61 +497,80 @@ def import_oice_script(_settings, _safile_settings, user_email, job_id, oice_id,
                 'message': str(error),
             },
         })
+    except BaseException:
+        # Interrupted, the next run of the job resumes from its checkpoint
+        script_path = None
+        raise
     else:
         transaction.commit()
+        checkpoint.clear()
         send_result_request(socket_url, {
             'stage': 'finished',
         })
+    finally:
+        if script_path:
+            os.remove(script_path)
+
+
+def remove_imported_blocks(oice_id, checkpoint):
+    """Delete the blocks committed by a failed import, the oice is left as it was"""
+    removed = False
+    with transaction.manager:
+        for block_ids in checkpoint.iter_block_ids(INSERT_CHUNK_SIZE):
+            delete_blocks(DBSession, oice_id, block_ids)
+            removed = True
+        if removed:
+            rebuild_word_counts(DBSession, oice_id)
+    checkpoint.clear()
 
 class ImportOiceWorker(object):
 
-    def __init__(self, user_email, job_id, oice, script_file, language):
+    def __init__(self, user_email, job_id, oice, script_path, language):
         super().__init__()
 
         self.user_email = user_email
         self.job_id = job_id
         self.oice = oice
-        self.script_file = script_file
+        self.script_path = script_path
         self.language = language
 
     def run(self):
-        redis = Redis(
-            settings["redis.host"],
-            settings["redis.port"],
-            password=settings["redis.password"],
-        )
-        use_connection(redis)
-
-        result = Queue().enqueue(
+        result = get_scheduler().enqueue(
+            LANE_EXPORT,
             import_oice_script,
             args=(
-                settings,
-                safile_settings,
                 self.user_email,
                 self.job_id,
                 self.oice,
-                self.script_file,
+                self.script_path,
                 self.language,
             ),
-            timeout=600
         )
 
-def transcode_audio_assets(_settings, _safile_settings, job_id, assets, asset_files):
-    pyramid_safile.init_factory(_safile_settings)
-
-    engine = engine_from_config(_settings)
-    DBSession.configure(bind=engine)
-
+@worker_job
+def transcode_audio_assets(job_id, asset_paths):
+    """Transcode the audio files staged for assets, asset_paths is a list of
+    (asset id, path) removed once done"""
     socket_url = 'audio/convert/' + job_id
+    transcodes = []
 
     try:
-        assets = AssetQuery(DBSession).get_by_ids([asset.id for asset in assets])
+        assets = AssetQuery(DBSession).get_by_ids([asset_id for (asset_id, _) in asset_paths])
+        assets_dict = dict((asset.id, asset) for asset in assets)
         updated_library = False
 
-        for asset, asset_file in zip(assets, asset_files):
-            handle = audio_transcodec(asset.filename, asset_file)
+        # Every encode starts at once, the pool bounds how many run
+        for (asset_id, path) in asset_paths:
+            asset = assets_dict[asset_id]
+            transcodes.append((asset, AudioTranscode(asset.filename, path)))
+
+        blob_store = BlobStore(DBSession)
+        for index, (asset, transcode) in enumerate(transcodes):
+            handle = transcode.store(blob_store)
             if handle:
+                blob_store.release(asset.storage)
                 asset.import_handle(handle)
+                asset.duration = transcode.duration
                 DBSession.add(asset)
             elif not asset.storage:
                 send_result_request(socket_url, {
@@ -457,6 +585,7 @@ def transcode_audio_assets(_settings, _safile_settings, job_id, assets, asset_fi
                 'stage': 'transcode',
                 'assetId': asset.id,
                 'error': None if handle else 'ERR_AUDIO_TRANSCODE_FAILURE',
+                'progress': float(index + 1) / len(transcodes) * 100,
             })
 
             if not updated_library and handle:
@@ -478,36 +607,58 @@ def transcode_audio_assets(_settings, _safile_settings, job_id, assets, asset_fi
         send_result_request(socket_url, {
             'stage': 'finished',
         })
+    finally:
+        for (_, transcode) in transcodes:
+            transcode.close()
+        for (_, path) in asset_paths:
+            os.remove(path)
 
 class AudioFileWorker(object):
 
-    def __init__(self, job_id, assets, asset_files):
+    def __init__(self, job_id, asset_paths):
         super().__init__()
         self.job_id = job_id
-        self.assets = assets
-        self.asset_files = asset_files
+        self.asset_paths = asset_paths
 
     def run(self):
-        redis = Redis(
-            settings["redis.host"],
-            settings["redis.port"],
-            password=settings["redis.password"],
-        )
-        use_connection(redis)
-
-        result = Queue().enqueue(
+        result = get_scheduler().enqueue(
+            LANE_AUDIO,
             transcode_audio_assets,
             args=(
-                settings,
-                safile_settings,
                 self.job_id,
-                self.assets,
-                self.asset_files,
+                self.asset_paths,
             ),
-            timeout=600
         )
 
 
+class ProgressReporter(object):
+    """Send the progress of a stage, at most every step percent or every
+    interval seconds, instead of after every item"""
+
+    def __init__(self, socket_url, stage, step=5, interval=1):
+        self.socket_url = socket_url
+        self.stage = stage
+        self.step = step
+        self.interval = interval
+        self.sent_progress = None
+        self.sent_at = 0
+
+    def update(self, done, total):
+        progress = float(done) / total * 100 if total else 100
+        now = time.monotonic()
+        if self.sent_progress is not None and progress < 100 \
+                and progress - self.sent_progress < self.step \
+                and now - self.sent_at < self.interval:
+            return
+
+        self.sent_progress = progress
+        self.sent_at = now
+        send_result_request(self.socket_url, {
+            'stage': self.stage,
+            'progress': progress,
+        })
+
+
 def send_result_request(path, data={}):
 
     host = os.environ.get('MODMOD_SOCKETIO_HOST', '127.0.0.1')
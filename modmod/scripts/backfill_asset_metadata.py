@@ -0,0 +1,67 @@
+import os
+import sys
+import transaction
+
+from sqlalchemy import engine_from_config
+from sqlalchemy.sql.expression import null
+import pyramid_safile
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from ..models import (
+    DBSession,
+    Asset,
+    )
+from ..operations.asset import update_asset_metadata
+
+
+BATCH_SIZE = 100
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri>\n'
+          'Store the size and duration of assets uploaded before they were recorded\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) != 2:
+        usage(argv)
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+    pyramid_safile.init_factory({
+        'file.storages': ['fs:' + settings['upload_dir']],
+        'fs.' + settings['upload_dir'] + '.asset_path': '/upload/',
+    })
+
+    last_id = 0
+    count = 0
+    while True:
+        with transaction.manager:
+            assets = DBSession.query(Asset) \
+                .filter(Asset.id > last_id) \
+                .filter(Asset.storage != null()) \
+                .filter(Asset.width == null()) \
+                .filter(Asset.duration == null()) \
+                .order_by(Asset.id) \
+                .limit(BATCH_SIZE) \
+                .all()
+            if not assets:
+                break
+
+            for asset in assets:
+                update_asset_metadata(asset)
+                count += 1
+            last_id = assets[-1].id
+
+        print('Processed assets up to id %d' % last_id)
+
+    print('Updated %d assets' % count)
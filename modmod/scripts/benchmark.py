@@ -0,0 +1,258 @@
+import argparse
+import io
+import os
+import resource
+import sys
+import time
+
+from pyramid.paster import get_appsettings
+from sqlalchemy import engine_from_config, event
+import transaction
+
+from ..models import (
+    Attribute,
+    AttributeDefinition,
+    Block,
+    DBSession,
+    Macro,
+    Oice,
+    Story,
+    StoryLocalization,
+)
+from ..operations import block as block_operations
+from ..operations.script_export_serializer import ScriptVisitor
+from ..operations.script_import_parser import ScriptImportParser, parse_script
+from ..operations.script_parser import KsParser, parse as parse_ks
+
+
+# tagname: [(attribute_name, type, localizable, value)]
+SCRIPT_MACROS = {
+    'addTalk': [('talk', 'paragraph', True, 'Line %(index)d of the synthetic oice\nwith a second line; and 50%% symbols')],
+    'aside': [('name', 'string', True, 'Narrator'), ('text', 'paragraph', True, 'Aside %(index)d')],
+    'comment': [('text', 'string', True, 'Comment %(index)d')],
+    'wait': [('time', 'number', False, '500')],
+    'label': [('name', 'string', True, 'label%(index)d'), ('caption', 'string', True, 'Label %(index)d')],
+}
+
+SCRIPT_SEQUENCE = ['addTalk', 'addTalk', 'aside', 'addTalk', 'comment', 'wait', 'addTalk']
+
+
+def get_peak_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def format_bytes(size):
+    return '%.1f MiB' % (size / 1024 / 1024)
+
+
+def build_oice(block_count, languages):
+    """Synthetic oice made of transient models, nothing touches the database"""
+    story = Story(name='Benchmark', language=languages[0])
+    for language in languages[1:]:
+        story.localizations[language] = StoryLocalization(language=language, name='Benchmark')
+
+    oice = Oice(filename='benchmark', story=story)
+
+    macros = {}
+    for (macro_id, (tagname, attributes)) in enumerate(sorted(SCRIPT_MACROS.items()), start=1):
+        macro = Macro(id=macro_id, name=tagname, tagname=tagname)
+        definitions = [
+            AttributeDefinition(name=attribute_name, attribute_name=attribute_name, asset_type=asset_type,
+                                localizable=localizable, macro_id=macro_id)
+            for (attribute_name, asset_type, localizable, _) in attributes
+        ]
+        macros[tagname] = (macro, definitions)
+
+    blocks = []
+    for index in range(block_count):
+        tagname = 'label' if index % 100 == 0 else SCRIPT_SEQUENCE[index % len(SCRIPT_SEQUENCE)]
+        macro, definitions = macros[tagname]
+        block = Block(id=index + 1, macro=macro, position=index)
+        block.oice = oice
+        block.oice_id = 1
+
+        for (definition, (_, _, localizable, value)) in zip(definitions, SCRIPT_MACROS[tagname]):
+            for language in (languages if localizable else [None]):
+                block.attributes.append(Attribute(
+                    attribute_definition=definition,
+                    value=value % {'index': index},
+                    language=language,
+                ))
+        blocks.append(block)
+
+    oice.blocks = blocks
+    return oice
+
+
+def benchmark_script(args):
+    languages = args.languages.split(',')
+
+    start = time.time()
+    oice = build_oice(args.blocks, languages)
+    print('Built oice of %d blocks in %.2fs, peak RSS %s' % (
+        args.blocks, time.time() - start, format_bytes(get_peak_rss())))
+
+    visitor = ScriptVisitor(oice.story, [], scale_factor=0.5)
+    base_rss = get_peak_rss()
+
+    with open(os.devnull, 'w') as output:
+        start = time.time()
+        for language in languages:
+            visitor.write_oice(oice, language, output)
+            output.write('\n@return')
+        elapsed = time.time() - start
+
+    block_count = args.blocks * len(languages)
+    print('Wrote %d languages in %.2fs, %d blocks/s, peak RSS %s (+%s)' % (
+        len(languages), elapsed, block_count / elapsed,
+        format_bytes(get_peak_rss()), format_bytes(get_peak_rss() - base_rss)))
+
+
+def build_import_script(line_count, index):
+    lines = [
+        '<declaration>',
+        'version = 1',
+        '[hero] = 1 @ Hero',
+        '[friend] = 2',
+        '{street} = 3',
+        '</declaration>',
+        '<script>',
+    ]
+    for line_index in range(line_count):
+        if line_index % 50 == 0:
+            lines.append('{street}')
+        elif line_index % 7 == 0:
+            lines.append('// Scene %d of script %d' % (line_index, index))
+        elif line_index % 5 == 0:
+            lines.append('[narr]: Meanwhile **outside** !~ 500~!')
+        else:
+            lines.append('[%s]: Line %d of script %d' % ('hero' if line_index % 2 else 'friend', line_index, index))
+    lines.append('</script>')
+    return '\n'.join(lines) + '\n'
+
+
+def time_parses(name, parse, scripts):
+    line_count = sum(script.count('\n') for script in scripts)
+    start = time.time()
+    for script in scripts:
+        parse(script)
+    elapsed = time.time() - start
+    print('%s: %.2fs, %d lines/s' % (name, elapsed, line_count / elapsed))
+
+
+def benchmark_parse(args):
+    output = io.StringIO()
+    oice = build_oice(args.lines, ['en'])
+    ScriptVisitor(oice.story, [], scale_factor=0.5).write_oice(oice, 'en', output)
+    ks_script = output.getvalue()
+    ks_scripts = [ks_script] * args.scripts
+    import_scripts = [build_import_script(args.lines, index) for index in range(args.scripts)]
+
+    # The grammar used to be built by every call to the parse functions
+    time_parses('ks, grammar built per parse', lambda script: KsParser().parse(script), ks_scripts)
+    time_parses('ks, grammar built once', parse_ks, ks_scripts)
+    time_parses('import, grammar built per parse', lambda script: ScriptImportParser().parse(script), import_scripts)
+    time_parses('import, grammar built once', parse_script, import_scripts)
+
+
+class QueryCounter(object):
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
+
+
+def update_blocks_one_by_one(block_ids, round_index, language):
+    for block_id in block_ids:
+        block = DBSession.query(Block).filter(Block.id == block_id).first()
+        block_operations.update_block_attributes(
+            DBSession, block, {'text': 'Round %d' % round_index, 'time': str(round_index)}, language)
+        block.serialize(language)
+    DBSession.flush()
+
+
+def update_blocks_batched(block_ids, round_index, language):
+    blocks = block_operations.load_blocks(DBSession, block_ids)
+    block_operations.update_blocks_attributes(DBSession, [
+        (blocks[block_id], {'text': 'Round %d' % round_index, 'time': str(round_index)}, language)
+        for block_id in block_ids
+    ])
+    for block in block_operations.load_blocks(DBSession, block_ids, refresh=True).values():
+        block.serialize(language)
+
+
+def benchmark_update_blocks(args):
+    settings = get_appsettings(args.config_uri)
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+    counter = QueryCounter(engine)
+    language = 'en'
+
+    # Everything is rolled back at the end, the database is left untouched
+    transaction.begin()
+    try:
+        story = Story(name='Benchmark', language=language)
+        oice = Oice(filename='benchmark', story=story, order=0)
+        macro = Macro(name='benchmark', tagname='benchmark', content='')
+        definitions = {
+            'text': AttributeDefinition(name='text', attribute_name='text', asset_type='paragraph',
+                                        localizable=True, macro=macro),
+            'time': AttributeDefinition(name='time', attribute_name='time', asset_type='number',
+                                        localizable=False, macro=macro),
+        }
+        DBSession.add_all([story, oice, macro] + list(definitions.values()))
+
+        blocks = []
+        for index in range(args.blocks):
+            block = Block(macro=macro, oice=oice, position=(index + 1) * block_operations.POSITION_GAP)
+            block.attributes.append(Attribute(attribute_definition=definitions['text'],
+                                              value='Block %d' % index, language=language))
+            blocks.append(block)
+        DBSession.add_all(blocks)
+        DBSession.flush()
+        block_ids = [block.id for block in blocks]
+
+        for (name, update) in [('one by one', update_blocks_one_by_one), ('batched', update_blocks_batched)]:
+            DBSession.expire_all()
+            counter.count = 0
+            start = time.time()
+            for round_index in range(args.rounds):
+                update(block_ids, round_index, language)
+                DBSession.expire_all()
+            elapsed = time.time() - start
+            print('%s: %.1f ms and %d queries per save of %d blocks' % (
+                name, elapsed * 1000 / args.rounds, counter.count / args.rounds, args.blocks))
+    finally:
+        transaction.abort()
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]), description='Benchmarks of hot paths')
+    subparsers = parser.add_subparsers(dest='command')
+
+    script_parser = subparsers.add_parser('script', help='Serialize a synthetic oice into ks scripts')
+    script_parser.add_argument('--blocks', type=int, default=20000)
+    script_parser.add_argument('--languages', default='zh-HK,en,ja')
+    script_parser.set_defaults(func=benchmark_script)
+
+    parse_parser = subparsers.add_parser('parse', help='Parse ks and import scripts')
+    parse_parser.add_argument('--scripts', type=int, default=200)
+    parse_parser.add_argument('--lines', type=int, default=500, help='Blocks of each script')
+    parse_parser.set_defaults(func=benchmark_parse)
+
+    update_parser = subparsers.add_parser('update-blocks', help='Save blocks like PUT /blocks, one by one and batched')
+    update_parser.add_argument('config_uri', help='ini file of the database to use, nothing is committed')
+    update_parser.add_argument('--blocks', type=int, default=50)
+    update_parser.add_argument('--rounds', type=int, default=20)
+    update_parser.set_defaults(func=benchmark_update_blocks)
+
+    args = parser.parse_args(argv[1:])
+    if not getattr(args, 'func', None):
+        parser.print_help()
+        sys.exit(1)
+
+    args.func(args)
@@ -0,0 +1,82 @@
+import argparse
+import datetime
+import os
+import sys
+import transaction
+
+import pyramid_safile
+from sqlalchemy import engine_from_config
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from ..models import (
+    DBSession,
+    StorageBlobQuery,
+    )
+from ..operations.blob_store import remove_handle_files
+from ..operations.worker import get_safile_settings
+
+
+BATCH_SIZE = 100
+
+
+def collect_storage_blobs(min_age, dry_run=False):
+    """Remove the storage blobs unreferenced for min_age, returns their number"""
+    updated_before = datetime.datetime.utcnow() - min_age
+    last_id = 0
+    count = 0
+    while True:
+        handles = []
+        with transaction.manager:
+            query = StorageBlobQuery(DBSession)
+            blob_ids = query.fetch_unreferenced_ids(updated_before, last_id, BATCH_SIZE)
+            if not blob_ids:
+                break
+
+            for blob_id in blob_ids:
+                # Checked again under the lock, it may be referenced since it was listed
+                blob = query.lock_by_id(blob_id)
+                if blob and blob.ref_count <= 0:
+                    handles.append(blob.storage)
+                    if not dry_run:
+                        DBSession.delete(blob)
+            last_id = blob_ids[-1]
+
+        # Only once no row can reference them anymore
+        for handle in handles:
+            if dry_run:
+                print('Would remove %s' % handle.dst)
+            else:
+                remove_handle_files(handle)
+        count += len(handles)
+
+    return count
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Remove the files of the storage blobs no longer referenced',
+        epilog='example: "%s development.ini"' % os.path.basename(argv[0]),
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('--min-age', type=float, default=24, metavar='HOURS',
+                        help='Keep the blobs unreferenced for less than HOURS hours (default: 24)')
+    parser.add_argument('--dry-run', action='store_true', help='List the files without removing them')
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri)
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+    # The handles of the blobs are restored by the factory
+    pyramid_safile.init_factory(get_safile_settings(settings))
+
+    count = collect_storage_blobs(datetime.timedelta(hours=args.min_age), args.dry_run)
+    if args.dry_run:
+        print('Found %d storage blobs to remove' % count)
+    else:
+        print('Removed %d storage blobs' % count)
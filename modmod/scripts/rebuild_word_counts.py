@@ -0,0 +1,62 @@
+import os
+import sys
+import transaction
+
+from sqlalchemy import engine_from_config
+from zope.sqlalchemy import mark_changed
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from ..models import (
+    DBSession,
+    Oice,
+    rebuild_word_counts,
+    )
+
+
+BATCH_SIZE = 100
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri>\n'
+          'Recompute the word counts of every oice from its attributes\n'
+          '(example: "%s development.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) != 2:
+        usage(argv)
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+
+    last_id = 0
+    count = 0
+    while True:
+        with transaction.manager:
+            oice_ids = [
+                oice_id for (oice_id,) in DBSession.query(Oice.id)
+                                                   .filter(Oice.id > last_id)
+                                                   .order_by(Oice.id)
+                                                   .limit(BATCH_SIZE)
+            ]
+            if not oice_ids:
+                break
+
+            for oice_id in oice_ids:
+                rebuild_word_counts(DBSession, oice_id)
+            # The counts are written by plain statements
+            mark_changed(DBSession())
+            last_id = oice_ids[-1]
+            count += len(oice_ids)
+
+        print('Processed oices up to id %d' % last_id)
+
+    print('Counted the words of %d oices' % count)
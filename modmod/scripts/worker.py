@@ -0,0 +1,77 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+from rq.worker import SimpleWorker
+
+from ..operations.build_scheduler import LANES
+from ..operations.worker import (
+    get_redis,
+    get_scheduler,
+    setup_worker_process,
+    )
+
+
+log = logging.getLogger(__name__)
+
+
+def get_lane_concurrency(settings, lane):
+    return int(settings.get('worker.concurrency.' + lane, 1))
+
+
+def work(config_uri, lanes, burst):
+    setup_logging(config_uri)
+    setup_worker_process(get_appsettings(config_uri))
+
+    # Jobs run in this process so that they share its engine and settings
+    scheduler = get_scheduler()
+    worker = SimpleWorker([scheduler.queue(lane) for lane in lanes], connection=get_redis())
+    worker.work(burst=burst)
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Run the import, export and build jobs, with '
+                    'worker.concurrency.<lane> processes for each lane',
+        epilog='example: "%s development.ini"' % os.path.basename(argv[0]),
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('lanes', nargs='*', default=list(LANES), metavar='lane',
+                        help='Lanes to serve among: ' + ', '.join(LANES))
+    parser.add_argument('--burst', action='store_true', help='Quit once the queues are empty')
+    args = parser.parse_args(argv[1:])
+
+    for lane in args.lanes:
+        if lane not in LANES:
+            parser.error('unknown lane: ' + lane)
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri)
+    if not os.path.isdir(settings.get('o2.upload_spool_dir') or ''):
+        parser.error('o2.upload_spool_dir must be a directory shared with the web processes')
+
+    processes = []
+    for lane in args.lanes:
+        for _ in range(get_lane_concurrency(settings, lane)):
+            process = multiprocessing.Process(target=work, args=(args.config_uri, [lane], args.burst))
+            process.start()
+            processes.append(process)
+        log.info('Started %d workers for lane %s' % (get_lane_concurrency(settings, lane), lane))
+
+    def terminate(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    for process in processes:
+        process.join()
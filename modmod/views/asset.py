@@ -1,16 +1,18 @@
 from datetime import datetime
-import io
 import json
 import os.path
+import shutil
+import tempfile
 import uuid
 from pyramid.httpexceptions import HTTPFound
-import pyramid_safile
 from cornice import Service
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.expression import false, or_
 from pyramid.httpexceptions import HTTPForbidden
+import transaction
 from modmod.exc import ValidationError
 
+from ..config import get_o2_upload_spool_dir
 from ..models import (
     DBSession,
     Asset,
@@ -26,6 +28,7 @@ from ..models import (
     UserQuery,
 )
 from ..operations import asset as operations
+from ..operations.blob_store import BlobStore
 from ..operations.worker import AudioFileWorker
 from ..operations.image_handler import ResizeBackgroundImage
 
@@ -100,15 +103,53 @@ def list_asset(request):
     }
 
 
+def resize_background_image(handle):
+    ResizeBackgroundImage(handle.dst).run()
+
+
 def validate_audio_format(extension):
     if not extension.lower() in SUPPORT_AUDIO_FORMATS:
         raise ValidationError('ERR_AUDIO_FORMAT_UNSUPPORTED')
 
 
+def remove_audio_files(asset_paths):
+    for (_, path) in asset_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
 def handle_audio_asset_files(job_id, assets, asset_files):
-    audio_bytes_list = [io.BufferedReader(f.file).read() for f in asset_files]
-    worker = AudioFileWorker(job_id, assets, audio_bytes_list)
-    worker.run()
+    # Staged to files in the spool directory shared with the workers, instead of
+    # passing their bytes through Redis, once nothing can abort the request
+    uploads = [(asset.id, asset_file) for (asset, asset_file) in zip(assets, asset_files)]
+    asset_paths = []
+
+    def stage_files():
+        try:
+            for (asset_id, asset_file) in uploads:
+                with tempfile.NamedTemporaryFile(dir=get_o2_upload_spool_dir(), prefix='audio-',
+                                                 suffix=os.path.splitext(asset_file.filename)[1],
+                                                 delete=False) as spool:
+                    asset_paths.append((asset_id, spool.name))
+                    shutil.copyfileobj(asset_file.file, spool)
+        except Exception:
+            remove_audio_files(asset_paths)
+            raise
+
+    def run_worker(success):
+        # The worker loads the assets, it must not run before they are committed
+        if not success:
+            remove_audio_files(asset_paths)
+            return
+        try:
+            AudioFileWorker(job_id, asset_paths).run()
+        except Exception:
+            remove_audio_files(asset_paths)
+            raise
+
+    current = transaction.get()
+    current.addBeforeCommitHook(stage_files)
+    current.addAfterCommitHook(run_worker)
 
 
 def create_asset(asset_types, asset_type, meta, asset_file, library_id, user_email, order):
@@ -132,11 +173,8 @@ def create_asset(asset_types, asset_type, meta, asset_file, library_id, user_ema
     if asset_type == 'bgm' or asset_type == 'se':
         validate_audio_format(file_extension)
     else:
-        factory = pyramid_safile.get_factory()
-        handle = factory.create_handle(asset_file.filename, asset_file.file)
-        if asset_type == 'bgimage':
-            bgImageHandler = ResizeBackgroundImage(handle.dst)
-            bgImageHandler.run()
+        process = resize_background_image if asset_type == 'bgimage' else None
+        handle = BlobStore(DBSession).store(asset_file.filename, asset_file.file, process)
 
     asset = Asset.from_handle(handle=handle,
                               asset_types=asset_types,
@@ -148,6 +186,7 @@ def create_asset(asset_types, asset_type, meta, asset_file, library_id, user_ema
                               users=users,
                               credits_url=credits_url,
                               order=order)
+    operations.update_asset_metadata(asset)
 
     return asset
 
@@ -187,6 +226,7 @@ def add_asset(request):
             asset = create_asset(asset_types, asset_type, meta, asset_file, library_id, user_email, order)
             DBSession.add(asset)
             DBSession.flush()
+            operations.create_asset_derivatives(asset)
 
             if 'characterId' in meta:
                 character_id = meta['characterId']
@@ -287,13 +327,14 @@ def update_asset(request):
                 validate_audio_format(file_extension)
                 handle_audio_asset_files(job_id, [asset], [asset_file])
             else:
-                factory = pyramid_safile.get_factory()
-                handle = factory.create_handle(asset_file.filename, asset_file.file)
-                if asset.asset_types[0].folder_name == 'bgimage':
-                    bgImageHandler = ResizeBackgroundImage(handle.dst)
-                    bgImageHandler.run()
+                process = resize_background_image \
+                    if asset.asset_types[0].folder_name == 'bgimage' else None
+                handle = BlobStore(DBSession).replace(asset.storage, asset_file.filename,
+                                                      asset_file.file, process)
 
                 asset.import_handle(handle)
+                operations.update_asset_metadata(asset)
+                operations.create_asset_derivatives(asset)
 
             DBSession.add(asset)
 
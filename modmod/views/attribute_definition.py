@@ -5,7 +5,8 @@ from modmod.exc import ValidationError
 
 from ..models import (
     DBSession,
-    AttributeDefinition
+    AttributeDefinition,
+    catalog,
 )
 
 log = logging.getLogger(__name__)
@@ -42,6 +43,7 @@ def add_attribute_definition(request):
             localizable=localizable)
         DBSession.add(attribute_definition)
         DBSession.flush()
+        catalog.invalidate_after_commit()
 
     except ValueError as e:
         raise ValidationError(str(e))
@@ -76,6 +78,7 @@ def update_attribute_definition(request):
 
         DBSession.add(attribute_definition)
         DBSession.flush()
+        catalog.invalidate_after_commit()
 
     except ValueError as e:
         raise ValidationError(str(e))
@@ -1,5 +1,6 @@
 import logging
 from cornice import Service
+from pyramid.httpexceptions import HTTPNotModified
 from modmod.exc import ValidationError
 
 from ..models import (
@@ -8,6 +9,8 @@ from ..models import (
     OiceFactory,
     Block,
     BlockFactory,
+    BlockTombstoneQuery,
+    OiceRevisionQuery,
 )
 
 from . import log_block_message, check_is_language_valid
@@ -23,6 +26,12 @@ block_list = \
         renderer='json',
         factory=OiceFactory,
         traverse='/{oice_id}')
+block_delta = \
+    Service(name='block_delta',
+        path='oice/{oice_id}/blocks/delta',
+        renderer='json',
+        factory=OiceFactory,
+        traverse='/{oice_id}')
 block = \
     Service(name='block',
         path='block/{block_id}',
@@ -55,24 +64,28 @@ def read_blocks(request):
             .filter(
                 Block.oice_id == request_oice_id,
                 Block.id >= min_block_id) \
-            .order_by(Block.position) \
+            .order_by(Block.position, Block.id) \
             .first()
     else:
         first_block = DBSession.query(Block.position) \
             .filter(Block.oice_id == request_oice_id) \
-            .order_by(Block.position) \
+            .order_by(Block.position, Block.id) \
             .first()
 
+    # Starting point for the delta of later changes
+    revision = OiceRevisionQuery(DBSession).get_revision(request.context.id)
+
     if first_block is None:
         return {
             "code": 200,
+            "revision": revision,
             "blocks": []
         }
 
     blocks = DBSession.query(Block) \
         .filter(Block.oice_id == request_oice_id) \
         .filter(Block.position >= first_block.position) \
-        .order_by(Block.position) \
+        .order_by(Block.position, Block.id) \
         .limit(count) \
         .all()
 
@@ -87,56 +100,121 @@ def read_blocks(request):
 
     return {
         "code": 200,
+        "revision": revision,
         "blocks": serialized
     }
 
 
+@block_delta.get(permission='get')
+def read_block_delta(request):
+    """Blocks created, changed or moved and ids of blocks deleted since a revision
+
+    Attributes refer to their definition by id, the definitions of the
+    returned blocks are sent once. Blocks are to be ordered by position.
+    """
+    oice = request.context
+    query_language = request.params.get('language')
+    query_language = check_is_language_valid(query_language) if query_language else oice.story.language
+    try:
+        since = int(request.params.get('since', 0))
+    except ValueError:
+        raise ValidationError('ERR_BLOCK_DELTA_INVALID_REVISION')
+
+    revision = OiceRevisionQuery(DBSession).get_revision(oice.id)
+    etag = '%d-%d-%d-%s' % (oice.id, revision, since, query_language)
+    if etag in request.if_none_match:
+        return HTTPNotModified(headers={'ETag': '"%s"' % etag})
+
+    blocks = []
+    deleted_block_ids = []
+    if since < revision:
+        blocks = DBSession.query(Block) \
+            .filter(Block.oice_id == oice.id) \
+            .filter(Block.revision > since) \
+            .order_by(Block.position, Block.id) \
+            .all()
+        deleted_block_ids = BlockTombstoneQuery(DBSession).fetch_block_ids_since(oice.id, since)
+
+    definitions = {}
+    for block in blocks:
+        for attribute in block.attributes:
+            definitions[attribute.attribute_definition_id] = attribute.definition
+
+    request.response.etag = etag
+
+    return {
+        "code": 200,
+        "revision": revision,
+        "since": since,
+        "blocks": [block.serialize_delta(query_language) for block in blocks],
+        "deletedBlockIds": deleted_block_ids,
+        "definitions": {
+            definition_id: definition.serialize()
+            for (definition_id, definition) in definitions.items()
+        },
+    }
+
+
 @blocks.put(permission='get')
 def update_blocks(request):
     query_language = request.params.get('language')
+    if query_language:
+        query_language = check_is_language_valid(query_language)
     blocks_to_be_updated = request.json_body
-    serialized = []
-    log_blocks = []
+
+    block_ids = set(a['blockId'] for a in blocks_to_be_updated)
+    blocks = operations.load_blocks(DBSession, block_ids)
+    blocks = {str(block_id): block for (block_id, block) in blocks.items()}
+
+    changes = []
+    old_values = {}
     oice = None
 
     for a in blocks_to_be_updated:
-        block_id = a['blockId']
-        block = DBSession.query(Block) \
-                                    .filter(Block.id == block_id) \
-                                    .first()
+        block = blocks.get(str(a['blockId']))
         if block:
             if not oice:
                 oice = block.oice
 
             # get value before change; for logging
-            attrs = {}
-            for attr in block.attributes:
-                attrs[attr.attribute_definition.attribute_name] = attr.serialized_value
-
-            query_language = check_is_language_valid(query_language) if query_language else block.oice.story.language
-            operations.update_block_attributes(DBSession, block, a['attributes'], query_language)
-            block_serialize = block.serialize(query_language)
-            serialized.append(block_serialize)
-
-            # log data for updating blocks
-            log_block = {
-                'blockId': block_id,
-                'change': [],
-                'macroId': block.macro_id,
-                'macroName': block.macro.name,
-                'macroTagname': block.macro.tagname,
-            }
-            for attr in block.attributes:
-                attr_name = attr.attribute_definition.attribute_name
-                old_value = attrs[attr_name] if attr_name in attrs else None
-                new_value = attr.value
-                if old_value != new_value:
-                    log_block['change'].append({
-                        'whichFieldChange': attr_name,
-                        'beforeChange': old_value,
-                        'afterChange': new_value,
-                    })
-            log_blocks.append(log_block)
+            if block.id not in old_values:
+                old_values[block.id] = {
+                    attr.definition.attribute_name: attr.serialized_value
+                    for attr in block.attributes
+                }
+
+            language = query_language or block.oice.story.language
+            changes.append((block, a['attributes'], language))
+
+    operations.update_blocks_attributes(DBSession, changes)
+    blocks = operations.load_blocks(DBSession, old_values.keys(), refresh=True)
+
+    serialized = []
+    log_blocks = []
+    for (changed_block, _, language) in changes:
+        block = blocks[changed_block.id]
+        serialized.append(block.serialize(language))
+
+        # log data for updating blocks
+        attrs = old_values[block.id]
+        log_block = {
+            'blockId': block.id,
+            'change': [],
+            'macroId': block.macro_id,
+            'macroName': block.macro_entry.name,
+            'macroTagname': block.macro_entry.tagname,
+        }
+        for attr in block.attributes:
+            attr_name = attr.definition.attribute_name
+            old_value = attrs[attr_name] if attr_name in attrs else None
+            new_value = attr.value
+            if old_value != new_value:
+                log_block['change'].append({
+                    'whichFieldChange': attr_name,
+                    'beforeChange': old_value,
+                    'afterChange': new_value,
+                })
+        log_blocks.append(log_block)
 
     if log_blocks:
         log_dict = {
@@ -200,7 +278,7 @@ def add_block(request):
     # Add attributes in log
     attrs = {}
     for attr in block.attributes:
-        attrs[attr.attribute_definition.attribute_name] = attr.value
+        attrs[attr.definition.attribute_name] = attr.value
     log_dict.update(attrs)
     log_dict = set_basic_info_log(request, log_dict)
     log_block_message(log_dict, request.authenticated_userid, oice)
@@ -231,8 +309,8 @@ def move_block(request):
         'action': 'changeOrder',
         'blockId': block.id,
         'macroId': block.macro_id,
-        'macroName': block.macro.name,
-        'macroTagname': block.macro.tagname,
+        'macroName': block.macro_entry.name,
+        'macroTagname': block.macro_entry.tagname,
         'parentId': serialized['parentId'],
     }
     log_dict = set_basic_info_log(request, log_dict)
@@ -268,8 +346,8 @@ def delete_block(request):
         'action': 'deleteBlock',
         'blockId': block.id,
         'macroId': block.macro_id,
-        'macroName': block.macro.name,
-        'macroTagname': block.macro.tagname,
+        'macroName': block.macro_entry.name,
+        'macroTagname': block.macro_entry.tagname,
     }
     log_dict = set_basic_info_log(request, log_dict)
     log_block_message(log_dict, request.authenticated_userid, block.oice)
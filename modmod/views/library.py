@@ -1,5 +1,4 @@
 from pyramid.response import FileResponse
-import pyramid_safile
 import logging
 import transaction
 import json
@@ -23,6 +22,7 @@ from ..models import (
     PriceTierQuery,
 )
 from ..operations import library as operations
+from ..operations.blob_store import BlobStore
 
 log = logging.getLogger(__name__)
 
@@ -169,10 +169,9 @@ def add_library(request):
 
         if 'coverStorage' in request.POST:
             cover_storage = request.POST['coverStorage']
-            factory = pyramid_safile.get_factory()
             extension = os.path.splitext(cover_storage.filename)[1]
             filename = 'cover_storage' + extension
-            handle = factory.create_handle(filename, cover_storage.file)
+            handle = BlobStore(DBSession).store(filename, cover_storage.file)
             library.import_handle(handle)
 
         user.libraries.append(library)
@@ -231,10 +230,9 @@ def update_library(request):
 
         if 'coverStorage' in request.POST:
             cover_storage = request.POST['coverStorage']
-            factory = pyramid_safile.get_factory()
             extension = os.path.splitext(cover_storage.filename)[1]
             filename = 'cover_storage' + extension
-            handle = factory.create_handle(filename, cover_storage.file)
+            handle = BlobStore(DBSession).replace(library.cover_storage, filename, cover_storage.file)
             library.import_handle(handle)
 
         DBSession.add(library)
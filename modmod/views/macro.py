@@ -8,6 +8,7 @@ from ..models import (
     Macro,
     MacroFactory,
     MacroQuery,
+    catalog,
 )
 
 log = logging.getLogger(__name__)
@@ -54,6 +55,7 @@ def add_macro(request):
     else:
         DBSession.add(macro)
         DBSession.flush()
+        catalog.invalidate_after_commit()
 
         return {
             'code': 200,
@@ -96,6 +98,7 @@ def update_macro(request):
 
     else:
         DBSession.add(macro)
+        catalog.invalidate_after_commit()
 
         return {
             'code': 200,
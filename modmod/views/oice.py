@@ -2,6 +2,7 @@ from cornice import Service
 
 import io
 import os.path
+import tempfile
 import transaction
 import json
 import cgi
@@ -42,13 +43,14 @@ from ..models import (
 
 from ..operations.script_validator import ScriptValidator
 from ..operations.image_handler import ComposeOgImage, ComposeCoverImage
-from ..operations.worker import ExportWorker, ImportOiceWorker, KSBuildWorker
+from ..operations.worker import ExportWorker, ImportOiceWorker, KSBuildWorker, get_scheduler
 from ..operations.credit import get_oice_credit
 from ..operations.script_export_default import OICE_INTERACTION_SCRIPT
 from ..config import (
     get_oice_view_url,
     get_oice_preview_url,
     get_oice_communication_url,
+    get_o2_upload_spool_dir,
 )
 from . import (
     set_basic_info_oice_log,
@@ -141,6 +143,12 @@ oice_build = Service(name='oice_build',
 oice_build_all = Service(name='oice_build_all',
                        path='oice/buildall',
                        renderer='json')
+oice_build_stats = Service(name='oice_build_stats',
+                         path='oice/build/stats',
+                         renderer='json')
+oice_build_batch = Service(name='oice_build_batch',
+                         path='oice/build/batch/{batch_id}',
+                         renderer='json')
 oice_preview = Service(name='oice_preview',
                    path='oice/{oice_id}/preview',
                    renderer='json',
@@ -507,15 +515,20 @@ def import_oice(request):
     job_id = uuid.uuid4().hex
     language = fetch_oice_query_language(request, oice)
 
+    # Spooled to a file read by the worker, whatever the size of the script
+    spool = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=get_o2_upload_spool_dir(),
+                                        prefix='import-', suffix='.txt', delete=False)
     try:
-        text_wrapper = io.TextIOWrapper(script.file, encoding='utf-8-sig')
-        script_text = text_wrapper.read()
-        # handle Windows text file
-        script_text = script_text.replace('\r', '')
+        with spool:
+            text_wrapper = io.TextIOWrapper(script.file, encoding='utf-8-sig')
+            for line in text_wrapper:
+                # handle Windows text file
+                spool.write(line.replace('\r', ''))
     except Exception as error:
+        os.remove(spool.name)
         raise ValidationError('ERR_IMPORT_SCRIPT_FILE_CANNOT_OPEN')
 
-    worker = ImportOiceWorker(user_email, job_id, oice_id, script_text, language)
+    worker = ImportOiceWorker(user_email, job_id, oice_id, spool.name, language)
     worker.run()
 
     return {
@@ -607,6 +620,34 @@ def build_all_oice(request):
     }
 
 
+@oice_build_stats.get(permission='admin_set')
+def get_build_stats(request):
+    return {
+        'code': 200,
+        'lanes': get_scheduler().stats(),
+    }
+
+
+@oice_build_batch.get(permission='admin_set')
+def get_build_batch(request):
+    batch_id = request.matchdict['batch_id']
+    return {
+        'code': 200,
+        'batch': get_scheduler().batch_progress(batch_id),
+    }
+
+
+@oice_build_batch.delete(permission='admin_set')
+def cancel_build_batch(request):
+    batch_id = request.matchdict['batch_id']
+    canceled_count = get_scheduler().cancel_batch(batch_id)
+    return {
+        'code': 200,
+        'canceledCount': canceled_count,
+        'batch': get_scheduler().batch_progress(batch_id),
+    }
+
+
 @oice_preview.get()
 def preview_oice(request):
 
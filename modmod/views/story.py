@@ -2,7 +2,6 @@ import json
 import datetime
 import os.path
 import uuid
-import pyramid_safile
 import logging
 from pyramid.httpexceptions import HTTPForbidden
 from cornice import Service
@@ -43,6 +42,7 @@ from ..config import (
 )
 from ..operations.script_validator import ScriptValidator
 from ..operations.credit import get_story_credit
+from ..operations.blob_store import BlobStore
 from ..operations.image_handler import ComposeOgImage
 from ..operations.worker import KSBuildWorker
 from ..operations.block import count_words_of_block
@@ -203,6 +203,10 @@ def add_story(request):
         raise ValidationError(str(e))
 
 
+def compose_og_image(handle):
+    ComposeOgImage(handle.dst).run()
+
+
 @story_id.post(permission='get')
 def update_story(request):
     story_id = request.matchdict['story_id']
@@ -229,35 +233,31 @@ def update_story(request):
 
         if 'coverStorage' in request.POST:
             cover_storage = request.POST['coverStorage']
-            factory = pyramid_safile.get_factory()
             extension = os.path.splitext(cover_storage.filename)[1]
             filename = 'cover_storage' + extension
-            handle = factory.create_handle(filename, cover_storage.file)
+            handle = BlobStore(DBSession).replace(story.get_cover_storage(query_language),
+                                                  filename, cover_storage.file)
             story.import_handle(handle, query_language)
 
         if 'titleLogo' in request.POST:
             title_logo = request.POST['titleLogo']
-            factory = pyramid_safile.get_factory()
             extension = os.path.splitext(title_logo.filename)[1]
             filename = 'title_logo' + extension
-            handle = factory.create_handle(filename, title_logo.file)
+            handle = BlobStore(DBSession).replace(story.title_logo, filename, title_logo.file)
             story.import_title_logo_handle(handle)
 
         if 'heroImage' in request.POST:
             hero_image = request.POST['heroImage']
-            factory = pyramid_safile.get_factory()
             extension = os.path.splitext(hero_image.filename)[1]
             filename = 'hero_image' + extension
-            handle = factory.create_handle(filename, hero_image.file)
+            handle = BlobStore(DBSession).replace(story.hero_image, filename, hero_image.file)
             story.import_hero_image_handle(handle)
         if 'ogImage' in request.POST:
             og_image = request.POST['ogImage']
-            factory = pyramid_safile.get_factory()
             extension = os.path.splitext(og_image.filename)[1]
             filename = 'og_image.jpg'
-            handle = factory.create_handle(filename, og_image.file)
-            ogImageHandler = ComposeOgImage(handle.dst)
-            ogImageHandler.run()
+            handle = BlobStore(DBSession).replace(story.get_og_image(query_language), filename,
+                                                  og_image.file, compose_og_image)
             story.import_og_image_handle(handle, query_language)
 
         DBSession.add(story)
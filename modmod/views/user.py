@@ -17,7 +17,6 @@ from pyramid.security import authenticated_userid
 from pyramid.security import forget
 from pyramid.security import remember
 from pyramid.response import Response
-import pyramid_safile
 from io import BytesIO
 from modmod.exc import ValidationError
 from firebase_admin import auth
@@ -36,6 +35,7 @@ from ..models import (
     Oice,
     LibraryQuery
 )
+from ..operations.blob_store import BlobStore
 from ..operations.story import fork_story
 from ..operations.oice import fork_oice
 from ..operations.library import create_user_public_library
@@ -221,8 +221,7 @@ def login_user(request):
     if photo_url and user.avatar_storage is None:
         r = requests.get(photo_url)
         avatar = BytesIO(r.content)
-        factory = pyramid_safile.get_factory()
-        handle = factory.create_handle('avatar.png', avatar)
+        handle = BlobStore(DBSession).store('avatar.png', avatar)
         user.import_handle(handle)
 
     language = request.json_body.get('language', None)
@@ -410,10 +409,9 @@ def update_profile(request):
 
         if 'avatar' in request.POST:
             avatar_file = request.POST['avatar']
-            factory = pyramid_safile.get_factory()
             extension = os.path.splitext(avatar_file.filename)[1]
             filename = 'avatar' + extension
-            handle = factory.create_handle(filename, avatar_file.file)
+            handle = BlobStore(DBSession).replace(user.avatar_storage, filename, avatar_file.file)
 
             log_dict['change'].append({
                     'whichFieldChange': 'avatar',
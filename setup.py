@@ -43,5 +43,10 @@ setup(name='modmod',
       [console_scripts]
       initialize_modmod_db = modmod.scripts.initializedb:main
       modmod_load_dummy = modmod.scripts.load_dummy:main
+      modmod_backfill_asset_metadata = modmod.scripts.backfill_asset_metadata:main
+      modmod_benchmark = modmod.scripts.benchmark:main
+      modmod_rebuild_word_counts = modmod.scripts.rebuild_word_counts:main
+      modmod_worker = modmod.scripts.worker:main
+      modmod_collect_storage_blobs = modmod.scripts.collect_storage_blobs:main
       """,
       )